@@ -0,0 +1,316 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from file_cache import get_file_cache, CACHE_DIR_NAME
+from jobs import JobExecutor
+from operations import validate_file, find_similar_columns, merge_files, merge_to_file
+from staging import stage_files
+from tracing import span
+from writers import write_frame
+
+try:
+    import yaml
+except ImportError:  # JSON specs only
+    yaml = None
+
+# Headless batch runs. A spec file lists merge jobs; each one stages its source folder, picks a
+# key column in every file that has no override (the best-scoring column, as the wizard
+# suggests), merges and writes the output, with no Tk anywhere. Jobs run in parallel on a
+# JobExecutor, and a memory budget shared by all jobs holds a job back until its estimated
+# footprint fits; a job larger than the whole budget merges out of core within it. Under a budget
+# a job's parsed-file cache keeps nothing in memory while the job runs, since the budget does not
+# account for it.
+# Scoring workers are spawned rather than forked from a process with job threads running.
+#
+#   python batch.py jobs.yaml --workers 4 --memory-budget 8G --report report.json
+#
+# A spec is one job, a list of jobs or {"jobs": [...], "defaults": {...}}. A job:
+#
+#   name: weekly                       (defaults to its position)
+#   source: /data/weekly               folder of .csv/.xlsx files
+#   master_file: master.csv
+#   key_column: id                     a list is a composite key; it needs key_columns for every file
+#   key_columns: {other.csv: customer_id}   per-file overrides
+#   files: [master.csv, other.csv]     default: every data file in the folder
+#   output: /out/weekly.csv
+#   format: csv | xlsx | parquet       default: from the output's extension
+#   how: inner | left | outer          default: inner
+#   normalize: trim|numeric|casefold   key normalization for scoring only, see key_normalization.py;
+#                                      the merge still matches the raw key values
+#
+# The report has one entry per job: status (done/failed), error, start time, total seconds and
+# seconds per stage, output rows, bytes and write throughput, the key column used for every file
+# and the files skipped because no key column was found in them.
+
+OUTPUT_FORMATS = ('csv', 'xlsx', 'parquet')
+JOB_FIELDS = ('name', 'source', 'master_file', 'key_column', 'key_columns', 'files', 'output', 'format', 'how', 'normalize')
+REQUIRED_FIELDS = ('source', 'master_file', 'key_column', 'output')
+MEMORY_PER_SOURCE_BYTE = {'.csv': 5, '.xlsx': 20}  # rough in-memory size of a parsed file per byte on disk
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(text):
+    # "512M", "8G", "1.5G" or a plain number of bytes
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Not a size: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def load_spec(path):
+    # The jobs of a spec file, with defaults applied and every job checked
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("YAML job specs need PyYAML; install it or use JSON")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    defaults = {}
+    if isinstance(spec, dict) and 'jobs' in spec:
+        defaults = spec.get('defaults') or {}
+        spec = spec['jobs']
+    elif isinstance(spec, dict):
+        spec = [spec]
+    if not isinstance(spec, list) or not spec:
+        raise ValueError(f"No jobs in {path}")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for i, job in enumerate(spec):
+        job = {**defaults, **job}
+        unknown = set(job) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown job settings in job {i}: {', '.join(sorted(unknown))}")
+        missing = [field for field in REQUIRED_FIELDS if not job.get(field)]
+        if missing:
+            raise ValueError(f"Job {job.get('name', i)} is missing: {', '.join(missing)}")
+        job.setdefault('name', str(i))
+        # Relative paths are relative to the spec, so a spec works from any directory (e.g. cron's)
+        job['source'] = os.path.join(base_dir, os.path.expanduser(job['source']))
+        job['output'] = os.path.join(base_dir, os.path.expanduser(job['output']))
+        job['format'] = job.get('format') or os.path.splitext(job['output'])[1].lstrip('.').lower()
+        if job['format'] not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format for job {job['name']}: {job['format']}")
+        job.setdefault('how', 'inner')
+        job['key_columns'] = {filename: tuple(column) if isinstance(column, list) else column
+                              for filename, column in (job.get('key_columns') or {}).items()}
+        if isinstance(job['key_column'], list):
+            job['key_column'] = tuple(job['key_column'])  # a composite key
+        jobs.append(job)
+
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names must be unique")
+    return jobs
+
+
+def estimate_memory(job):
+    # Bytes a job is expected to hold at its peak: its parsed inputs plus the merged result
+    total = 0
+    for filename in _source_files(job):
+        factor = MEMORY_PER_SOURCE_BYTE.get(os.path.splitext(filename)[1].lower(), 5)
+        total += os.path.getsize(os.path.join(job['source'], filename)) * factor
+    return 2 * total
+
+
+def _source_files(job):
+    files = [name for name in sorted(os.listdir(job['source']))
+             if not name.startswith('.') and validate_file(name.lower()) and os.path.isfile(os.path.join(job['source'], name))]
+    if job.get('files'):
+        missing = [name for name in job['files'] if name not in files]
+        if missing:
+            raise ValueError(f"Files not found in {job['source']}: {', '.join(missing)}")
+        files = [name for name in files if name in job['files']]
+    return files
+
+
+class MemoryBudget:
+    # Shared by all jobs: acquire(n) blocks until n bytes are free. A request larger than the
+    # whole budget is granted the whole budget once nothing else holds any of it.
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount):
+        amount = min(amount, self.total)
+        with self._condition:
+            self._condition.wait_for(lambda: self.used + amount <= self.total)
+            self.used += amount
+        return amount
+
+    def release(self, amount):
+        with self._condition:
+            self.used -= amount
+            self._condition.notify_all()
+
+
+def run_job(job, temp_root, budget=None, score_workers=None):
+    # Run one job and return its report entry; errors are reported, not raised
+    report = {'name': job['name'], 'status': 'running', 'error': None, 'output': job['output'],
+              'started': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'seconds': None,
+              'stages': {}, 'rows': None, 'bytes_written': None, 'write_rows_per_second': None, 'key_columns': None,
+              'skipped': [], 'memory_estimate': None, 'out_of_core': False}
+    started = time.perf_counter()
+    clock = [started]
+    granted = 0
+
+    def stage(name):
+        # Seconds since the previous stage ended
+        now = time.perf_counter()
+        report['stages'][name] = now - clock[0]
+        clock[0] = now
+
+    cache = None
+    cache_memory_bytes = None
+
+    try:
+        with span('batch_job', job=job['name']) as job_span:
+            if isinstance(job['key_column'], tuple):
+                # Scoring compares single columns, so a composite key needs every file's key given
+                unkeyed = [name for name in _source_files(job) if name != job['master_file'] and name not in job['key_columns']]
+                if unkeyed:
+                    raise ValueError(f"A composite key_column needs key_columns for every other file; missing: {', '.join(unkeyed)}")
+            estimate = report['memory_estimate'] = estimate_memory(job)
+            if budget is not None:
+                granted = budget.acquire(estimate)
+                report['out_of_core'] = estimate > budget.total
+                stage('wait')
+
+            # Each job stages into its own directory, so reruns restage only changed files
+            temp_dir = os.path.join(temp_root, re.sub(r'[^\w.-]+', '_', job['name']))
+            if budget is not None:
+                cache = get_file_cache(os.path.join(temp_dir, CACHE_DIR_NAME))
+                cache_memory_bytes, cache.max_memory_bytes = cache.max_memory_bytes, 0
+            filenames, _ = stage_files(job['source'], temp_dir)
+            files = [name for name in _source_files(job) if name in filenames]
+            if job['master_file'] not in files:
+                raise ValueError(f"Master file {job['master_file']} not found in {job['source']}")
+            stage('stage')
+
+            key_columns = {job['master_file']: job['key_column']}
+            to_score = [name for name in files if name != job['master_file'] and name not in job['key_columns']]
+            if to_score:
+                results, _ = find_similar_columns(to_score, temp_dir, job['master_file'], job['key_column'],
+                                                  max_workers=score_workers, normalize=job.get('normalize'),
+                                                  mp_context=multiprocessing.get_context('spawn'))
+                key_columns.update(dict(results))
+            for name in files:
+                if name in job['key_columns']:
+                    key_columns[name] = job['key_columns'][name]
+            # The master leads the merge; a file left without a key column is reported, not merged
+            report['skipped'] = [name for name in files if key_columns.get(name) is None]
+            key_columns = {job['master_file']: job['key_column'],
+                           **{name: key_columns[name] for name in files
+                              if name != job['master_file'] and key_columns.get(name) is not None}}
+            report['key_columns'] = {name: list(column) if isinstance(column, tuple) else column for name, column in key_columns.items()}
+            stage('score')
+
+            # The writers replace the output only once it is complete, so a failed run leaves the last one intact
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+            if report['out_of_core']:
+                # Partitions are written as the external join produces them
+                written = merge_to_file(list(key_columns), temp_dir, key_columns, job['output'], how=job['how'],
+                                        output_key=job['key_column'], memory_budget=granted // 2, format=job['format'])
+                stage('merge_write')
+            else:
+                merged = merge_files(list(key_columns), temp_dir, key_columns, how=job['how'], output_key=job['key_column'])
+                stage('merge')
+                written = write_frame(merged, job['output'], job['format'])
+                del merged
+                stage('write')
+            report['rows'] = written['rows']
+            report['bytes_written'] = written['bytes']
+            report['write_rows_per_second'] = written['rows_per_second']
+            job_span.add(rows=written['rows'])
+        report['status'] = 'done'
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if cache is not None:
+            cache.max_memory_bytes = cache_memory_bytes
+        if granted:
+            budget.release(granted)
+        report['seconds'] = time.perf_counter() - started
+    return report
+
+
+def run_batch(jobs, temp_root, max_workers=2, memory_budget=None, cpu_count=None, on_done=None):
+    # Run jobs max_workers at a time and return their reports in spec order. Scoring processes
+    # share the CPUs: each job gets cpu_count // max_workers of them. on_done(report) is called
+    # as each job finishes.
+    cpu_count = cpu_count or os.cpu_count() or 1
+    score_workers = max(1, cpu_count // max_workers)
+    budget = MemoryBudget(memory_budget) if memory_budget else None
+    executor = JobExecutor(max_workers=max_workers)
+    reports = {}
+    lock = threading.Lock()
+
+    def run(job_handle, job):
+        report = run_job(job, temp_root, budget, score_workers)
+        with lock:
+            reports[job['name']] = report
+            if on_done:
+                on_done(report)
+        return report
+
+    try:
+        handles = [executor.submit(run, job, name=job['name']) for job in jobs]
+        for handle in handles:
+            handle.result()
+    finally:
+        executor.shutdown()
+    return [reports[job['name']] for job in jobs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run merge jobs from a JSON or YAML spec without the GUI.")
+    parser.add_argument('spec')
+    parser.add_argument('--workers', type=int, default=2, help="jobs run at the same time")
+    parser.add_argument('--cpus', type=int, default=None, help="CPUs shared by the jobs' scoring (default: all)")
+    parser.add_argument('--memory-budget', default=None, help="memory shared by all jobs, e.g. 8G")
+    parser.add_argument('--temp-dir', default=os.path.join(os.getcwd(), "temp_files_batch"))
+    parser.add_argument('--report', default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument('--only', action='append', default=None, metavar='NAME', help="run only these jobs (repeatable)")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_spec(args.spec)
+        memory_budget = parse_size(args.memory_budget) if args.memory_budget else None
+    except (OSError, ValueError) as e:
+        print(f"Invalid job spec: {e}", file=sys.stderr)
+        return 2
+    if args.only:
+        jobs = [job for job in jobs if job['name'] in args.only]
+
+    def on_done(report):
+        outcome = f"{report['rows']} rows" if report['status'] == 'done' else report['error']
+        if report['skipped']:
+            outcome += f"; skipped {', '.join(report['skipped'])}"
+        print(f"{report['name']}: {report['status']} in {report['seconds']:.2f}s ({outcome})", file=sys.stderr)
+
+    started = time.perf_counter()
+    reports = run_batch(jobs, args.temp_dir, args.workers, memory_budget, args.cpus, on_done)
+    result = {'spec': os.path.abspath(args.spec), 'seconds': time.perf_counter() - started,
+              'failed': sum(report['status'] != 'done' for report in reports), 'jobs': reports}
+    text = json.dumps(result, indent=2)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
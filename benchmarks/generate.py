@@ -0,0 +1,108 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Deterministic synthetic data folders. The same spec and seed always produce the same data
+# (workbooks differ only in their save timestamps), so timings from different runs and
+# releases measure the code, not the data.
+#
+# The first file is the master: it holds every key once. Every other file draws its keys from
+# the master's keys (overlap) or from keys the master does not have, repeats some of them, and
+# carries filler columns in the requested dtype mix. Every file also has an alternate id
+# (alt_id) derived from the key, so key propagation can be benchmarked against the master.
+
+DESCRIPTION_NAME = ".dataset.json"  # hidden, so staging the folder leaves it behind
+DEFAULT_SPEC = {
+    'files': 6,
+    'rows': 20000,
+    'width': 12,  # filler columns per file, besides the key and alt_id
+    'key_cardinality': 20000,  # distinct keys in the master file
+    'overlap': 0.8,  # share of each other file's keys that occur in the master
+    'duplicate_ratio': 0.1,  # share of each other file's rows that repeat an earlier key
+    'dtype_mix': {'int': 0.4, 'float': 0.3, 'str': 0.2, 'date': 0.1},
+    'key_dtype': 'str',  # 'str' ("K0000123") or 'int'
+    'rename_keys': False,  # other files call the key column "<key>_<n>" instead of the key's name
+    'xlsx_fraction': 0.25,  # share of the other files written as workbooks
+    'key_column': 'id',
+    'seed': 0,
+}
+
+
+def _keys(indices, key_dtype):
+    if key_dtype == 'int':
+        return indices.astype(np.int64)
+    return np.char.add('K', np.char.zfill(indices.astype(str), 7)).astype(object)
+
+
+def _filler(rng, rows, width, dtype_mix):
+    kinds = list(dtype_mix)
+    weights = np.array([dtype_mix[kind] for kind in kinds], dtype=float)
+    counts = np.floor(weights / weights.sum() * width).astype(int)
+    counts[np.argmax(weights)] += width - counts.sum()
+
+    columns = {}
+    for kind, count in zip(kinds, counts):
+        for i in range(count):
+            name = f"{kind}_{i}"
+            if kind == 'int':
+                columns[name] = rng.integers(0, 1000, rows)
+            elif kind == 'float':
+                columns[name] = np.round(rng.normal(100, 25, rows), 3)
+            elif kind == 'str':
+                columns[name] = np.char.add('v', rng.integers(0, 500, rows).astype(str)).astype(object)
+            elif kind == 'date':
+                columns[name] = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1500, rows), unit='D')
+            else:
+                raise ValueError(f"Unsupported column kind in dtype_mix: {kind}")
+    return columns
+
+
+def generate_folder(folder, **spec):
+    # Write the files described by spec (DEFAULT_SPEC overrides) into folder and return a
+    # description: the spec, the master file, key column, file names, rows and bytes.
+    unknown = set(spec) - set(DEFAULT_SPEC)
+    if unknown:
+        raise ValueError(f"Unknown generator settings: {', '.join(sorted(unknown))}")
+    spec = {**DEFAULT_SPEC, **spec}
+    rng = np.random.default_rng(spec['seed'])
+    os.makedirs(folder, exist_ok=True)
+    key_column = spec['key_column']
+    cardinality = spec['key_cardinality']
+
+    files = []
+    n_xlsx = int(round((spec['files'] - 1) * spec['xlsx_fraction']))
+    for n in range(spec['files']):
+        if n == 0:
+            indices = rng.permutation(cardinality)
+            name = "master.csv"
+        else:
+            rows = spec['rows']
+            n_repeat = int(rows * spec['duplicate_ratio'])
+            n_inside = int(round((rows - n_repeat) * spec['overlap']))
+            inside = rng.choice(cardinality, min(n_inside, cardinality), replace=False)
+            # Keys past the master's range never match
+            outside = cardinality + rng.choice(cardinality * 4, rows - n_repeat - len(inside), replace=False)
+            distinct = np.concatenate([inside, outside])
+            indices = np.concatenate([distinct, rng.choice(distinct, n_repeat)]) if len(distinct) else distinct
+            indices = rng.permutation(indices)
+            name = f"data_{n:03d}.{'xlsx' if n > spec['files'] - 1 - n_xlsx else 'csv'}"
+
+        frame = {key_column if n == 0 or not spec['rename_keys'] else f"{key_column}_{n}": _keys(indices, spec['key_dtype']),
+                 'alt_id': indices.astype(np.int64) * 7 + 3}
+        frame.update(_filler(rng, len(indices), spec['width'], spec['dtype_mix']))
+        df = pd.DataFrame(frame)
+
+        path = os.path.join(folder, name)
+        if name.endswith('.xlsx'):
+            df.to_excel(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        files.append({'name': name, 'rows': len(df), 'columns': df.shape[1], 'bytes': os.path.getsize(path)})
+
+    description = {'spec': spec, 'master': files[0]['name'], 'key_column': key_column, 'files': files,
+                   'rows': sum(f['rows'] for f in files), 'bytes': sum(f['bytes'] for f in files)}
+    with open(os.path.join(folder, DESCRIPTION_NAME), 'w', encoding='utf-8') as f:
+        json.dump(description, f, indent=2)
+    return description
@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import tracing
+from benchmarks.generate import DEFAULT_SPEC, generate_folder
+
+# Timed scenarios over a generated folder. Each scenario is timed `repeat` times and then run
+# once more under tracemalloc for its peak Python/NumPy allocation (tracing slows code down,
+# so it never overlaps a timed run). Buffers the C parsers allocate themselves are invisible
+# to tracemalloc, so the process's peak RSS so far is recorded too (process_peak_rss_bytes: the
+# high-water mark of the whole run up to and including the scenario, not the scenario's own).
+# Throughput is over what a scenario actually processed: the whole dataset unless its run
+# returns {'rows', 'bytes'}, as the single-file scenarios and the writers (the output) do.
+# Results go to a JSON file that --compare can diff later.
+#
+#   python -m benchmarks.run --rows 50000 --files 8 --output bench.json
+#   python -m benchmarks.run --output new.json --compare bench.json
+
+
+class _Progress(dict):
+    # Stands in for the ttk.Progressbar copy_files_to_temp updates
+    pass
+
+
+class _Listbox:
+    def __init__(self):
+        self.items = []
+
+    def delete(self, first, last=None):
+        self.items = []
+
+    def insert(self, index, item):
+        self.items.append(item)
+
+
+class _Root:
+    def update_idletasks(self):
+        pass
+
+
+def _clear_cache(temp_dir):
+    from file_cache import get_file_cache, CACHE_DIR_NAME
+    get_file_cache(os.path.join(temp_dir, CACHE_DIR_NAME)).clear()
+
+
+def _scenarios(dataset, source_dir, temp_dir):
+    # name -> (setup, run); setup runs untimed before every repetition
+    import operations
+    from preview import PreviewModel
+
+    master = dataset['master']
+    key_column = dataset['key_column']
+    files = [f['name'] for f in dataset['files']]
+    others = files[1:]
+    sizes = {f['name']: {'rows': f['rows'], 'bytes': f['bytes']} for f in dataset['files']}
+
+    def stage():
+        operations.copy_files_to_temp(source_dir, temp_dir, _Progress(), _Listbox(), _Root())
+
+    def unstage():
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        _clear_cache(temp_dir)
+
+    def load_all():
+        for filename in files:
+            df, error = operations.load_file(os.path.join(temp_dir, filename))
+            if df is None:
+                raise ValueError(error)
+
+    def load_all_compact():
+        for filename in files:
+            df, error = operations.load_file(os.path.join(temp_dir, filename), compact=True, key_columns=[key_column])
+            if df is None:
+                raise ValueError(error)
+
+    def verify():
+        operations.verify_key_column(files, temp_dir, key_column)
+
+    def similar():
+        operations.find_similar_columns(others, temp_dir, master, key_column)
+
+    target = others[0]
+
+    def restage_target():
+        # The target is rewritten by the scenario, so it is staged afresh each time
+        stage()
+        operations.detach_staged_file(os.path.join(temp_dir, target))
+        shutil.copyfile(os.path.join(source_dir, target), os.path.join(temp_dir, target))
+
+    def add_key():
+        operations.add_key_column_by_matching(temp_dir, target, master, 'alt_id', 'alt_id', key_column)
+        return sizes[target]
+
+    def preview():
+        # What setup_treeview does, without Tk: first screen, a sort, a filter, a scroll
+        df, _ = operations.load_file(os.path.join(temp_dir, others[0]))
+        model = PreviewModel(df)
+        model.window(0, 40)
+        model.sort(key_column if key_column in df.columns else df.columns[0])
+        model.window(len(model) // 2, 40)
+        model.set_filter("1")
+        model.window(0, 40)
+        return sizes[others[0]]
+
+    merged = {}
+
+    def merge_all():
+        # Untimed: the write scenarios time only the output
+        stage()
+        if 'df' not in merged:
+            merged['df'] = operations.merge_files(files, temp_dir, key_column, how='outer')
+
+    def write(output_format):
+        from writers import write_frame
+        output_path = os.path.join(os.path.dirname(temp_dir), f"merged.{output_format}")
+        return lambda: write_frame(merged['df'], output_path)
+
+    return {
+        'copy_files_to_temp': (unstage, stage),
+        'load_file_cold': (lambda: (stage(), _clear_cache(temp_dir)), load_all),
+        'load_file_warm': (lambda: (stage(), load_all()), load_all),
+        'load_file_compact_cold': (lambda: (stage(), _clear_cache(temp_dir)), load_all_compact),
+        'verify_key_column': (stage, verify),
+        'find_similar_columns': (lambda: (stage(), load_all()), similar),
+        'add_key_column_by_matching': (restage_target, add_key),
+        'setup_treeview_headless': (lambda: (stage(), load_all()), preview),
+        'write_merged_csv': (merge_all, write('csv')),
+        'write_merged_xlsx': (merge_all, write('xlsx')),
+        'write_merged_parquet': (merge_all, write('parquet')),
+    }
+
+
+def run_benchmarks(dataset, source_dir, work_dir, repeat=3, names=None):
+    temp_dir = os.path.join(work_dir, "temp_files")
+    os.makedirs(temp_dir, exist_ok=True)
+    scenarios = _scenarios(dataset, source_dir, temp_dir)
+    unknown = set(names or ()) - set(scenarios)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    for name, (setup, run) in scenarios.items():
+        if names and name not in names:
+            continue
+        timings = []
+        for _ in range(repeat):
+            setup()
+            started = time.perf_counter()
+            processed = run() or {'rows': dataset['rows'], 'bytes': dataset['bytes']}
+            timings.append(time.perf_counter() - started)
+
+        setup()
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        best = min(timings)
+        results.append({
+            'name': name, 'repeat': repeat, 'wall_seconds': timings, 'best_seconds': best,
+            'median_seconds': statistics.median(timings), 'peak_memory_bytes': peak,
+            'process_peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None,
+            'rows': processed['rows'], 'bytes': processed['bytes'],
+            'rows_per_second': processed['rows'] / best if best else None,
+            'bytes_per_second': processed['bytes'] / best if best else None,
+        })
+        print(f"{name:32s} best {best:8.3f}s  median {statistics.median(timings):8.3f}s  peak {peak / 1024 ** 2:8.1f} MiB")
+    return results
+
+
+def check_external_merge(dataset, source_dir, work_dir):
+    # The out-of-core join must give exactly what the in-memory one does, including when a
+    # small budget leaves some partitions without rows from one of the inputs
+    import operations
+    temp_dir = os.path.join(work_dir, "check_files")
+    os.makedirs(temp_dir, exist_ok=True)
+    operations.stage_files(source_dir, temp_dir)
+    master = dataset['master']
+    key_column = dataset['key_column']
+    other = next(f['name'] for f in dataset['files'][1:] if f['name'].endswith('.csv'))
+    # A few rows only, so most partitions hold nothing from this side
+    operations.load_data_file(os.path.join(temp_dir, other)).head(3).to_csv(os.path.join(temp_dir, "sparse.csv"), index=False)
+
+    mismatches = []
+    for files in ([master, other], [master, "sparse.csv"]):
+        budget = sum(os.path.getsize(os.path.join(temp_dir, filename)) for filename in files) // 16
+        for how in ('inner', 'left', 'outer'):
+            in_memory = operations.merge_files(files, temp_dir, key_column, how=how)
+            external = operations.merge_files(files, temp_dir, key_column, how=how, memory_budget=budget)
+            ok = in_memory.equals(external)
+            print(f"external merge {'+'.join(files):32s} {how:6s} {'ok' if ok else 'MISMATCH'}")
+            if not ok:
+                mismatches.append((files, how))
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    if mismatches:
+        raise ValueError(f"External merge differs from the in-memory merge for: {mismatches}")
+
+
+def _same_rows(a, b):
+    # Equal columns, dtypes and rows, in any row order
+    if list(a.columns) != list(b.columns) or a.dtypes.tolist() != b.dtypes.tolist() or len(a) != len(b):
+        return False
+    return np.array_equal(np.sort(pd.util.hash_pandas_object(a, index=False).to_numpy()),
+                          np.sort(pd.util.hash_pandas_object(b, index=False).to_numpy()))
+
+
+def check_missing_keys(dataset, source_dir, work_dir):
+    # Rows with a missing key match nothing, but left and outer joins keep them as pd.merge does.
+    # The missing keys sit on one side at a time: pd.merge would also pair NaN with NaN, which
+    # the merge deliberately does not.
+    import operations
+    temp_dir = os.path.join(work_dir, "check_missing")
+    os.makedirs(temp_dir, exist_ok=True)
+    operations.stage_files(source_dir, temp_dir)
+    master = dataset['master']
+    key_column = dataset['key_column']
+    other = next(f['name'] for f in dataset['files'][1:] if f['name'].endswith('.csv'))
+
+    mismatches = []
+    for gappy in (master, other):
+        df = operations.load_data_file(os.path.join(temp_dir, gappy))
+        df[key_column] = df[key_column].where(np.arange(len(df)) % 7 != 3)
+        gappy_name = f"missing_{os.path.splitext(gappy)[0]}.csv"
+        df.to_csv(os.path.join(temp_dir, gappy_name), index=False)
+        files = [gappy_name if name == gappy else name for name in (master, other)]
+        left, right = (operations.load_data_file(os.path.join(temp_dir, filename)) for filename in files)
+        budget = sum(os.path.getsize(os.path.join(temp_dir, filename)) for filename in files) // 16
+        for how in ('inner', 'left', 'outer'):
+            merged = operations.merge_files(files, temp_dir, key_column, how=how)
+            external = operations.merge_files(files, temp_dir, key_column, how=how, memory_budget=budget)
+            expected = pd.merge(left, right, on=key_column, how=how)
+            # The merge puts the key first and renames clashing columns its own way
+            expected = expected[[key_column] + [column for column in expected.columns if column != key_column]]
+            expected.columns = merged.columns
+            ok = _same_rows(merged, expected) and _same_rows(external, expected)
+            print(f"missing keys {'+'.join(files):34s} {how:6s} {'ok' if ok else 'MISMATCH'}")
+            if not ok:
+                mismatches.append((files, how))
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    if mismatches:
+        raise ValueError(f"Merge with missing keys differs from pd.merge for: {mismatches}")
+
+
+def compare(results, baseline):
+    # Ratio of median times against an earlier results file (> 1 means slower now)
+    before = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    ratios = {}
+    for scenario in results['scenarios']:
+        old = before.get(scenario['name'])
+        if old and old['median_seconds']:
+            ratios[scenario['name']] = scenario['median_seconds'] / old['median_seconds']
+            print(f"{scenario['name']:32s} {ratios[scenario['name']]:6.2f}x")
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the merge wizard's operations on generated data.")
+    parser.add_argument('--files', type=int, default=DEFAULT_SPEC['files'])
+    parser.add_argument('--rows', type=int, default=DEFAULT_SPEC['rows'])
+    parser.add_argument('--width', type=int, default=DEFAULT_SPEC['width'])
+    parser.add_argument('--key-cardinality', type=int, default=None, help="defaults to --rows")
+    parser.add_argument('--overlap', type=float, default=DEFAULT_SPEC['overlap'])
+    parser.add_argument('--duplicate-ratio', type=float, default=DEFAULT_SPEC['duplicate_ratio'])
+    parser.add_argument('--dtype-mix', default=None, help='JSON, e.g. {"int": 0.5, "str": 0.5}')
+    parser.add_argument('--key-dtype', choices=('str', 'int'), default=DEFAULT_SPEC['key_dtype'])
+    parser.add_argument('--xlsx-fraction', type=float, default=DEFAULT_SPEC['xlsx_fraction'])
+    parser.add_argument('--seed', type=int, default=DEFAULT_SPEC['seed'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', action='append', dest='scenarios', help="run only these (repeatable)")
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--compare', default=None, help="earlier results file to compare against")
+    parser.add_argument('--trace', default=None, help="also write a Chrome trace of the operations' spans here")
+    parser.add_argument('--check', action='store_true', help="first check that out-of-core merges match in-memory ones and pd.merge")
+    args = parser.parse_args(argv)
+
+    spec = {'files': args.files, 'rows': args.rows, 'width': args.width,
+            'key_cardinality': args.key_cardinality or args.rows, 'overlap': args.overlap,
+            'duplicate_ratio': args.duplicate_ratio, 'key_dtype': args.key_dtype,
+            'xlsx_fraction': args.xlsx_fraction, 'seed': args.seed}
+    if args.dtype_mix:
+        spec['dtype_mix'] = json.loads(args.dtype_mix)
+
+    output = os.path.abspath(args.output)
+    trace_path = os.path.abspath(args.trace) if args.trace else None
+    if trace_path:
+        # Spans only; the peak-memory runs already use tracemalloc themselves
+        tracing.enable(memory=False)
+    work_dir = tempfile.mkdtemp(prefix="merger-bench-")
+    cwd = os.getcwd()
+    try:
+        # The operations keep their caches under the working directory, so run inside a scratch one
+        os.chdir(work_dir)
+        source_dir = os.path.join(work_dir, "source")
+        dataset = generate_folder(source_dir, **spec)
+        if args.check:
+            check_external_merge(dataset, source_dir, work_dir)
+            check_missing_keys(dataset, source_dir, work_dir)
+        scenarios = run_benchmarks(dataset, source_dir, work_dir, args.repeat, args.scenarios)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'pandas': pd.__version__, 'numpy': np.__version__},
+        'dataset': {key: dataset[key] for key in ('spec', 'master', 'rows', 'bytes', 'files')},
+        'scenarios': scenarios,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if trace_path:
+        tracing.export_chrome_trace(trace_path)
+        print(tracing.summary_table())
+        print(f"Trace written to {trace_path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
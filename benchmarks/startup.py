@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Startup benchmark. Every measurement runs in a fresh interpreter, since a warm process has its
+# imports cached; the scenarios split a cold start into what happens before the window can be
+# painted and what the lazy start moves off the critical path:
+#
+#   first_paint      imports main.py needs before it shows the window (tkinter, ttkthemes)
+#   app_import       importing ui, i.e. pandas, numpy, pyarrow and the operations
+#   temp_cleanup     clear_temp_directory over a temp directory left by an earlier session
+#   eager_start      all of it in sequence, as main.py --eager does before the first paint
+#
+# -X importtime then breaks app_import down by package and by the project's own modules.
+#
+#   python -m benchmarks.startup --repeat 5 --output startup.json
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STALE_FILES = 200  # stray files the cleanup scenarios have to remove
+
+SCENARIOS = {
+    'first_paint': "import main",
+    'app_import': "import ui",
+    'temp_cleanup': "from operations import clear_temp_directory; import time; t = time.perf_counter(); "
+                    "clear_temp_directory(); print(time.perf_counter() - t)",
+    'eager_start': "from operations import clear_temp_directory; clear_temp_directory(); import ui",
+}
+TIMED_INSIDE = {'temp_cleanup'}  # the statement prints its own time, excluding the imports
+
+
+def _python(statement, work_dir, *flags):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get('PYTHONPATH')])))
+    env.pop('MERGER_TRACE', None)
+    return subprocess.run([sys.executable, *flags, '-c', statement], cwd=work_dir, env=env, capture_output=True, text=True)
+
+
+def _leave_stale_files(work_dir):
+    # What an interrupted session leaves behind: a spill directory and files nothing vouches for
+    spill_dir = os.path.join(work_dir, "temp_files", ".spill", "merge-0")
+    os.makedirs(spill_dir, exist_ok=True)
+    for i in range(STALE_FILES):
+        with open(os.path.join(spill_dir, f"part-{i:05d}.pkl"), 'wb') as f:
+            f.write(os.urandom(4096))
+        with open(os.path.join(work_dir, "temp_files", f"stale_{i}.csv"), 'w', encoding='utf-8') as f:
+            f.write("id\n1\n")
+
+
+def run_scenarios(work_dir, repeat=5, names=None):
+    unknown = set(names or ()) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    results = []
+    for name, statement in SCENARIOS.items():
+        if names and name not in names:
+            continue
+        timings = []
+        error = None
+        for _ in range(repeat):
+            _leave_stale_files(work_dir)
+            started = time.perf_counter()
+            completed = _python(statement, work_dir)
+            elapsed = time.perf_counter() - started
+            if completed.returncode != 0:
+                error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}"
+                break
+            timings.append(float(completed.stdout.strip().splitlines()[-1]) if name in TIMED_INSIDE else elapsed)
+
+        result = {'name': name, 'statement': statement, 'repeat': repeat, 'wall_seconds': timings, 'error': error,
+                  'best_seconds': min(timings) if timings else None,
+                  'median_seconds': statistics.median(timings) if timings else None}
+        results.append(result)
+        if error:
+            print(f"{name:16s} failed: {error}")
+        else:
+            print(f"{name:16s} best {result['best_seconds']:8.3f}s  median {result['median_seconds']:8.3f}s")
+    return results
+
+
+def import_breakdown(work_dir, statement="import ui", top=15):
+    # -X importtime's self times summed per top-level package, plus each project module's
+    # cumulative time (its own imports included)
+    completed = _python(statement, work_dir, '-X', 'importtime')
+    packages = {}
+    project = {}
+    total = 0
+    project_modules = {os.path.splitext(name)[0] for name in os.listdir(PROJECT_ROOT) if name.endswith('.py')}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        module = module.strip()
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        total += int(self_us)
+        if module in project_modules:
+            project[module] = int(cumulative_us) / 1e6
+
+    by_package = sorted(packages.items(), key=lambda item: -item[1])
+    breakdown = {'statement': statement, 'total_seconds': total / 1e6,
+                 'packages': [{'package': package, 'seconds': us / 1e6, 'share': us / total if total else 0.0}
+                              for package, us in by_package[:top]],
+                 'project_modules': dict(sorted(project.items(), key=lambda item: -item[1]))}
+    print(f"\n{statement}: {breakdown['total_seconds']:.3f}s of imports")
+    for row in breakdown['packages']:
+        print(f"  {row['package']:24s} {row['seconds']:8.3f}s  {row['share']:6.1%}")
+    return breakdown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the wizard's cold start and where its import time goes.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenario', action='append', dest='scenarios', help="run only these (repeatable)")
+    parser.add_argument('--top', type=int, default=15, help="packages listed in the import breakdown")
+    parser.add_argument('--output', default="startup_results.json")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    # clear_temp_directory works under the working directory, so run inside a scratch one
+    work_dir = tempfile.mkdtemp(prefix="merger-startup-")
+    try:
+        scenarios = run_scenarios(work_dir, args.repeat, args.scenarios)
+        breakdown = import_breakdown(work_dir, top=args.top)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'scenarios': scenarios,
+        'imports': breakdown,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
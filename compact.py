@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:  # Arrow strings need pyarrow; object strings stay as they are without it
+    STRING_DTYPE = None
+
+# Memory-compact frames. Parsed files hold object strings and 64-bit numbers throughout, which
+# is several times their size on disk. A compact frame keeps key columns and columns with few
+# distinct values as categoricals (small integer codes plus each distinct value once), other
+# text as Arrow strings, integers in the smallest type that holds them and floats as float32
+# when that loses nothing. Numeric key columns are narrowed the same way and then become
+# categoricals too. Hashing, key lookups and value counts then work on the codes.
+
+CATEGORY_MAX_RATIO = 0.5  # distinct values per row at or below which text becomes categorical
+
+
+def _is_text(series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def compact_series(series, as_category=False, max_category_ratio=CATEGORY_MAX_RATIO):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+        return series
+    if as_category and pd.api.types.is_numeric_dtype(dtype) and isinstance(dtype, np.dtype):
+        # Narrowed first, so the categories are stored in the smallest type as well
+        return compact_series(series).astype('category')
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(dtype) and isinstance(dtype, np.dtype):
+        if dtype == np.float64:
+            narrow = series.astype(np.float32)
+            # Only when every value survives the round trip, so results never change
+            if np.array_equal(narrow.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+                return narrow
+        return series
+    if not _is_text(series):
+        return series  # datetimes, timedeltas and extension types are already compact
+
+    strings = STRING_DTYPE is not None and (dtype != object or pd.api.types.infer_dtype(series, skipna=True) == 'string')
+    if as_category or series.nunique(dropna=True) <= max_category_ratio * len(series):
+        if strings:
+            series = series.astype(STRING_DTYPE)
+        return series.astype('category')
+    if strings and dtype != STRING_DTYPE:
+        return series.astype(STRING_DTYPE)
+    return series  # Mixed values (numbers and text) stay objects so they compare as before
+
+
+def compact_frame(df, key_columns=(), max_category_ratio=CATEGORY_MAX_RATIO):
+    # Compact copy of df; key_columns always become categoricals. Values, missing values and
+    # column order are unchanged, only how they are stored.
+    key_columns = set(key_columns or ())
+    compact = df.copy(deep=False)
+    for i, column in enumerate(df.columns):
+        compact.isetitem(i, compact_series(df.iloc[:, i], column in key_columns, max_category_ratio))
+    return compact
+
+
+def frame_nbytes(df):
+    # Bytes held by the frame's values, counting each string object
+    return int(df.memory_usage(index=False, deep=True).sum())
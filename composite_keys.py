@@ -0,0 +1,202 @@
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from operations import load_data_file
+from sketches import canonical_hashes, composite_hashes, profile_column, profile_frame, containment_estimate, jaccard_estimate, _mix
+
+# Composite key discovery. Finds minimal sets of columns whose value tuples are unique in the
+# master file, level by level (Apriori): a set is only tried when every smaller subset is
+# non-unique, so supersets of a key are never tested. Tuples are compared as 64-bit row hashes
+# built from per-column hashes computed once; a random sample of rows rejects most candidates
+# before the full check, and a product of distinct counts below the row count rejects others
+# without hashing at all. The keys found are then lined up with columns of the other files.
+
+DEFAULT_MAX_COLUMNS = 3
+DEFAULT_TIME_LIMIT = 5.0
+DEFAULT_MAX_CANDIDATES = 20000
+SAMPLE_ROWS = 10000
+MIN_CONTAINMENT = 0.5
+MIN_DISTINCT_RATIO = 0.25  # fewest distinct values a matched column may have, relative to the other side
+
+
+def _key_like(series):
+    # Continuous measurements make poor keys; floats only qualify if they hold whole numbers
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna().to_numpy()
+        return bool(len(values)) and bool(np.all(np.mod(values, 1) == 0))
+    return True
+
+
+def find_unique_column_sets(df, columns=None, max_columns=DEFAULT_MAX_COLUMNS, time_limit=DEFAULT_TIME_LIMIT,
+                            max_candidates=DEFAULT_MAX_CANDIDATES, max_null_fraction=0.0, seed=0):
+    # Minimal column sets (tuples, smallest first) whose rows are unique; rows missing a part of
+    # the set are ignored, and sets missing more than max_null_fraction of rows are skipped.
+    # Returns (keys, complete); complete is False when the time or candidate cap cut the search short.
+    n_rows = len(df)
+    columns = [column for column in (df.columns if columns is None else columns) if _key_like(df[column])]
+    if not n_rows or not columns:
+        return [], True
+
+    started = time.perf_counter()
+    nulls = {column: df[column].isna().to_numpy() for column in columns}
+    columns = [column for column in columns if nulls[column].mean() <= max_null_fraction]
+    null_counts = {column: int(nulls[column].sum()) for column in columns}
+    hashes = {}
+    distinct = {}
+    for column in columns:
+        hashes[column] = canonical_hashes(df[column])
+        distinct[column] = len(np.unique(hashes[column][~nulls[column]]))
+    # Most distinct first, so the likeliest keys are tried first within each level
+    columns.sort(key=lambda column: -distinct[column])
+    sample = np.random.default_rng(seed).choice(n_rows, min(n_rows, SAMPLE_ROWS), replace=False)
+
+    def row_hashes(column_set, rows=None):
+        # Same combination as composite_hashes, from the per-column hashes computed above
+        combined = np.zeros(n_rows if rows is None else len(rows), dtype=np.uint64)
+        for column in column_set:
+            part = hashes[column] if rows is None else hashes[column][rows]
+            combined = _mix((combined * np.uint64(0x100000001B3)) ^ part)
+        return combined
+
+    def is_unique(column_set):
+        missing = None
+        n_valid = n_rows
+        if any(null_counts[column] for column in column_set):
+            missing = np.zeros(n_rows, dtype=bool)
+            for column in column_set:
+                missing |= nulls[column]
+            if missing.mean() > max_null_fraction:
+                return None  # Too sparse, and so is every superset
+            n_valid -= int(missing.sum())
+        if np.prod([float(distinct[column]) for column in column_set]) < n_valid:
+            return False
+        rows = sample if missing is None else sample[~missing[sample]]
+        if len(np.unique(row_hashes(column_set, rows))) < len(rows):
+            return False
+        # A hash collision can only make a unique set look duplicated, never the reverse
+        valid = None if missing is None else np.flatnonzero(~missing)
+        return len(np.unique(row_hashes(column_set, valid))) == n_valid
+
+    keys = []
+    tested = 0
+    level = []
+    for column in columns:
+        unique = is_unique((column,))
+        tested += 1
+        if unique:
+            keys.append((column,))
+        elif unique is not None:
+            level.append((column,))
+
+    position = {column: i for i, column in enumerate(columns)}
+    for size in range(2, max_columns + 1):
+        non_unique = set(level)
+        next_level = []
+        # Apriori join: sets sharing all but their last column combine into one candidate
+        by_prefix = {}
+        for column_set in level:
+            by_prefix.setdefault(column_set[:-1], []).append(column_set[-1])
+        candidates = [prefix + tuple(sorted(pair, key=position.get))
+                      for prefix, lasts in by_prefix.items() for pair in itertools.combinations(lasts, 2)]
+        for candidate in candidates:
+            if any(subset not in non_unique for subset in itertools.combinations(candidate, size - 1)):
+                continue  # Contains a key (not minimal) or a subset too sparse to matter
+            if time.perf_counter() - started > time_limit or tested >= max_candidates:
+                return keys, False
+            unique = is_unique(candidate)
+            tested += 1
+            if unique:
+                keys.append(candidate)
+            elif unique is not None:
+                next_level.append(candidate)
+        level = next_level
+        if not level:
+            break
+    return keys, True
+
+
+def _match_columns(master_profiles, key, df, profiles, min_containment):
+    # For each part of the key, the column of df with the same name, or else the one with the
+    # highest Jaccard similarity among columns whose values are mostly contained in the master
+    # column and whose distinct count is comparable to it. Constant and few-valued columns fall
+    # inside almost any domain, so they are never matched; ties go to the earliest column.
+    # Same-name columns are settled first, so none of them can be claimed by another part
+    matched = [column if column in df.columns else None for column in key]
+    for i, column in enumerate(key):
+        if matched[i] is not None:
+            continue
+        master_distinct = master_profiles[column]['distinct']
+        best, best_score = None, None
+        for other, profile in profiles.items():
+            if other in matched or profile['distinct'] < 2:
+                continue
+            if min(profile['distinct'], master_distinct) < MIN_DISTINCT_RATIO * max(profile['distinct'], master_distinct):
+                continue
+            containment = containment_estimate(master_profiles[column], profile)
+            if containment < min_containment:
+                continue
+            score = (jaccard_estimate(master_profiles[column], profile), containment)
+            if best_score is None or score > best_score:
+                best, best_score = other, score
+        if best is None:
+            return None
+        matched[i] = best
+    return tuple(matched)
+
+
+def tuple_containment(master_hashes, df, columns):
+    # Share of df's distinct (complete) key tuples that also occur in the master file
+    complete = df[list(columns)].notna().all(axis=1).to_numpy()
+    hashes = np.unique(composite_hashes(df[complete], columns))
+    if not len(hashes):
+        return 0.0
+    return float(np.isin(hashes, master_hashes, assume_unique=True).mean())
+
+
+def discover_composite_keys(temp_dir, master_key_file, other_files=(), max_columns=DEFAULT_MAX_COLUMNS,
+                            time_limit=DEFAULT_TIME_LIMIT, min_containment=MIN_CONTAINMENT, max_keys=20):
+    # Candidate keys for the master file with, for every other file, the columns that line up
+    # with each part and the share of that file's key tuples found in the master. Keys are
+    # ranked by mean coverage over the other files, then by size.
+    master = load_data_file(os.path.join(temp_dir, master_key_file))
+    keys, complete = find_unique_column_sets(master, max_columns=max_columns, time_limit=time_limit)
+    keys = keys[:max_keys]
+
+    key_columns = sorted({column for key in keys for column in key}, key=list(master.columns).index)
+    master_profiles = {column: profile_column(master[column], keep_hashes=True) for column in key_columns}
+    master_hashes = {}
+
+    results = [{'columns': key, 'files': {}, 'coverage': 0.0} for key in keys]
+    for filename in other_files:
+        df = load_data_file(os.path.join(temp_dir, filename))
+        profiles = profile_frame(df, [column for column in df.columns if _key_like(df[column])])
+        for result in results:
+            key = result['columns']
+            matched = _match_columns(master_profiles, key, df, profiles, min_containment)
+            if matched is None:
+                result['files'][filename] = {'columns': None, 'containment': 0.0}
+                continue
+            if key not in master_hashes:
+                complete_rows = master[list(key)].notna().all(axis=1).to_numpy()
+                master_hashes[key] = np.unique(composite_hashes(master[complete_rows], key))
+            result['files'][filename] = {'columns': matched, 'containment': tuple_containment(master_hashes[key], df, matched)}
+
+    for result in results:
+        if other_files:
+            result['coverage'] = float(np.mean([match['containment'] for match in result['files'].values()]))
+    results.sort(key=lambda result: (-result['coverage'], len(result['columns'])))
+    return results, complete
+
+
+def composite_key_columns(result, master_key_file):
+    # merge_files key_columns for a discovered key: {filename: tuple of columns}
+    key_columns = {master_key_file: tuple(result['columns'])}
+    for filename, match in result['files'].items():
+        if match['columns'] is None:
+            raise ValueError(f"Key {result['columns']} has no matching columns in {filename}")
+        key_columns[filename] = tuple(match['columns'])
+    return key_columns
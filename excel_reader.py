@@ -0,0 +1,155 @@
+import importlib.util
+import os
+import threading
+import time
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# Excel ingestion. Workbooks are parsed with calamine when python-calamine is installed (a
+# Rust parser, many times faster than openpyxl); otherwise sheets are streamed row by row with
+# openpyxl in read-only mode and only the requested columns are converted. Either way the
+# result matches pd.read_excel, and how long each file took to parse is recorded.
+
+EXCEL_ERRORS = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'}
+HAS_CALAMINE = importlib.util.find_spec('python_calamine') is not None
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def default_engine():
+    return 'calamine' if HAS_CALAMINE else 'openpyxl'
+
+
+def list_sheets(file_path):
+    # Sheet names in workbook order, without parsing any cells
+    if HAS_CALAMINE:
+        from python_calamine import CalamineWorkbook
+        return list(CalamineWorkbook.from_path(file_path).sheet_names)
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def unique_header(header):
+    # Name blank and repeated header cells the way pandas does ("Unnamed: 3", "price.1")
+    columns = []
+    counts = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or name == "" else name
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        columns.append(name)
+        counts[name] = count + 1
+    return columns
+
+
+def _convert_cell(value):
+    # Same cell conversion as pandas' openpyxl reader: whole floats become ints, errors NaN
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in EXCEL_ERRORS:
+        return float('nan')
+    return value
+
+
+def _column_positions(columns, usecols):
+    if usecols is None:
+        return list(range(len(columns)))
+    positions = set()
+    for column in usecols:
+        if isinstance(column, int) and column not in columns:
+            if not 0 <= column < len(columns):
+                raise ValueError(f"Column index {column} is out of range")
+            positions.add(column)
+        elif column in columns:
+            positions.add(columns.index(column))
+        else:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {[column]}")
+    return sorted(positions)
+
+
+def _read_openpyxl(file_path, sheet_name=0, usecols=None, nrows=None):
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        sheet.reset_dimensions()  # Saved dimensions are often wrong; read until the rows run out
+        rows = sheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        while header and (header[-1] is None or header[-1] == ""):
+            header.pop()
+        data = []
+        width = len(header)
+        last_with_data = -1
+        for row in rows:
+            if nrows is not None and len(data) >= nrows:
+                break
+            if any(value is not None for value in row):
+                last_with_data = len(data)
+                width = max(width, max(i for i, value in enumerate(row) if value is not None) + 1)
+            data.append(row)
+    finally:
+        workbook.close()
+    data = data[:last_with_data + 1]
+    if not header and not data:
+        return pd.DataFrame()
+
+    # Cells are only converted for the columns that were asked for
+    columns = unique_header(header + [None] * (width - len(header)))
+    positions = _column_positions(columns, usecols)
+    names = [columns[i] for i in positions]
+    data = [[_convert_cell(row[i]) if i < len(row) else "" for i in positions] for row in data]
+    if not data:
+        return pd.DataFrame(columns=names)
+    return TextParser(data, names=names, header=None, skip_blank_lines=False).read()
+
+
+def read_excel(file_path, sheet_name=0, usecols=None, nrows=None, engine=None):
+    # One sheet as a DataFrame (by index or name), or {name: DataFrame} for every sheet when
+    # sheet_name is None. usecols takes column names or positions.
+    if sheet_name is None:
+        return {name: read_excel(file_path, name, usecols, nrows, engine) for name in list_sheets(file_path)}
+
+    engine = engine or default_engine()
+    started = time.perf_counter()
+    if engine == 'calamine':
+        df = pd.read_excel(file_path, sheet_name=sheet_name, usecols=usecols, nrows=nrows, engine='calamine')
+    elif engine == 'openpyxl':
+        df = _read_openpyxl(file_path, sheet_name, usecols, nrows)
+    else:
+        raise ValueError(f"Unsupported Excel engine: {engine}")
+    if nrows is None:
+        _record_timing(file_path, sheet_name, engine, time.perf_counter() - started, df)
+    return df
+
+
+def iter_excel_chunks(file_path, usecols=None, chunksize=100_000, sheet_name=0):
+    # Chunks of a sheet. Workbooks are capped at about a million rows, so the sheet is parsed
+    # once (only usecols) and handed out in slices
+    df = read_excel(file_path, sheet_name=sheet_name, usecols=usecols)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def _record_timing(file_path, sheet_name, engine, seconds, df):
+    with _timings_lock:
+        _timings[(os.path.abspath(file_path), sheet_name)] = {
+            'file': os.path.basename(file_path), 'sheet': sheet_name, 'engine': engine,
+            'seconds': seconds, 'rows': len(df), 'columns': df.shape[1],
+        }
+
+
+def parse_timings():
+    # Latest full parse of every workbook sheet this session, slowest first
+    with _timings_lock:
+        return sorted(_timings.values(), key=lambda timing: -timing['seconds'])
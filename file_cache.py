@@ -0,0 +1,212 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from compact import STRING_DTYPE
+from tracing import span
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # Feather needs pyarrow; fall back to pickle without it
+    feather = None
+
+
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+DEFAULT_MAX_MEMORY_BYTES = 1024 ** 3
+
+
+class ParsedFileCache:
+    # Caches parsed DataFrames keyed on (path, size, mtime, read options).
+    # Parsed copies live in memory and as Feather (or pickle) files under cache_dir;
+    # both tiers evict least recently used entries once over their byte budget.
+    # max_memory_bytes=0 turns the memory tier off, so nothing stays resident between loads.
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (dataframe, nbytes)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # entry file name -> size on disk
+        self._disk_bytes = 0
+        self._current_key = {}  # path -> key of its latest version
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan_disk()
+
+    def _scan_disk(self):
+        # Pick up entries left by an earlier process, oldest access first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def cache_key(self, file_path, **options):
+        stat = os.stat(file_path)
+        raw = repr((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, sorted(options.items())))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def load(self, file_path, reader, **options):
+        # Return the parsed file, calling reader(file_path, **options) only on a miss
+        key = self.cache_key(file_path, **options)
+        path_key = (os.path.abspath(file_path), repr(sorted(options.items())))
+
+        with self._lock:
+            previous = self._current_key.get(path_key)
+            if previous is not None and previous != key:
+                # The file changed on disk; its old parsed copy can never be hit again
+                self._drop(previous)
+            self._current_key[path_key] = key
+
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key][0].copy(deep=False)
+
+        # Partial loads (nrows samples) are quick to re-read and, one entry per sample size,
+        # would pile up on disk; they are kept in memory only
+        persist = options.get('nrows') is None
+        df = None
+        if persist:
+            with span('cache_read', file=os.path.basename(file_path)):
+                df = self._read_disk(key)
+        if df is None:
+            with self._lock:
+                self.misses += 1
+            df = reader(file_path, **options)
+            if persist:
+                with span('cache_write', file=os.path.basename(file_path), rows=len(df)):
+                    self._write_disk(key, df)
+        else:
+            with self._lock:
+                self.hits += 1
+
+        self._remember(key, df)
+        return df.copy(deep=False)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._memory) + [name.split('.')[0] for name in self._disk]:
+                self._drop(key)
+            self._current_key.clear()
+
+    def _remember(self, key, df):
+        # deep=True counts the strings behind object columns, which are most of a text frame's size
+        if self.max_memory_bytes <= 0:
+            return
+        nbytes = int(df.memory_usage(index=False, deep=True).sum())
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (df, nbytes)
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted
+
+    def _drop(self, key):
+        if key in self._memory:
+            _, nbytes = self._memory.pop(key)
+            self._memory_bytes -= nbytes
+        for name in (f"{key}.feather", f"{key}.pkl"):
+            if name in self._disk:
+                self._disk_bytes -= self._disk.pop(name)
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def _read_disk(self, key):
+        for name in (f"{key}.feather", f"{key}.pkl"):
+            path = os.path.join(self.cache_dir, name)
+            with self._lock:
+                if name not in self._disk:
+                    continue
+                self._disk.move_to_end(name)
+            try:
+                if name.endswith('.feather'):
+                    return _restore_missing(feather.read_feather(path))
+                return pd.read_pickle(path)
+            except Exception:
+                # A damaged entry is just a miss
+                with self._lock:
+                    self._drop(key)
+                return None
+        return None
+
+    def _write_disk(self, key, df):
+        name = f"{key}.pkl"
+        path = os.path.join(self.cache_dir, name)
+        if feather is not None and all(isinstance(column, str) for column in df.columns):
+            try:
+                feather.write_feather(df.reset_index(drop=True), os.path.join(self.cache_dir, f"{key}.feather"))
+                name = f"{key}.feather"
+                path = os.path.join(self.cache_dir, name)
+            except Exception:
+                # Mixed-type object columns cannot become Arrow arrays; pickle them instead
+                pass
+        if not name.endswith('.feather'):
+            df.to_pickle(path, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+            self._disk[name] = os.path.getsize(path)
+            self._disk_bytes += self._disk[name]
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                try:
+                    os.remove(os.path.join(self.cache_dir, evicted))
+                except OSError:
+                    pass
+
+
+def _restore_missing(df):
+    # Arrow hands back None for missing strings where the parsers produce NaN, and text
+    # categories as str where compact frames keep them as Arrow strings
+    for column in df.columns[df.dtypes == object]:
+        if df[column].isna().any():
+            df[column] = df[column].where(df[column].notna(), np.nan)
+    if STRING_DTYPE is not None:
+        for i, dtype in enumerate(df.dtypes):
+            if (isinstance(dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(dtype.categories.dtype)
+                    and dtype.categories.dtype != object and dtype.categories.dtype != STRING_DTYPE):
+                values = df.iloc[:, i].array
+                df.isetitem(i, pd.Categorical.from_codes(values.codes, values.categories.astype(STRING_DTYPE), dtype.ordered))
+    return df
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+CACHE_DIR_NAME = ".cache"
+
+
+def get_file_cache(cache_dir=None):
+    # One shared cache per directory, by default temp_files/.cache for the session
+    if cache_dir is None:
+        cache_dir = os.path.join(os.getcwd(), "temp_files", CACHE_DIR_NAME)
+    cache_dir = os.path.abspath(cache_dir)
+    with _caches_lock:
+        if cache_dir not in _caches or not os.path.isdir(cache_dir):
+            _caches[cache_dir] = ParsedFileCache(cache_dir)
+        return _caches[cache_dir]
+
+
+def staging_cache(file_path):
+    # The cache of the staging directory a file lives in, <temp_dir>/.cache: staging keeps it
+    # next to the staged files and clearing the directory removes it with them, wherever the
+    # process runs from
+    return get_file_cache(os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME))
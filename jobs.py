@@ -0,0 +1,139 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Background jobs for long operations. Work runs on a thread pool; progress, partial results,
+# errors and completion come back through a queue that the owner drains with poll() (the Tk
+# loop does this every few milliseconds via attach()), so callbacks always run on the thread
+# that owns the widgets. Headless code can simply wait on job.result().
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, executor, name, group, callbacks):
+        self.name = name
+        self.group = group
+        self.status = 'pending'
+        self.future = None
+        self.superseded = None
+        self._executor = executor
+        self._callbacks = callbacks
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = 'cancelled'
+
+    def check_cancelled(self):
+        # Called by the job's function at convenient points; raising unwinds it cleanly
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.name)
+
+    def wait_superseded(self):
+        # Jobs that share state with the one they superseded (e.g. the same staging directory)
+        # call this first; cancelling only flags the old job, which may still be unwinding. A job
+        # cancelled before it started still links to the one it superseded, so the chain is followed.
+        previous, self.superseded = self.superseded, None
+        while previous is not None:
+            wait([previous.future])
+            previous = previous.superseded
+
+    def report(self, done=None, total=None, message=None, partial=None):
+        self.check_cancelled()
+        self._executor._events.put((self, 'progress', {'done': done, 'total': total, 'message': message, 'partial': partial}))
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class JobExecutor:
+    def __init__(self, max_workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._events = queue.Queue()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, name=None, group=None, on_progress=None, on_result=None, on_error=None, on_cancel=None, **kwargs):
+        # Runs fn(job, *args, **kwargs) in the background. A new job in the same group supersedes
+        # (cancels) the one before it, and late events of a superseded job are dropped.
+        callbacks = {'progress': on_progress, 'result': on_result, 'error': on_error, 'cancelled': on_cancel}
+        job = Job(self, name or getattr(fn, '__name__', 'job'), group, callbacks)
+        with self._lock:
+            if group is not None:
+                previous = self._groups.get(group)
+                if previous is not None:
+                    previous.cancel()
+                    job.superseded = previous
+                self._groups[group] = job
+            job.future = self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        try:
+            job.check_cancelled()
+            value = fn(job, *args, **kwargs)
+            job.check_cancelled()
+        except JobCancelled:
+            job.status = 'cancelled'
+            self._events.put((job, 'cancelled', None))
+            raise
+        except Exception as e:
+            job.status = 'failed'
+            self._events.put((job, 'error', e))
+            raise
+        finally:
+            # Drop the link so a run of superseded jobs is not kept alive
+            job.superseded = None
+        job.status = 'done'
+        self._events.put((job, 'result', value))
+        return value
+
+    def is_current(self, job):
+        return job.group is None or self._groups.get(job.group) is job
+
+    def poll(self, max_events=100):
+        # Dispatch queued events on the calling thread; returns how many were handled
+        handled = 0
+        while handled < max_events:
+            try:
+                job, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind != 'cancelled' and (job.cancelled or not self.is_current(job)):
+                continue
+            callback = job._callbacks.get(kind)
+            if callback is not None:
+                if kind == 'cancelled':
+                    callback()
+                else:
+                    callback(payload)
+            with self._lock:
+                if kind != 'progress' and job.group is not None and self._groups.get(job.group) is job:
+                    del self._groups[job.group]
+        return handled
+
+    def attach(self, root, interval_ms=50):
+        # Keep draining the queue from the Tk event loop
+        def tick():
+            self.poll()
+            root.after(interval_ms, tick)
+        root.after(interval_ms, tick)
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._groups.values():
+                job.cancel()
+
+    def shutdown(self, wait=True):
+        self.cancel_all()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,147 @@
+import heapq
+import math
+import os
+
+import pandas as pd
+
+from operations import build_key_index, lookup_keys, apply_key_index
+from value_index import build_value_index
+
+# Resolves the master key for files that only reach it through other files, e.g.
+# emp_id -(crosswalk A)-> badge -(crosswalk B)-> master key. States are (file, column) pairs
+# whose values we can produce for every target row; a hop looks those values up in a column of
+# another file that holds them (found through the value index) and reads off another column of
+# that file. The master key column itself is the goal. Each hop's id -> value index is built
+# once and kept, and a whole chain is composed into a single id -> key index before it is applied.
+
+DEFAULT_MAX_HOPS = 4
+MIN_CONTAINMENT = 0.5
+
+
+class KeyResolver:
+    def __init__(self, temp_dir, master_key_file, key_column, index=None, min_containment=MIN_CONTAINMENT, max_hops=DEFAULT_MAX_HOPS):
+        self.temp_dir = temp_dir
+        self.goal = (master_key_file, key_column)
+        self.index = index if index is not None else build_value_index(temp_dir)
+        if key_column not in self.index.files.get(master_key_file, {}).get('columns', {}):
+            raise ValueError(f"Key column '{key_column}' not found in the file {master_key_file}")
+        self.min_containment = min_containment
+        self.max_hops = max_hops
+        self._neighbours = {}
+        self._hop_indexes = {}  # (file, from column, to column) -> (file stamp, key index)
+        self._chains = {}  # path -> (file stamps, composed key index)
+
+    def neighbours(self, filename, column):
+        # (file, column, containment) of columns elsewhere holding most of this column's values
+        key = (filename, column)
+        if key not in self._neighbours:
+            self._neighbours[key] = [(other_file, other_column, containment)
+                                     for other_file, other_column, _, containment
+                                     in self.index.query(filename, column, self.min_containment)
+                                     if containment >= self.min_containment]
+        return self._neighbours[key]
+
+    def _hops_from(self, filename, column):
+        # Look the values up in a matching column of another file and read any id-like column there
+        for other_file, lookup_column, containment in self.neighbours(filename, column):
+            if (other_file, lookup_column) == self.goal:
+                yield other_file, lookup_column, lookup_column, containment
+                continue
+            for to_column in self.index.files[other_file]['columns']:
+                if to_column != lookup_column and ((other_file, to_column) == self.goal or self.neighbours(other_file, to_column)):
+                    yield other_file, lookup_column, to_column, containment
+
+    def find_path(self, target_file, target_column=None, prefer='coverage'):
+        # Best chain from the target to the master key: {'column', 'hops', 'coverage'} or None.
+        # prefer='coverage' maximizes the estimated share of rows that resolve (fewest hops on
+        # ties); prefer='hops' takes the shortest chain (best coverage on ties).
+        if prefer not in ('coverage', 'hops'):
+            raise ValueError(f"Unsupported path preference: {prefer}")
+        columns = self.index.files.get(target_file, {}).get('columns', {})
+        starts = [target_column] if target_column is not None else list(columns)
+        starts = [column for column in starts if column in columns]
+
+        def cost(hops, coverage):
+            loss = -math.log(coverage) if coverage > 0 else math.inf
+            return (loss, hops) if prefer == 'coverage' else (hops, loss)
+
+        heap = [(cost(0, 1.0), i, (target_file, column), column, [], 1.0) for i, column in enumerate(starts)]
+        heapq.heapify(heap)
+        settled = set()
+        counter = len(heap)
+        while heap:
+            _, _, state, start, hops, coverage = heapq.heappop(heap)
+            if state == self.goal and hops:
+                return {'column': start, 'hops': hops, 'coverage': coverage}
+            if state in settled or len(hops) >= self.max_hops:
+                continue
+            settled.add(state)
+            for other_file, lookup_column, to_column, containment in self._hops_from(*state):
+                if other_file == target_file or any(hop[0] == other_file for hop in hops):
+                    continue  # A file is used at most once per chain
+                next_hops = hops + [(other_file, lookup_column, to_column)]
+                counter += 1
+                heapq.heappush(heap, (cost(len(next_hops), coverage * containment), counter, (other_file, to_column),
+                                      start, next_hops, coverage * containment))
+        return None
+
+    def _stamp(self, filename):
+        stat = os.stat(os.path.join(self.temp_dir, filename))
+        return stat.st_size, stat.st_mtime_ns
+
+    def hop_index(self, filename, from_column, to_column):
+        key = (filename, from_column, to_column)
+        stamp = self._stamp(filename)
+        cached = self._hop_indexes.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, build_key_index(os.path.join(self.temp_dir, filename), from_column, to_column))
+            self._hop_indexes[key] = cached
+        return cached[1]
+
+    def chain_index(self, hops):
+        # One id -> key index for the whole chain: the first hop's ids with every later hop applied
+        path = tuple(hops)
+        stamps = [self._stamp(hop[0]) for hop in path]
+        cached = self._chains.get(path)
+        if cached is not None and cached[0] == stamps:
+            return cached[1]
+
+        ids, keys = self.hop_index(*path[0])
+        for hop in path[1:]:
+            keys = pd.Series(lookup_keys(self.hop_index(*hop), keys))
+        resolved = keys.notna().to_numpy()
+        chain = (ids[resolved], keys[resolved].reset_index(drop=True))
+        self._chains[path] = (stamps, chain)
+        return chain
+
+
+def resolve_key_columns(temp_dir, target_files, master_key_file, key_column, target_id_columns=None, prefer='coverage',
+                        output='sidecar', output_dir=None, max_hops=DEFAULT_MAX_HOPS, resolver=None):
+    # Add the master key to targets that lack it by chaining identifier mappings across the
+    # staged files. target_id_columns optionally pins the starting column ({filename: column}).
+    # Returns one report per target: the add_key_column_to_files report plus its path and the
+    # estimated coverage, or an error when no chain reaches the master key.
+    resolver = resolver or KeyResolver(temp_dir, master_key_file, key_column, max_hops=max_hops)
+    target_id_columns = target_id_columns or {}
+
+    reports = {}
+    found = {}
+    for filename in target_files:
+        path = resolver.find_path(filename, target_id_columns.get(filename), prefer)
+        if path is None:
+            reports[filename] = {'target': filename, 'rows': 0, 'matched': 0, 'match_rate': 0.0, 'output': None,
+                                 'error': f"No chain of identifier columns links '{filename}' to '{key_column}'.",
+                                 'path': None, 'coverage': 0.0}
+        else:
+            found[filename] = path
+
+    if found:
+        filenames = list(found)
+        applied = apply_key_index(temp_dir, filenames, {filename: found[filename]['column'] for filename in filenames},
+                                  {filename: resolver.chain_index(found[filename]['hops']) for filename in filenames},
+                                  key_column, output, output_dir)
+        for filename, report in zip(filenames, applied):
+            report['path'] = [(filename, found[filename]['column'])] + found[filename]['hops']
+            report['coverage'] = found[filename]['coverage']
+            reports[filename] = report
+    return [reports[filename] for filename in target_files]
@@ -1,11 +1,16 @@
-import tkinter as tk
-import glob
+import sys
+import threading
+from tkinter import ttk, messagebox
 from ttkthemes import ThemedTk
-from ui import DataMatcherApp
-from operations import clear_temp_directory
 
-def main():
-    clear_temp_directory()
+# pandas and everything built on it load only after the window is up: ui (and with it
+# operations and pandas) is imported on a background thread while a placeholder is shown, and
+# the temp directory is cleared on another one. --eager restores the old sequential startup.
+
+def main(lazy=True):
+    if not lazy:
+        from operations import clear_temp_directory
+        clear_temp_directory()
     root = ThemedTk(theme="adapta")
     root.title("Data Matcher Wizard")
     screen_width = root.winfo_screenwidth()
@@ -16,8 +21,43 @@ def main():
     y_position = (screen_height - window_height) // 2  # Center the window
     root.geometry(f"{window_width}x{window_height}+{x_position}+{y_position}")
     root.resizable(True, True)
-    app = DataMatcherApp(root)
+    if not lazy:
+        from ui import DataMatcherApp
+        app = DataMatcherApp(root)
+        root.mainloop()
+        return
+
+    placeholder = ttk.Label(root, text="Loading...")
+    placeholder.pack(expand=True)
+    root.update()  # First paint before anything heavy is imported
+
+    loaded = {}
+
+    def load():
+        try:
+            from ui import DataMatcherApp
+            loaded['app'] = DataMatcherApp
+        except Exception as e:
+            loaded['error'] = e
+
+    threading.Thread(target=load, name="startup-import", daemon=True).start()
+
+    def show_app():
+        # Tk may only be touched from this thread, so the app is built here once ui is loaded
+        if not loaded:
+            root.after(20, show_app)
+            return
+        if 'error' in loaded:
+            messagebox.showerror("Startup Error", str(loaded['error']))
+            root.destroy()
+            return
+        from operations import clear_temp_directory_in_background
+        cleanup = clear_temp_directory_in_background()
+        placeholder.destroy()
+        root.app = loaded['app'](root, temp_cleanup=cleanup)
+
+    root.after(20, show_app)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(lazy="--eager" not in sys.argv[1:])
@@ -1,11 +1,25 @@
+import numpy as np
 import pandas as pd
 import tkinter as tk
 import glob
 import shutil
 import os
-from tkinter import messagebox
+import math
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from tkinter import ttk
-from scipy.stats import wasserstein_distance
+from file_cache import get_file_cache, staging_cache, CACHE_DIR_NAME
+from compact import compact_frame
+from key_normalization import normalize_keys, pipeline_name
+from excel_reader import read_excel
+from staging import stage_files, clean_staging_directory, detach_staged_file
+from preview import PreviewModel, VirtualPreview
+from sketches import canonical_hashes, composite_hashes, profile_column, score_profiles, score_interval
+from streaming import profile_file
+from tracing import span
+from writers import open_writer, write_frame
 
 
 def setup_temp_directory():
@@ -13,37 +27,42 @@ def setup_temp_directory():
     os.makedirs(temp_dir, exist_ok=True)
     return temp_dir
 
-def clear_temp_directory():
-    temp_dir = os.path.join(os.getcwd(), "temp_files")
+def clear_temp_directory(full=False):
+    # By default only what the staging manifest cannot vouch for is removed, so files
+    # staged in an earlier session are reused; full=True empties the directory
+    temp_dir = setup_temp_directory()
+    if not full:
+        clean_staging_directory(temp_dir)
+        return
     for file in os.listdir(temp_dir):
         file_path = os.path.join(temp_dir, file)
-        os.remove(file_path)
+        if os.path.isdir(file_path) and not os.path.islink(file_path):
+            shutil.rmtree(file_path)
+        else:
+            os.remove(file_path)
+
+def clear_temp_directory_in_background(full=False):
+    # clear_temp_directory on a thread, so startup does not wait for it; join() the returned
+    # thread before staging into the directory
+    thread = threading.Thread(target=clear_temp_directory, args=(full,), name="temp-cleanup", daemon=True)
+    thread.start()
+    return thread
 
 def copy_files_to_temp(folder_path, temp_dir, progress, file_listbox, root):
-    files = os.listdir(folder_path)
     progress['value'] = 0
-    progress['maximum'] = len(files)
-
-    # Check if the files are already in the temporary directory
-    existing_files = os.listdir(temp_dir)
-    if set(files) == set(existing_files):
-        # Files are already in the temporary directory, populate the file listbox
-        for i, filename in enumerate(existing_files):
-            file_path = os.path.join(temp_dir, filename)
-            if os.path.isfile(file_path):
-                progress['value'] = i + 1
-                file_listbox.insert(tk.END, filename)
-                root.update_idletasks()
-    else:
-        # Files are not in the temporary directory, copy them from the selected folder
-        for i, filename in enumerate(files):
-            src_path = os.path.join(folder_path, filename)
-            dest_path = os.path.join(temp_dir, filename)
-            if os.path.isfile(src_path):
-                shutil.copy(src_path, dest_path)
-                progress['value'] = i + 1
-                file_listbox.insert(tk.END, filename)
-                root.update_idletasks()
+
+    def update_progress(done, total, filename):
+        progress['maximum'] = max(total, 1)
+        progress['value'] = done
+        root.update_idletasks()
+
+    # Link or copy only files that are new or changed since they were last staged
+    with span('copy_files_to_temp'):
+        filenames, _ = stage_files(folder_path, temp_dir, progress_callback=update_progress)
+        file_listbox.delete(0, tk.END)
+        for filename in filenames:
+            file_listbox.insert(tk.END, filename)
+        root.update_idletasks()
 
     progress['value'] = 0
 
@@ -51,108 +70,170 @@ def validate_file(file_path):
     allowed_extensions = ['.xlsx', '.csv']  # Define the allowed file types
     return any(file_path.endswith(ext) for ext in allowed_extensions)
 
-def load_file(file_path):
-    try:
-        if file_path.endswith('.xlsx'):
-            df = pd.read_excel(file_path)
-        elif file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
+def read_data_file(file_path, compact=False, key_columns=(), **options):
+    # Parse a file based on its extension, bypassing the cache. compact=True returns a
+    # memory-compact frame (see compact.py) with key_columns as categoricals.
+    if not file_path.lower().endswith(('.xlsx', '.csv')):
+        raise ValueError(f"Unsupported file format for {os.path.basename(file_path)}")
+    with span('parse', file=os.path.basename(file_path), bytes=os.path.getsize(file_path)) as parse:
+        if file_path.lower().endswith('.xlsx'):
+            df = read_excel(file_path, **options)
         else:
+            df = pd.read_csv(file_path, **options)
+        parse.add(rows=len(df))
+    if compact:
+        with span('compact', file=os.path.basename(file_path), rows=len(df)):
+            df = compact_frame(df, key_columns)
+    return df
+
+def load_data_file(file_path, cache=None, **options):
+    # Parse a file at most once per session; later loads come from the parsed-file cache of the
+    # staging directory the file is in unless another cache is passed
+    if not validate_file(file_path.lower()):
+        raise ValueError(f"Unsupported file format for {os.path.basename(file_path)}")
+    cache = cache or staging_cache(file_path)
+    # A load that was not served from the cache has a 'parse' span inside it
+    with span('load', file=os.path.basename(file_path)) as load:
+        df = cache.load(file_path, read_data_file, **options)
+        load.add(rows=len(df))
+    return df
+
+def load_file(file_path, usecols=None, sheet=None, compact=False, key_columns=None, cache=None):
+    try:
+        if not validate_file(file_path):
             return None, "Unsupported file format."
-        return df, None
+        options = {}
+        if usecols is not None:
+            # Only the requested columns are parsed (and cached)
+            options['usecols'] = list(usecols)
+        if sheet is not None:
+            # Workbook sheet by name or position; the first sheet otherwise
+            options['sheet_name'] = sheet
+        if compact:
+            # Categorical keys, Arrow strings and narrow numbers; cached apart from the full-size frame
+            options['compact'] = True
+            options['key_columns'] = tuple(key_columns or ())
+        return load_data_file(file_path, cache, **options), None
     except Exception as e:
         return None, str(e)
 
-def setup_treeview(df, treeview):
-    # Clear existing columns and data in treeview
-    treeview.delete(*treeview.get_children())
-    treeview['columns'] = list(df.columns)
-    #print("TreeView columns:", treeview['columns'])
-
-    # Reset the configuration to avoid residual settings
-    for col in treeview['columns']:
-        treeview.heading(col, text=col, anchor='w')
-        treeview.column(col, anchor="w", width=100)
+def _read_normalized_keys(file_path, key_column, pipeline):
+    # From the whole parsed file, which every column of it shares through the cache
+    df = load_data_file(file_path)
+    if key_column not in df.columns:
+        raise ValueError(f"Column '{key_column}' not found in the file {os.path.basename(file_path)}")
+    with span('normalize_keys', file=os.path.basename(file_path), rows=len(df), pipeline=pipeline):
+        return pd.DataFrame({key_column: normalize_keys(df[key_column], pipeline)})
 
-    # Populate treeview with data
-    for index, row in df.iterrows():
-        # The row data must be a tuple in the exact order of the columns
-        treeview.insert("", "end", values=tuple(row[col] for col in df.columns))
+def load_normalized_keys(file_path, key_column, pipeline, cache=None):
+    # One column of a file run through a key normalization pipeline (see key_normalization.py);
+    # cached per file version, column and pipeline like any parsed file
+    cache = cache or staging_cache(file_path)
+    return cache.load(file_path, _read_normalized_keys, key_column=key_column, pipeline=pipeline_name(pipeline))[key_column]
 
-    # Make sure the treeview is updated with new settings
-    treeview.update()
+def setup_treeview(df, treeview):
+    # Only the visible window of rows is ever in the treeview; pages are formatted on scroll
+    with span('preview', rows=len(df)):
+        preview = getattr(treeview, 'virtual_preview', None)
+        if preview is None:
+            preview = VirtualPreview(treeview)
+            treeview.virtual_preview = preview
+        preview.show(PreviewModel(df))
+
+        # Make sure the treeview is updated with new settings
+        treeview.update()
+    return preview
 
 def select_all_files(file_vars):
     for var in file_vars.values():
         var.set(True)
 
 
+def probe_file_schema(file_path, sample_rows=0):
+    # Columns, sample dtypes and any error for one file, without parsing the whole file
+    try:
+        with span('probe', file=os.path.basename(file_path)) as probe:
+            if file_path.lower().endswith('.csv'):
+                df = pd.read_csv(file_path, nrows=sample_rows)
+            elif file_path.lower().endswith('.xlsx'):
+                # Streams just the header row (and a few data rows) of the first sheet
+                df = read_excel(file_path, nrows=sample_rows, engine='openpyxl')
+            else:
+                return {'columns': [], 'dtypes': {}, 'error': "Unsupported file format."}
+            probe.add(rows=len(df))
+    except Exception as e:
+        return {'columns': [], 'dtypes': {}, 'error': str(e)}
+
+    dtypes = {column: str(dtype) for column, dtype in df.dtypes.items()} if sample_rows else {}
+    return {'columns': df.columns.tolist(), 'dtypes': dtypes, 'error': None}
+
+def probe_schemas(file_paths, sample_rows=0, max_workers=None, use_processes=False):
+    # Probe many files concurrently; results are keyed by path in input order
+    file_paths = list(file_paths)
+    if not file_paths:
+        return {}
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    max_workers = max_workers or min(32, len(file_paths), (os.cpu_count() or 1) * 4)
+    with executor_class(max_workers=max_workers) as executor:
+        probes = executor.map(probe_file_schema, file_paths, [sample_rows] * len(file_paths))
+        return dict(zip(file_paths, probes))
+
 def verify_key_column(selected_files, temp_dir, key_column):
     missing_key_files = []
     errors = []
 
-    for filename in selected_files:
-        file_path = os.path.join(temp_dir, filename)
-        try:
-            # Load the file based on its extension
-            if file_path.endswith('.xlsx'):
-                df = pd.read_excel(file_path)
-            else:
-                df = pd.read_csv(file_path)
-
-            # Check if the key column exists in the dataframe
-            if key_column not in df.columns:
-                missing_key_files.append(filename)
+    # Only the header row of each file is needed to find the key column
+    file_paths = [os.path.join(temp_dir, filename) for filename in selected_files]
+    with span('verify', files=len(file_paths)):
+        probes = probe_schemas(file_paths)
 
-        except Exception as e:
+    for filename, file_path in zip(selected_files, file_paths):
+        probe = probes[file_path]
+        if probe['error']:
             # Store error messages in a list to handle later or return
-            errors.append(f"Error loading {filename}: {str(e)}")
+            errors.append(f"Error loading {filename}: {probe['error']}")
             continue
 
+        # Check if the key column exists in the file header
+        if key_column not in probe['columns']:
+            missing_key_files.append(filename)
+
     return missing_key_files, errors
 
 def populate_files(parent_widget):
     temp_dir = "/temp_files"
-    print("Populating files in the temporary directory...")
-    print("Temporary directory:", temp_dir)
     file_pattern = os.path.join(temp_dir, "*")
-    print("File pattern:", file_pattern)
-    files = glob.glob(file_pattern)
-    print("Files found:", files)
+    with span('populate_files', pattern=file_pattern) as populate:
+        files = glob.glob(file_pattern)
+        populate.set(files=len(files))
 
-    file_checkbuttons = {}
-    file_vars = {}
+        file_checkbuttons = {}
+        file_vars = {}
 
-    if not files:
-        label = ttk.Label(parent_widget, text="No Excel files found in the temporary directory.")
-        label.pack(anchor='w', padx=10, pady=2)
-    else:
-        for file_path in files:
-            filename = os.path.basename(file_path)
-            var = tk.BooleanVar()
-            chk = ttk.Checkbutton(parent_widget, text=filename, variable=var)
-            chk.pack(anchor='w', padx=10, pady=2)
-            file_checkbuttons[filename] = chk
-            file_vars[filename] = var
-    print("File population complete.")
+        if not files:
+            label = ttk.Label(parent_widget, text="No Excel files found in the temporary directory.")
+            label.pack(anchor='w', padx=10, pady=2)
+        else:
+            for file_path in files:
+                filename = os.path.basename(file_path)
+                var = tk.BooleanVar()
+                chk = ttk.Checkbutton(parent_widget, text=filename, variable=var)
+                chk.pack(anchor='w', padx=10, pady=2)
+                file_checkbuttons[filename] = chk
+                file_vars[filename] = var
     return file_checkbuttons, file_vars
 
-def add_key_column_by_matching(temp_dir, target_file, source_file, target_id_column, source_id_column, key_column):
+def add_key_column_by_matching(temp_dir, target_file, source_file, target_id_column, source_id_column, key_column, normalize=None):
+    # normalize is an optional key normalization pipeline applied to both identifier columns
     target_path = os.path.join(temp_dir, target_file)
     source_path = os.path.join(temp_dir, source_file)
 
-    # Load data from files based on file extension
-    def load_data(file_path):
-        if file_path.endswith('.xlsx'):
-            return pd.read_excel(file_path)
-        elif file_path.endswith('.csv'):
-            return pd.read_csv(file_path)
-        else:
-            raise ValueError(f"Unsupported file type for {file_path}")
-
     try:
-        df_target = load_data(target_path)
-        df_source = load_data(source_path)
+        df_target = load_data_file(target_path)
+        # The source is only read for two columns, so its header is enough to validate it
+        source_probe = probe_file_schema(source_path)
+        if source_probe['error']:
+            raise ValueError(source_probe['error'])
     except ValueError as e:
         print(f"Error loading data files: {str(e)}")
         raise
@@ -160,26 +241,30 @@ def add_key_column_by_matching(temp_dir, target_file, source_file, target_id_col
     # Validate existence of necessary columns in dataframes
     if target_id_column not in df_target.columns:
         raise ValueError(f"Target identifier column '{target_id_column}' does not exist in target file.")
-    if key_column not in df_source.columns or source_id_column not in df_source.columns:
+    if key_column not in source_probe['columns'] or source_id_column not in source_probe['columns']:
         raise ValueError(f"Source identifier column '{source_id_column}' or key column '{key_column}' does not exist in source file.")
 
-    # Create a mapping from the source dataframe based on the identifier and key columns
-    key_mapping = df_source.dropna(subset=[key_column]).set_index(source_id_column)[key_column].to_dict()
+    # Create a mapping from the source file based on the identifier and key columns; only those
+    # two columns are read, a chunk at a time for large files
+    key_index = build_key_index(source_path, source_id_column, key_column, normalize)
 
     # Map the key column from the source to the target dataframe based on matching identifier columns
-    df_target[key_column] = df_target[target_id_column].map(key_mapping)
+    with span('match_keys', file=target_file, rows=len(df_target)):
+        target_ids = df_target[target_id_column] if normalize is None else load_normalized_keys(target_path, target_id_column, normalize)
+        df_target[key_column] = lookup_keys(key_index, target_ids)
 
-    # Save the updated target dataframe back to the file
+    # Save the updated target dataframe back to the file, streamed so large workbooks are not
+    # built in memory first
     def save_data(df, file_path):
-        if file_path.endswith('.xlsx'):
-            df.to_excel(file_path, index=False)
-        elif file_path.endswith('.csv'):
-            df.to_csv(file_path, index=False)
-        else:
+        if not file_path.endswith(('.xlsx', '.csv')):
             raise ValueError(f"Unsupported file type for {file_path}")
+        write_frame(df, file_path)
 
     try:
-        save_data(df_target, target_path)
+        # Never write through a link into the user's source folder
+        with span('save', file=target_file, rows=len(df_target)):
+            detach_staged_file(target_path)
+            save_data(df_target, target_path)
     except ValueError as e:
         print(f"Error saving updated data to file: {str(e)}")
         raise
@@ -187,59 +272,730 @@ def add_key_column_by_matching(temp_dir, target_file, source_file, target_id_col
     print(f"Key column '{key_column}' added to '{target_file}' based on matching identifier column '{target_id_column}' from '{source_file}'.")
 
 
-def find_similar_columns(selected_files, temp_dir, master_key_file, key_column):
+def build_key_index(source_path, source_id_column, key_column, normalize=None):
+    # The source's id -> key mapping as a hashed index of ids plus the keys in the same order;
+    # a later row wins for a repeated id, and rows without a key or an id are left out.
+    # With a normalize pipeline the index holds normalized ids.
+    span_fields = {} if normalize is None else {'pipeline': pipeline_name(normalize)}
+    with span('key_index', file=os.path.basename(source_path), **span_fields) as index_span:
+        source = load_data_file(source_path, usecols=list(dict.fromkeys([source_id_column, key_column])))
+        keys = source[key_column]
+        if normalize is not None:
+            ids = load_normalized_keys(source_path, source_id_column, normalize)
+        else:
+            ids = source[source_id_column]
+        valid = (ids.notna() & keys.notna()).to_numpy()
+        last = ~ids[valid].duplicated(keep='last').to_numpy()
+        index_span.set(ids=int(last.sum()))
+    return pd.Index(ids[valid][last]), keys[valid][last].reset_index(drop=True)
+
+def lookup_keys(key_index, ids):
+    # Vectorized id -> key lookup; ids without a key get NaN
+    index, keys = key_index
+    if not len(index):
+        positions = np.full(len(ids), -1)
+    elif isinstance(getattr(ids, 'dtype', None), pd.CategoricalDtype):
+        # Categorical ids are looked up once per category and broadcast by code
+        ids = pd.Categorical(ids)
+        category_positions = np.append(index.get_indexer(pd.Index(ids.categories)), -1)
+        positions = category_positions[np.where(ids.codes >= 0, ids.codes, len(category_positions) - 1)]
+    else:
+        positions = index.get_indexer(pd.Index(ids))
+    return keys.reindex(positions).to_numpy()
+
+KEY_SIDECAR_DIR = ".keys"
+
+def _write_key_sidecar(df, output_dir, target_file, key_column):
+    # Columnar sidecar next to (not inside) the target; CSV when Parquet cannot be written
+    os.makedirs(output_dir, exist_ok=True)
+    stem = f"{target_file}.{key_column}"
+    try:
+        path = os.path.join(output_dir, f"{stem}.parquet")
+        df.to_parquet(path, index=False)
+    except (ImportError, ValueError, TypeError):
+        path = os.path.join(output_dir, f"{stem}.csv")
+        df.to_csv(path, index=False)
+    return path
+
+def _propagate_key(temp_dir, target_file, target_id_column, key_index, key_column, output, output_dir, normalize=None):
+    target_path = os.path.join(temp_dir, target_file)
+    report = {'target': target_file, 'rows': 0, 'matched': 0, 'match_rate': 0.0, 'output': None, 'error': None}
+    with span('propagate_key', file=target_file, output=output) as propagate:
+        try:
+            probe = probe_file_schema(target_path)
+            if probe['error']:
+                raise ValueError(probe['error'])
+            if target_id_column not in probe['columns']:
+                raise ValueError(f"Target identifier column '{target_id_column}' does not exist in target file.")
+            if output == 'sidecar':
+                # The sidecar only needs the id column, so nothing else is parsed
+                df_target = load_data_file(target_path, usecols=[target_id_column])
+            else:
+                df_target = load_data_file(target_path)
+
+            target_ids = df_target[target_id_column] if normalize is None else load_normalized_keys(target_path, target_id_column, normalize)
+            keys = lookup_keys(key_index, target_ids)
+            matched = int(pd.notna(keys).sum())
+            report.update(rows=len(df_target), matched=matched, match_rate=matched / len(df_target) if len(df_target) else 0.0)
+            propagate.add(rows=len(df_target))
+
+            if output == 'sidecar':
+                sidecar = pd.DataFrame({target_id_column: df_target[target_id_column].to_numpy(), key_column: keys})
+                report['output'] = _write_key_sidecar(sidecar, output_dir, target_file, key_column)
+            else:
+                df_target[key_column] = keys
+                detach_staged_file(target_path)
+                write_frame(df_target, target_path)
+                report['output'] = target_path
+        except Exception as e:
+            report['error'] = str(e)
+    return report
+
+def add_key_column_to_files(temp_dir, target_files, source_file, target_id_columns, source_id_column, key_column,
+                            output='sidecar', output_dir=None, max_workers=None, normalize=None):
+    # Add the source's key to many targets in one pass: the source is read once into a key index
+    # and the targets are matched against it concurrently. output='sidecar' writes each target's
+    # ids and keys to <output_dir>/<target>.<key>.parquet (temp_files/.keys by default) instead of
+    # rewriting it; output='inplace' rewrites the targets like add_key_column_by_matching.
+    # target_id_columns is one column name for every target or a {filename: column} dict.
+    # normalize is an optional key normalization pipeline applied to every identifier column.
+    # Returns one report per target: rows, matched, match_rate, output and error.
+    if output not in ('sidecar', 'inplace'):
+        raise ValueError(f"Unsupported output mode: {output}")
+
+    source_path = os.path.join(temp_dir, source_file)
+    source_probe = probe_file_schema(source_path)
+    if source_probe['error']:
+        raise ValueError(f"Error loading data files: {source_probe['error']}")
+    if key_column not in source_probe['columns'] or source_id_column not in source_probe['columns']:
+        raise ValueError(f"Source identifier column '{source_id_column}' or key column '{key_column}' does not exist in source file.")
+    key_index = build_key_index(source_path, source_id_column, key_column, normalize)
+    return apply_key_index(temp_dir, target_files, target_id_columns, key_index, key_column, output, output_dir, max_workers, normalize)
+
+def apply_key_index(temp_dir, target_files, target_id_columns, key_index, key_column, output='sidecar', output_dir=None, max_workers=None,
+                    normalize=None):
+    # Match targets against a prepared key index (one index for all of them, or a {filename: index} dict);
+    # with normalize, the index must hold ids normalized by the same pipeline
+    if output not in ('sidecar', 'inplace'):
+        raise ValueError(f"Unsupported output mode: {output}")
+    if isinstance(target_id_columns, str):
+        target_id_columns = {filename: target_id_columns for filename in target_files}
+    missing = [filename for filename in target_files if filename not in target_id_columns]
+    if missing:
+        raise ValueError(f"No identifier column given for: {', '.join(missing)}")
+    key_indexes = key_index if isinstance(key_index, dict) else {filename: key_index for filename in target_files}
+
+    output_dir = output_dir or os.path.join(temp_dir, KEY_SIDECAR_DIR)
+    max_workers = max_workers or min(8, len(target_files) or 1, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_propagate_key, temp_dir, filename, target_id_columns[filename], key_indexes[filename],
+                                   key_column, output, output_dir, normalize)
+                   for filename in target_files]
+        reports = [future.result() for future in futures]
+
+    for report in reports:
+        if report['error']:
+            print(f"Failed to add key column '{key_column}' to '{report['target']}': {report['error']}")
+        else:
+            print(f"Key column '{key_column}' matched {report['matched']}/{report['rows']} rows ({report['match_rate']:.1%}) of '{report['target']}'.")
+    return reports
+
+def load_key_profile(temp_dir, master_key_file, key_column, normalize=None):
     master_key_path = os.path.join(temp_dir, master_key_file)  # Full path to the master key file
 
     # Attempt to load the master key file based on its extension
     try:
-        if master_key_path.lower().endswith('.csv'):
-            key_data = pd.read_csv(master_key_path)
-        elif master_key_path.lower().endswith('.xlsx'):
-            key_data = pd.read_excel(master_key_path)
-        else:
+        if not validate_file(master_key_path.lower()):
             raise ValueError(f"Unsupported file format for the master key file: {master_key_file}")
+        probe = probe_file_schema(master_key_path)
+        if probe['error']:
+            raise ValueError(probe['error'])
     except Exception as e:
         raise ValueError(f"Failed to load master key file due to: {str(e)}")
 
-    if key_column not in key_data.columns:
+    if key_column not in probe['columns']:
         raise ValueError(f"Key column '{key_column}' not found in the file {master_key_file}")
 
-    key_hist = key_data[key_column].value_counts(normalize=True)
-    results = []
-    similarity_scores = []
+    # Every column is reduced to a compact sketch once, so scoring is cheap enough to cover all of
+    # them; a large master file is streamed with only the key column read
+    try:
+        with span('profile_key', file=master_key_file, bytes=os.path.getsize(master_key_path)):
+            if normalize is not None:
+                return profile_column(load_normalized_keys(master_key_path, key_column, normalize), keep_hashes=True)
+            return profile_file(master_key_path, [key_column], keep_hashes=True, loader=load_data_file)[key_column]
+    except Exception as e:
+        raise ValueError(f"Failed to load master key file due to: {str(e)}")
 
+def score_file_columns(file_path, key_profile, normalize=None):
+    # Best matching column of one file; ties go to the earliest column so results never depend on scheduling.
+    # With normalize, every column is compared as normalized keys (the key profile must be normalized alike).
+    max_similarity = 0
+    most_similar_column = None
+
+    with span('score', file=os.path.basename(file_path), bytes=os.path.getsize(file_path)):
+        if normalize is None:
+            # Large CSVs are profiled chunk by chunk instead of being parsed whole
+            profiles = profile_file(file_path, loader=load_data_file)
+        else:
+            # Candidates are normalized from the cached parse and dropped once profiled; only key
+            # columns go through load_normalized_keys and get cache entries of their own
+            df = load_data_file(file_path)
+            with span('normalize_keys', file=os.path.basename(file_path), rows=len(df), columns=len(df.columns), pipeline=pipeline_name(normalize)):
+                profiles = {column: profile_column(normalize_keys(df[column], normalize)) for column in df.columns}
+        for column, profile in profiles.items():
+            similarity = score_profiles(key_profile, profile)
+            if similarity > max_similarity:
+                max_similarity = similarity
+                most_similar_column = column
+
+    return most_similar_column, max_similarity
+
+_worker_key_profile = None
+_worker_normalize = None
+
+def _init_scoring_worker(key_profile, normalize=None, cache_dir=None, cache_memory_bytes=None, hashes_path=None):
+    # Workers receive the fixed-size part of the master key sketch (a few KB) once at start-up,
+    # along with the parent's memory limit for parsed files. The exact key hashes grow with the
+    # key (80 MB for 10M keys), so they are memory-mapped from the .npy file at hashes_path
+    # instead of being pickled into every worker.
+    global _worker_key_profile, _worker_normalize
+    if hashes_path is not None:
+        key_profile = dict(key_profile, hashes=np.load(hashes_path, mmap_mode='r'))
+    _worker_key_profile = key_profile
+    _worker_normalize = normalize
+    if cache_memory_bytes is not None:
+        get_file_cache(cache_dir).max_memory_bytes = cache_memory_bytes
+
+def _score_file_in_worker(file_path):
+    return score_file_columns(file_path, _worker_key_profile, _worker_normalize)
+
+def iter_similar_columns(selected_files, temp_dir, master_key_file, key_column, max_workers=None, normalize=None, mp_context=None):
+    # Yields (filename, column, score) as each file finishes; max_workers > 1 scores files in worker processes,
+    # started from mp_context when given (the platform's default start method otherwise).
+    # normalize is an optional key normalization pipeline applied to the key and every candidate column.
+    key_profile = load_key_profile(temp_dir, master_key_file, key_column, normalize)
+    file_paths = {}
     for filename in selected_files:
         file_path = os.path.join(temp_dir, filename)
-        try:
-            if file_path.lower().endswith('.csv'):
-                data = pd.read_csv(file_path)
-            elif file_path.lower().endswith('.xlsx'):
-                data = pd.read_excel(file_path)
+        if validate_file(file_path.lower()):  # Skip files with unsupported formats
+            file_paths[filename] = file_path
+
+    if not max_workers or max_workers <= 1 or len(file_paths) <= 1:
+        for filename, file_path in file_paths.items():
+            try:
+                column, score = score_file_columns(file_path, key_profile, normalize)
+            except Exception as e:
+                raise ValueError(f"Failed to load data from {filename} due to: {str(e)}")
+            yield filename, column, score
+        return
+
+    sketch = {name: value for name, value in key_profile.items() if name != 'hashes'}
+    hashes_path = None
+    if key_profile.get('hashes') is not None:
+        # A dot file, so it is never listed as one of the data files
+        fd, hashes_path = tempfile.mkstemp(prefix=".key-hashes-", suffix=".npy", dir=temp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, key_profile['hashes'])
+    cache_dir = os.path.join(temp_dir, CACHE_DIR_NAME)
+    initargs = (sketch, normalize, cache_dir, get_file_cache(cache_dir).max_memory_bytes, hashes_path)
+    try:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(file_paths)), mp_context=mp_context,
+                                 initializer=_init_scoring_worker, initargs=initargs) as executor:
+            futures = {executor.submit(_score_file_in_worker, file_path): filename for filename, file_path in file_paths.items()}
+            try:
+                for future in as_completed(futures):
+                    filename = futures[future]
+                    try:
+                        column, score = future.result()
+                    except Exception as e:
+                        raise ValueError(f"Failed to load data from {filename} due to: {str(e)}")
+                    yield filename, column, score
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        if hashes_path is not None:
+            os.remove(hashes_path)
+
+def find_similar_columns(selected_files, temp_dir, master_key_file, key_column, max_workers=None, normalize=None, mp_context=None):
+    scored = {}
+    with span('score_files', files=len(selected_files), workers=max_workers or 1):
+        for filename, column, score in iter_similar_columns(selected_files, temp_dir, master_key_file, key_column, max_workers, normalize,
+                                                            mp_context):
+            scored[filename] = (column, score)
+
+    # Report in the caller's file order whatever order the workers finished in
+    results = [(filename, scored[filename][0]) for filename in selected_files if filename in scored]
+    similarity_scores = [scored[filename][1] for filename, _ in results]
+    return results, _low_similarity_files(results, similarity_scores)
+
+def _low_similarity_files(results, similarity_scores):
+    # Files scoring well below the average; none when nothing was scored
+    if not similarity_scores:
+        return []
+    avg_similarity = sum(similarity_scores) / len(similarity_scores)
+    return [filename for (filename, _), score in zip(results, similarity_scores) if score < avg_similarity * 0.8]
+
+PROGRESSIVE_SAMPLE_ROWS = (2000, 20000, 200000)
+
+def _score_progressively(file_path, key_profile, sample_rows, z, normalize=None):
+    # Score every column on the first rows, drop columns whose upper bound cannot reach the
+    # leader's lower bound, and rescore only the survivors on more rows (finally all of them)
+    candidates = None
+    runner_up = None
+    for stage_rows in list(sample_rows) + [None]:
+        with span('score_sample', file=os.path.basename(file_path), sample_rows=stage_rows) as sample:
+            data = load_data_file(file_path, nrows=stage_rows) if stage_rows else load_data_file(file_path)
+            sample.add(rows=len(data))
+            sampled = stage_rows is not None and len(data) >= stage_rows
+            columns = data.columns.tolist() if candidates is None else candidates
+            if normalize is None:
+                intervals = {column: score_interval(key_profile, profile_column(data[column]), sampled, z) for column in columns}
+            elif stage_rows is None:
+                intervals = {column: score_interval(key_profile, profile_column(load_normalized_keys(file_path, column, normalize)), sampled, z)
+                             for column in columns}
             else:
-                continue  # Skip files with unsupported formats
+                # Samples are normalized on the fly; only whole columns are worth caching
+                intervals = {column: score_interval(key_profile, profile_column(normalize_keys(data[column], normalize)), sampled, z)
+                             for column in columns}
+
+            # Ties go to the earliest column, as in find_similar_columns
+            best = max(columns, key=lambda column: (intervals[column][0], -columns.index(column)))
+            candidates = [column for column in columns if column == best or intervals[column][2] >= intervals[best][1]]
+            others = [column for column in columns if column != best]
+            if others:
+                runner_up = intervals[max(others, key=lambda column: intervals[column][0])]
+            if not sampled or len(candidates) == 1:
+                break
+
+    score, _, _, error = intervals[best]
+    if runner_up is None:
+        confidence = 1.0
+    else:
+        # Probability that the chosen column really beats the best alternative
+        gap = (score - runner_up[0]) / math.sqrt(error ** 2 + runner_up[3] ** 2)
+        confidence = 0.5 * (1 + math.erf(gap / math.sqrt(2)))
+    return {'column': best, 'score': score, 'confidence': confidence, 'rows_scanned': len(data), 'sampled': sampled}
+
+def find_similar_columns_progressive(selected_files, temp_dir, master_key_file, key_column, sample_rows=PROGRESSIVE_SAMPLE_ROWS, z=2.0, progress_callback=None,
+                                     normalize=None):
+    # Like find_similar_columns, plus a per-file report of the score, how confident the pick is
+    # and how many rows were needed to make it. progress_callback(done, total, filename, details)
+    # is called after each file.
+    key_profile = load_key_profile(temp_dir, master_key_file, key_column, normalize)
+    results = []
+    report = {}
+
+    for done, filename in enumerate(selected_files, start=1):
+        file_path = os.path.join(temp_dir, filename)
+        if not validate_file(file_path.lower()):
+            continue  # Skip files with unsupported formats
+        try:
+            with span('score', file=filename, bytes=os.path.getsize(file_path)) as score_span:
+                report[filename] = _score_progressively(file_path, key_profile, sample_rows, z, normalize)
+                score_span.set(column=report[filename]['column'], rows_scanned=report[filename]['rows_scanned'])
         except Exception as e:
             raise ValueError(f"Failed to load data from {filename} due to: {str(e)}")
+        results.append((filename, report[filename]['column']))
+        if progress_callback:
+            progress_callback(done, len(selected_files), filename, report[filename])
+
+    similarity_scores = [report[filename]['score'] for filename, _ in results]
+    return results, _low_similarity_files(results, similarity_scores), report
+
+def plan_merge_order(key_uniques):
+    # Join the most selective sides first: an inner join can never produce more
+    # keys than its smallest input, so intersecting smallest-first keeps every
+    # intermediate key set bounded by that side's cardinality.
+    return sorted(range(len(key_uniques)), key=lambda i: (len(key_uniques[i]), i))
+
+
+def _key_parts(key_column):
+    # A composite key is given as a tuple (or list) of columns
+    return list(key_column) if isinstance(key_column, (tuple, list)) else [key_column]
+
+def _key_values(df, key_column):
+    # The join key of every row; composite keys become tuples, None when any part is missing
+    if not isinstance(key_column, (tuple, list)):
+        return df[key_column]
+    parts = df[list(key_column)]
+    keys = pd.Series(list(zip(*(parts[column].tolist() for column in key_column))), index=df.index, dtype=object)
+    keys[parts.isna().any(axis=1).to_numpy()] = None
+    return keys
+
+def _key_index(values):
+    # Tuples of a composite key stay a flat index instead of turning into a MultiIndex; the
+    # distinct keys of a categorical become plain values so any two files' keys compare
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        values = np.asarray(values)
+    return pd.Index(values, tupleize_cols=False)
+
+def _build_key_domain(key_uniques, order, how):
+    if how == 'left':
+        return _key_index(key_uniques[0])
+    if how == 'outer':
+        domain = _key_index(key_uniques[0])
+        if len(key_uniques) > 1:
+            domain = domain.append([_key_index(uniques) for uniques in key_uniques[1:]])
+        return domain.unique()
+
+    domain = _key_index(key_uniques[order[0]])
+    for i in order[1:]:
+        if len(domain) == 0:
+            break
+        domain = domain.intersection(_key_index(key_uniques[i]))
+    master = _key_index(key_uniques[0])
+    if len(domain) and (order[0] != 0 or domain.dtype != master.dtype):
+        # Every key left is one of the master's; taking them from there keeps its key dtype
+        # (an int key stays int when another side's keys are floats), as pd.merge does
+        domain = master[domain.get_indexer(master) >= 0]
+    return domain
+
+
+def _group_rows_by_code(codes, n_keys):
+    # Row positions of one side grouped by key code (counting sort, no hashing)
+    valid = np.flatnonzero(codes >= 0)
+    sorted_rows = valid[np.argsort(codes[valid], kind='stable')]
+    counts = np.bincount(codes[valid], minlength=n_keys)
+    offsets = np.cumsum(counts) - counts
+    return sorted_rows, counts, offsets
+
+
+def factorize_keys(df, key_column):
+    # (codes, distinct keys) of a frame's join key; join_frames accepts these precomputed
+    return pd.factorize(_key_values(df, key_column))
+
+def _join_positions(frames, how, factorized=None):
+    # Hash every side exactly once (or not at all when its factorization is passed in);
+    # everything after this works on integer codes
+    factorized = [factorize_keys(df, key_column) if factorized is None or factorized[i] is None else factorized[i]
+                  for i, (_, df, key_column) in enumerate(frames)]
+    key_uniques = [uniques for _, uniques in factorized]
+    order = plan_merge_order(key_uniques)
+    domain = _build_key_domain(key_uniques, order, how)
+    n_keys = len(domain)
+
+    side_codes = []
+    for codes, uniques in factorized:
+        # Map each side's distinct keys into the shared domain, then broadcast to its rows
+        if len(uniques) == 0:
+            side_codes.append(np.full(len(codes), -1, dtype=np.intp))
+            continue
+        unique_to_domain = domain.get_indexer(_key_index(uniques))
+        side_codes.append(np.where(codes >= 0, unique_to_domain[np.maximum(codes, 0)], -1))
+
+    # Expand the result one side at a time in planned order, tracking row positions only
+    result_codes = np.arange(n_keys)
+    positions = [None] * len(frames)
+    for i in order:
+        sorted_rows, counts, offsets = _group_rows_by_code(side_codes[i], n_keys)
+        matched = counts[result_codes]
+        if how == 'inner':
+            repeat = matched
+        else:
+            # Keys missing from this side keep a single row with no match
+            repeat = np.maximum(matched, 1)
+
+        take = np.repeat(np.arange(len(result_codes)), repeat)
+        within = np.arange(len(take)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+        result_codes = result_codes[take]
+        has_match = matched[take] > 0
+        side_positions = np.full(len(take), -1, dtype=np.intp)
+        side_positions[has_match] = sorted_rows[offsets[result_codes[has_match]] + within[has_match]]
+
+        for j in range(len(frames)):
+            if positions[j] is not None:
+                positions[j] = positions[j][take]
+        positions[i] = side_positions
+
+    if how != 'inner':
+        # A row with a missing key (or key part) matches nothing, but a left join keeps the
+        # master's and an outer join every side's, each as a row of its own with code -1
+        for i in ([0] if how == 'left' else range(len(frames))):
+            missing = np.flatnonzero(factorized[i][0] < 0)
+            if not len(missing):
+                continue
+            result_codes = np.concatenate([result_codes, np.full(len(missing), -1)])
+            for j in range(len(frames)):
+                positions[j] = np.concatenate([positions[j], missing if j == i else np.full(len(missing), -1, dtype=np.intp)])
+
+    return domain, result_codes, positions
+
+
+def _canonical_row_order(row_ids):
+    # Canonical row order: by master row, then by each following file's row; unmatched rows last
+    sort_keys = [np.where(ids < 0, np.iinfo(np.int64).max, ids) for ids in row_ids]
+    return np.lexsort(sort_keys[::-1])
+
+
+def _materialize_join(frames, domain, result_codes, positions, output_key):
+    # Materialize each side with a single positional take
+    missing_key = result_codes < 0
+    keys = domain.take(np.maximum(result_codes, 0)) if len(domain) else domain.take(np.zeros(0, dtype=np.intp))
+    if isinstance(output_key, (tuple, list)):
+        # A composite key comes back as one column per part
+        key_frame = pd.DataFrame(keys.tolist() if len(keys) else None, columns=list(output_key))
+    else:
+        key_frame = pd.DataFrame({output_key: keys})
+    if missing_key.any():
+        # Rows kept for a missing key show the key as it is in the row they came from
+        parts = _key_parts(output_key)
+        filled = [np.full(len(result_codes), np.nan, dtype=object) for _ in parts]
+        for (_, df, key_column), side_positions in zip(frames, positions):
+            rows = missing_key & (side_positions >= 0)
+            for values, column in zip(filled, _key_parts(key_column)):
+                values[rows] = df[column].to_numpy(dtype=object)[side_positions[rows]]
+        for part, values in zip(parts, filled):
+            fill = pd.Series(values).infer_objects()
+            if not len(domain):
+                key_frame[part] = fill
+                continue
+            column = key_frame[part].where(~missing_key, fill)
+            if column.dtype == object and key_frame[part].dtype != object:
+                try:
+                    # Strings stay strings with the missing keys among them
+                    column = column.astype(key_frame[part].dtype)
+                except (TypeError, ValueError):
+                    pass
+            key_frame[part] = column
+    pieces = [key_frame]
+    seen_columns = set(_key_parts(output_key))
+    for (name, df, key_column), side_positions in zip(frames, positions):
+        stem = os.path.splitext(os.path.basename(name))[0]
+        side = df.drop(columns=_key_parts(key_column) + [SPILL_ROW_COLUMN], errors='ignore').reset_index(drop=True)
+        side = side.reindex(side_positions).reset_index(drop=True)
+
+        # Columns that clash with an earlier file get the file name as a suffix
+        renamed = []
+        for column in side.columns:
+            renamed.append(column if column not in seen_columns else f"{column}_{stem}")
+            seen_columns.add(renamed[-1])
+        side.columns = renamed
+        pieces.append(side)
+
+    return pd.concat(pieces, axis=1)
+
+
+def join_frames(frames, how='inner', output_key=None, factorized=None):
+    # frames is a list of (name, dataframe, key_column) tuples; the first entry is the master file.
+    # key_column may be a tuple of columns for a composite key (output_key then names its parts).
+    # Rows with a missing key (or key part) never match: inner joins leave them out, left and outer
+    # joins keep them unmatched (the master's for left, every side's for outer).
+    # factorized optionally holds each frame's factorize_keys result (None to compute it).
+    if how not in ('inner', 'left', 'outer'):
+        raise ValueError(f"Unsupported join type: {how}")
+    if not frames:
+        raise ValueError("No files to merge.")
+
+    output_key = output_key or frames[0][2]
+    domain, result_codes, positions = _join_positions(frames, how, factorized)
+    if len(result_codes):
+        row_order = _canonical_row_order(positions)
+        result_codes = result_codes[row_order]
+        positions = [p[row_order] for p in positions]
+
+    return _materialize_join(frames, domain, result_codes, positions, output_key)
+
+
+# Out-of-core merging: every input is hash-partitioned on its key into spill files under
+# temp_files/.spill, then the partitions are joined one at a time with join_frames.
+SPILL_ROW_COLUMN = '__merge_row__'
+PARSED_SIZE_FACTOR = 3  # rough in-memory size of a parsed frame relative to its file on disk
+
+
+def setup_spill_directory(temp_dir):
+    spill_root = os.path.join(temp_dir, ".spill")
+    os.makedirs(spill_root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="merge-", dir=spill_root)
+
+
+def _partition_keys(df, key_column, n_partitions):
+    # Anything the in-memory join could match (1, 1.0, "1") must land in the same partition
+    if isinstance(key_column, (tuple, list)):
+        hashes = composite_hashes(df, key_column)
+    else:
+        hashes = canonical_hashes(df[key_column])
+    return (hashes % np.uint64(n_partitions)).astype(np.intp)
+
+
+def _iter_file_chunks(file_path, chunk_bytes):
+    if file_path.lower().endswith('.csv'):
+        # Size chunks from a small sample so one parsed chunk stays within chunk_bytes
+        sample = pd.read_csv(file_path, nrows=1000)
+        bytes_per_row = max(1, sample.memory_usage(deep=True).sum() // max(1, len(sample)))
+        yield from pd.read_csv(file_path, chunksize=max(1000, chunk_bytes // bytes_per_row))
+    elif file_path.lower().endswith('.xlsx'):
+        # Workbooks are capped at ~1M rows, so they are parsed whole and spilled in slices
+        df = load_data_file(file_path)
+        chunksize = 100000
+        for start in range(0, max(len(df), 1), chunksize):
+            yield df.iloc[start:start + chunksize]
+    else:
+        raise ValueError(f"Unsupported file format: {os.path.basename(file_path)}")
+
+
+def _spill_file(file_path, key_column, n_partitions, spill_dir, tag, chunk_bytes):
+    # Stream one file into per-partition spill files; returns an empty frame carrying its dtypes
+    template = None
+    offset = 0
+    with span('spill', file=os.path.basename(file_path), bytes=os.path.getsize(file_path), partitions=n_partitions) as spill_span:
+        for chunk in _iter_file_chunks(file_path, chunk_bytes):
+            if any(column not in chunk.columns for column in _key_parts(key_column)):
+                raise ValueError(f"Key column '{key_column}' not found in the file {os.path.basename(file_path)}")
+            chunk = chunk.assign(**{SPILL_ROW_COLUMN: np.arange(offset, offset + len(chunk), dtype=np.int64)})
+            offset += len(chunk)
+            if template is None:
+                template = chunk.iloc[:0]
+
+            partitions = _partition_keys(chunk, key_column, n_partitions)
+            for partition in np.unique(partitions):
+                with open(os.path.join(spill_dir, f"{tag}-{partition:05d}.pkl"), 'ab') as spill:
+                    pickle.dump(chunk[partitions == partition], spill, protocol=pickle.HIGHEST_PROTOCOL)
+        spill_span.add(rows=offset)
+    return template
+
+
+def _read_spill(spill_dir, tag, partition, template):
+    path = os.path.join(spill_dir, f"{tag}-{partition:05d}.pkl")
+    if not os.path.exists(path):
+        return template
+    chunks = []
+    with open(path, 'rb') as spill:
+        while True:
+            try:
+                chunks.append(pickle.load(spill))
+            except EOFError:
+                break
+    return pd.concat([template] + chunks, ignore_index=True)
+
+
+def _external_join_batches(selected_files, temp_dir, key_columns, how, output_key, memory_budget):
+    paths = [os.path.join(temp_dir, filename) for filename in selected_files]
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    # Each partition of every input together should fit in the budget once parsed
+    n_partitions = max(1, -(-total_bytes * PARSED_SIZE_FACTOR // memory_budget))
+    # A parsed read chunk gets a quarter of the budget
+    chunk_bytes = max(1, memory_budget // 4)
+
+    spill_dir = setup_spill_directory(temp_dir)
+    try:
+        templates = []
+        for i, (filename, path) in enumerate(zip(selected_files, paths)):
+            templates.append(_spill_file(path, key_columns[filename], n_partitions, spill_dir, f"f{i:04d}", chunk_bytes))
+
+        produced = False
+        empty_result = None
+
+        for partition in range(n_partitions):
+            # The span closes before the batch is handed out, so it only times this partition's join
+            with span('join_partition', partition=partition) as partition_span:
+                frames = []
+                for i, filename in enumerate(selected_files):
+                    frames.append((filename, _read_spill(spill_dir, f"f{i:04d}", partition, templates[i]), key_columns[filename]))
+
+                domain, result_codes, positions = _join_positions(frames, how)
+                if not len(result_codes):
+                    if empty_result is None:
+                        empty_result = _materialize_join(frames, domain, result_codes, positions, output_key)
+                    continue
+
+                # Translate partition-local positions back into row numbers of the original files
+                row_ids = []
+                for (_, df, _), side_positions in zip(frames, positions):
+                    # A side with no rows in this partition only has unmatched (-1) positions
+                    file_rows = df[SPILL_ROW_COLUMN].to_numpy()
+                    side_rows = np.full(len(side_positions), -1, dtype=np.int64)
+                    matched = side_positions >= 0
+                    side_rows[matched] = file_rows[side_positions[matched]]
+                    row_ids.append(side_rows)
+                batch = _materialize_join(frames, domain, result_codes, positions, output_key)
+                partition_span.add(rows=len(batch))
+            yield batch, row_ids
+            produced = True
+
+        if not produced:
+            # Nothing matched anywhere: still hand back the merged columns
+            yield empty_result, [np.empty(0, dtype=np.int64) for _ in selected_files]
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def iter_external_merge(selected_files, temp_dir, key_columns, how='inner', output_key=None, memory_budget=256 * 1024 ** 2):
+    # Yields merged batches partition by partition; rows are not in canonical order across batches
+    key_columns = _key_columns_by_file(selected_files, key_columns)
+    if how not in ('inner', 'left', 'outer'):
+        raise ValueError(f"Unsupported join type: {how}")
+    if not selected_files:
+        raise ValueError("No files to merge.")
+
+    output_key = output_key or key_columns[selected_files[0]]
+    for batch, _ in _external_join_batches(selected_files, temp_dir, key_columns, how, output_key, memory_budget):
+        yield batch
+
+
+def merge_to_file(selected_files, temp_dir, key_columns, output_path, how='inner', output_key=None, memory_budget=None,
+                  format=None, **options):
+    # Merge straight into an output file (.csv, .xlsx or .parquet, see writers.py) and return the
+    # writer's stats. With a memory_budget the external join's partitions are written as they
+    # are produced, so neither the merged result nor the output is ever held whole; rows are
+    # then grouped by partition rather than in merge_files' order.
+    with open_writer(output_path, format, **options) as writer:
+        if memory_budget is None:
+            writer.write(merge_files(selected_files, temp_dir, key_columns, how, output_key))
+        else:
+            with span('merge', files=len(selected_files), how=how, external=True, streamed=True) as merge_span:
+                for batch in iter_external_merge(selected_files, temp_dir, key_columns, how, output_key, memory_budget):
+                    writer.write(batch)
+                    merge_span.add(rows=len(batch))
+    return writer.stats
+
+
+def _key_columns_by_file(selected_files, key_columns):
+    # One key shared by every file, or a {filename: key} mapping; a key is a column name or a
+    # tuple of column names
+    if not isinstance(key_columns, dict):
+        key_columns = {filename: key_columns for filename in selected_files}
+    return {filename: tuple(key) if isinstance(key, list) else key for filename, key in key_columns.items()}
+
+def merge_files(selected_files, temp_dir, key_columns, how='inner', output_key=None, memory_budget=None, compact=False):
+    # key_columns is either one key shared by every file or a {filename: key} mapping, where a key
+    # is a column name or a tuple of columns (a composite key).
+    # With a memory_budget (bytes) the inputs are partitioned to disk and joined out of core.
+    # compact=True loads in-memory inputs as compact frames, so the result keeps their narrow dtypes.
+    key_columns = _key_columns_by_file(selected_files, key_columns)
+    with span('merge', files=len(selected_files), how=how, external=memory_budget is not None) as merge_span:
+        merged = _merge_files(selected_files, temp_dir, key_columns, how, output_key, memory_budget, compact)
+        merge_span.add(rows=len(merged))
+    return merged
+
+def _merge_files(selected_files, temp_dir, key_columns, how, output_key, memory_budget, compact):
+    if memory_budget is not None:
+        if how not in ('inner', 'left', 'outer'):
+            raise ValueError(f"Unsupported join type: {how}")
+        if not selected_files:
+            raise ValueError("No files to merge.")
+        output_key = output_key or key_columns[selected_files[0]]
+
+        batches = []
+        batch_row_ids = []
+        for batch, row_ids in _external_join_batches(selected_files, temp_dir, key_columns, how, output_key, memory_budget):
+            batches.append(batch)
+            batch_row_ids.append(row_ids)
+
+        merged = pd.concat(batches, ignore_index=True)
+        row_ids = [np.concatenate(ids) for ids in zip(*batch_row_ids)]
+        return merged.take(_canonical_row_order(row_ids)).reset_index(drop=True)
+
+    frames = []
+    for filename in selected_files:
+        key_column = key_columns.get(filename)
+        df, error = load_file(os.path.join(temp_dir, filename), compact=compact,
+                              key_columns=_key_parts(key_column) if key_column is not None else None)
+        if df is None:
+            raise ValueError(f"Failed to load data from {filename} due to: {error}")
 
-        columns = data.columns.tolist()
-        selected_columns = columns[:20] + columns[-5:]  # example slice, adjust as necessary
-
-        max_similarity = 0
-        most_similar_column = None
-
-        for column in selected_columns:
-            if column in data.columns:
-                column_hist = data[column].value_counts(normalize=True)
-                emd = wasserstein_distance(key_hist, column_hist)
-                similarity = 1 / (1 + emd)
-
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    most_similar_column = column
-
-        results.append((filename, most_similar_column))
-        similarity_scores.append(max_similarity)
-
-    avg_similarity = sum(similarity_scores) / len(similarity_scores)
-    low_similarity_files = [filename for filename, score in zip(selected_files, similarity_scores) if score < avg_similarity * 0.8]
+        if key_column is None or any(column not in df.columns for column in _key_parts(key_column)):
+            raise ValueError(f"Key column '{key_column}' not found in the file {filename}")
+        frames.append((filename, df, key_column))
 
-    return results, low_similarity_files
\ No newline at end of file
+    return join_frames(frames, how=how, output_key=output_key)
@@ -0,0 +1,145 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from operations import load_file, _key_parts, _key_values, _key_index
+
+# Key-overlap report for a set of files. Every file's distinct keys are factorized into one
+# shared integer code space, so each file becomes a sorted array of codes plus a count per code.
+# Pairwise figures then come from block matrix products over that code space (membership x
+# membership for shared keys, counts x membership for matched rows, counts x counts for join
+# sizes) instead of building and intersecting Python sets for every pair.
+
+CODE_BLOCK = 1 << 16  # codes per block; a block's matrices are files x CODE_BLOCK
+
+
+def _file_keys(temp_dir, filename, key_column):
+    df, error = load_file(os.path.join(temp_dir, filename), usecols=_key_parts(key_column))
+    if df is None:
+        raise ValueError(f"Failed to load data from {filename} due to: {error}")
+    keys = _key_values(df, key_column)
+    codes, uniques = pd.factorize(keys)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return len(keys), int((codes < 0).sum()), uniques, counts
+
+
+def key_overlap(selected_files, temp_dir, key_columns, max_workers=None):
+    # key_columns is one key for every file or a {filename: key} mapping, as for merge_files.
+    # Returns a dict of DataFrames indexed by file name:
+    #   files:        rows, missing keys, distinct keys, keys on more than one row, duplicate rows
+    #   shared:       distinct keys of the row file also found in the column file
+    #   orphans:      distinct keys of the row file missing from the column file
+    #   matched_rows: rows of the row file whose key occurs in the column file
+    #   join_rows:    rows an inner join of the two files would produce
+    # plus 'uniques' (the shared code space) and 'codes' ({filename: sorted codes}) for orphan_keys.
+    if not isinstance(key_columns, dict):
+        key_columns = {filename: key_columns for filename in selected_files}
+    if not selected_files:
+        raise ValueError("No files selected.")
+
+    max_workers = max_workers or min(8, len(selected_files), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = list(executor.map(lambda filename: _file_keys(temp_dir, filename, key_columns[filename]), selected_files))
+
+    # One factorization of all distinct keys gives every file its codes in the shared space
+    uniques = [file_uniques for _, _, file_uniques, _ in loaded]
+    combined = _key_index(uniques[0]).append([_key_index(values) for values in uniques[1:]]) if len(uniques) > 1 else _key_index(uniques[0])
+    global_codes, space = pd.factorize(combined)
+    n_codes = len(space)
+
+    codes = {}
+    counts = {}
+    offset = 0
+    for filename, (_, _, file_uniques, file_counts) in zip(selected_files, loaded):
+        file_codes = global_codes[offset:offset + len(file_uniques)]
+        offset += len(file_uniques)
+        order = np.argsort(file_codes, kind='stable')
+        codes[filename] = file_codes[order]
+        counts[filename] = file_counts[order]
+
+    n_files = len(selected_files)
+    shared = np.zeros((n_files, n_files))
+    matched_rows = np.zeros((n_files, n_files))
+    join_rows = np.zeros((n_files, n_files))
+    for start in range(0, n_codes, CODE_BLOCK):
+        stop = min(start + CODE_BLOCK, n_codes)
+        member = np.zeros((n_files, stop - start), dtype=np.float32)  # exact: a block sums to at most CODE_BLOCK
+        weight = np.zeros((n_files, stop - start))
+        for i, filename in enumerate(selected_files):
+            lo, hi = np.searchsorted(codes[filename], [start, stop])
+            member[i, codes[filename][lo:hi] - start] = 1.0
+            weight[i, codes[filename][lo:hi] - start] = counts[filename][lo:hi]
+        shared += member @ member.T
+        matched_rows += weight @ member.T.astype(np.float64)
+        join_rows += weight @ weight.T
+
+    files = pd.DataFrame({
+        'rows': [rows for rows, _, _, _ in loaded],
+        'missing_keys': [missing for _, missing, _, _ in loaded],
+        'distinct_keys': [len(codes[filename]) for filename in selected_files],
+        'duplicated_keys': [int((counts[filename] > 1).sum()) for filename in selected_files],
+        'duplicate_rows': [int((counts[filename] - 1).clip(min=0).sum()) for filename in selected_files],
+    }, index=pd.Index(selected_files, name='file'))
+
+    def matrix(values):
+        return pd.DataFrame(np.rint(values).astype(np.int64), index=pd.Index(selected_files, name='file'), columns=selected_files)
+
+    shared = matrix(shared)
+    return {
+        'files': files,
+        'shared': shared,
+        'orphans': matrix(files['distinct_keys'].to_numpy()[:, None] - shared.to_numpy()),
+        'matched_rows': matrix(matched_rows),
+        'join_rows': matrix(join_rows),
+        'uniques': space,
+        'codes': codes,
+    }
+
+
+def orphan_keys(report, filename, other_file, limit=None):
+    # Key values of filename that do not occur in other_file
+    codes = report['codes'][filename]
+    orphaned = codes[~np.isin(codes, report['codes'][other_file], assume_unique=True)]
+    if limit is not None:
+        orphaned = orphaned[:limit]
+    return report['uniques'].take(orphaned).tolist()
+
+
+def overlap_pairs(report):
+    # One row per ordered pair of different files, for export or sorting
+    files = report['files'].index
+    rows = []
+    for a in files:
+        for b in files:
+            if a == b:
+                continue
+            distinct = report['files'].at[a, 'distinct_keys']
+            rows.append({
+                'file': a, 'other_file': b, 'distinct_keys': distinct,
+                'shared_keys': report['shared'].at[a, b], 'orphan_keys': report['orphans'].at[a, b],
+                'shared_share': report['shared'].at[a, b] / distinct if distinct else 0.0,
+                'matched_rows': report['matched_rows'].at[a, b], 'join_rows': report['join_rows'].at[a, b],
+            })
+    return pd.DataFrame(rows)
+
+
+def export_overlap_report(report, output_path):
+    # .xlsx: one sheet per table; .csv: the pair table; .json: every table
+    lower = output_path.lower()
+    tables = {name: report[name] for name in ('files', 'shared', 'orphans', 'matched_rows', 'join_rows')}
+    if lower.endswith('.xlsx'):
+        with pd.ExcelWriter(output_path) as writer:
+            for name, table in tables.items():
+                table.to_excel(writer, sheet_name=name)
+            overlap_pairs(report).to_excel(writer, sheet_name='pairs', index=False)
+    elif lower.endswith('.csv'):
+        overlap_pairs(report).to_csv(output_path, index=False)
+    elif lower.endswith('.json'):
+        payload = {name: json.loads(table.to_json(orient='index')) for name, table in tables.items()}
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+    else:
+        raise ValueError(f"Unsupported report format for {os.path.basename(output_path)}")
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Paged data preview. PreviewModel holds the row order (after sorting and filtering) and
+# formats rows a page at a time; VirtualPreview keeps a fixed set of Treeview items and only
+# rewrites their values as the user scrolls, so the widget never holds more than one screen.
+
+PAGE_SIZE = 200
+CACHED_PAGES = 8
+
+
+class FrameSource:
+    def __init__(self, df):
+        self.columns = df.columns.tolist()
+        self._frame = df
+
+    def __len__(self):
+        return len(self._frame)
+
+    def rows(self, start, stop):
+        return self._frame.iloc[start:stop]
+
+    def frame(self):
+        return self._frame
+
+
+def format_rows(df):
+    # Vectorized: one string conversion per column instead of a lookup per cell
+    if not len(df):
+        return []
+    formatted = [df.iloc[:, i].astype(object).where(df.iloc[:, i].notna(), '').astype(str).to_numpy()
+                 for i in range(df.shape[1])]
+    return list(zip(*formatted))
+
+
+class PreviewModel:
+    def __init__(self, source, page_size=PAGE_SIZE, cached_pages=CACHED_PAGES):
+        self.source = source if hasattr(source, 'rows') else FrameSource(source)
+        self.columns = self.source.columns
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.sort_column = None
+        self.sort_ascending = True
+        self.filter_text = None
+        self.filter_column = None
+        self._order = None  # positions into the source after sort/filter; None means identity
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self.source) if self._order is None else len(self._order)
+
+    def sort(self, column, ascending=None):
+        # Clicking the same column again flips the direction
+        if ascending is None:
+            ascending = not self.sort_ascending if column == self.sort_column else True
+        self.sort_column, self.sort_ascending = column, ascending
+        self._rebuild_order()
+
+    def set_filter(self, text, column=None):
+        self.filter_text = text or None
+        self.filter_column = column
+        self._rebuild_order()
+
+    def _rebuild_order(self):
+        self._pages.clear()
+        if self.sort_column is None and self.filter_text is None:
+            self._order = None
+            return
+
+        df = self.source.frame()
+        order = np.arange(len(df))
+        if self.filter_text is not None:
+            columns = [self.filter_column] if self.filter_column is not None else df.columns
+            mask = np.zeros(len(df), dtype=bool)
+            for column in columns:
+                mask |= df[column].astype(str).str.contains(self.filter_text, case=False, regex=False).to_numpy()
+            order = order[mask]
+        if self.sort_column is not None:
+            keys = df[self.sort_column].iloc[order].reset_index(drop=True)
+            sorted_positions = keys.sort_values(ascending=self.sort_ascending, kind='stable', na_position='last').index
+            order = order[sorted_positions.to_numpy()]
+        self._order = order
+
+    def page(self, number):
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+
+        start = number * self.page_size
+        stop = min(start + self.page_size, len(self))
+        if self._order is None:
+            rows = self.source.rows(start, stop)
+        else:
+            rows = self.source.frame().iloc[self._order[start:stop]]
+        self._pages[number] = format_rows(rows)
+        while len(self._pages) > self.cached_pages:
+            self._pages.popitem(last=False)
+        return self._pages[number]
+
+    def window(self, first, count):
+        # Formatted rows [first, first + count); pages on either side stay cached as the buffer
+        rows = []
+        first = max(0, min(first, len(self)))
+        stop = min(first + count, len(self))
+        number = first // self.page_size
+        while first + len(rows) < stop:
+            page = self.page(number)
+            offset = first + len(rows) - number * self.page_size
+            rows.extend(page[offset:offset + stop - first - len(rows)])
+            number += 1
+        return rows
+
+
+class VirtualPreview:
+    def __init__(self, treeview, visible_rows=None):
+        from tkinter import ttk
+        self.treeview = treeview
+        self.model = None
+        self.first = 0
+        self.visible_rows = visible_rows or int(treeview.cget('height') or 10)
+        treeview.configure(height=self.visible_rows)
+        self.scrollbar = ttk.Scrollbar(treeview.master, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y", before=treeview)
+        treeview.bind("<MouseWheel>", self._on_mousewheel)
+        treeview.bind("<Button-4>", lambda e: self.scroll_to(self.first - 3) or "break")
+        treeview.bind("<Button-5>", lambda e: self.scroll_to(self.first + 3) or "break")
+
+    def show(self, model):
+        self.model = model
+        self.first = 0
+        treeview = self.treeview
+        treeview.delete(*treeview.get_children())
+        treeview['columns'] = list(model.columns)
+        treeview['show'] = 'headings'
+        for col in model.columns:
+            treeview.heading(col, text=str(col), anchor='w', command=lambda c=col: self.sort(c))
+            treeview.column(col, anchor="w", width=100)
+        # A fixed set of items is reused for every window of rows
+        for i in range(self.visible_rows):
+            treeview.insert("", "end", iid=f"row{i}", values=())
+        self.render()
+
+    def sort(self, column):
+        self.model.sort(column)
+        for col in self.model.columns:
+            arrow = (" ▲" if self.model.sort_ascending else " ▼") if col == column else ""
+            self.treeview.heading(col, text=f"{col}{arrow}")
+        self.scroll_to(0)
+
+    def set_filter(self, text, column=None):
+        self.model.set_filter(text, column)
+        self.scroll_to(0)
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, max(0, len(self.model) - self.visible_rows)))
+        self.render()
+
+    def render(self):
+        rows = self.model.window(self.first, self.visible_rows)
+        for i in range(self.visible_rows):
+            if i < len(rows):
+                self.treeview.item(f"row{i}", values=rows[i])
+                self.treeview.reattach(f"row{i}", "", i)
+            else:
+                # Fewer rows than the window (short file or narrow filter): hide the spare items
+                self.treeview.detach(f"row{i}")
+        total = max(len(self.model), 1)
+        self.scrollbar.set(self.first / total, min(1.0, (self.first + self.visible_rows) / total))
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(amount) * len(self.model)))
+        elif action == 'scroll':
+            step = self.visible_rows if unit == 'pages' else 1
+            self.scroll_to(self.first + int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS small deltas
+        steps = int(event.delta / 120) or (1 if event.delta > 0 else -1)
+        self.scroll_to(self.first - steps * 3)
+        return "break"
+
@@ -0,0 +1,272 @@
+import numpy as np
+import pandas as pd
+
+# Compact per-column summaries used to compare columns without touching raw data again:
+# a MinHash signature (value-set overlap), a bottom-k sample of distinct values
+# (containment), HyperLogLog registers (distinct count) and quantile sketches of the value
+# frequencies and, for numeric columns, of the values.
+
+MINHASH_SIZE = 128
+VALUE_SAMPLE_SIZE = 256
+HLL_PRECISION = 12
+QUANTILE_POINTS = np.linspace(0.0, 1.0, 65)
+_HASH_BLOCK = 4096
+_MINHASH_SEEDS = np.random.default_rng(20240604).integers(0, np.iinfo(np.int64).max, MINHASH_SIZE, dtype=np.int64).astype(np.uint64)
+
+
+def canonical_hashes(values):
+    # 64-bit hashes where values that compare equal across files (1, 1.0, "1") hash alike:
+    # numeric-looking values hash by their float value, everything else by its text
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Each category is hashed once and the rows take their category's hash by code
+        codes = values.cat.codes.to_numpy()
+        category_hashes = np.append(canonical_hashes(pd.Series(values.cat.categories)), _MISSING_HASH)
+        return category_hashes[np.where(codes >= 0, codes, len(category_hashes) - 1)]
+    textual = values.dtype == object or pd.api.types.is_string_dtype(values.dtype)
+    numeric = pd.to_numeric(values, errors='coerce') if textual else values
+    if pd.api.types.is_bool_dtype(numeric) or not pd.api.types.is_numeric_dtype(numeric):
+        numeric = pd.Series(np.nan, index=values.index)
+    numeric = numeric.astype('float64')
+    is_numeric = numeric.notna().to_numpy()
+
+    if is_numeric.all():
+        return pd.util.hash_pandas_object(numeric, index=False).to_numpy()
+    hashes = pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+    if is_numeric.any():
+        hashes = np.where(is_numeric, pd.util.hash_pandas_object(numeric, index=False).to_numpy(), hashes)
+    return hashes
+
+
+_MISSING_HASH = canonical_hashes(pd.Series([np.nan]))[0]
+
+
+def composite_hashes(df, columns):
+    # One 64-bit hash per row for a tuple of columns; each part is hashed like canonical_hashes,
+    # so (1, "a") and ("1", "a") hash alike, and the order of the parts matters
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for column in columns:
+        hashes = _mix((hashes * np.uint64(0x100000001B3)) ^ canonical_hashes(df[column]))
+    return hashes
+
+
+def _mix(hashes):
+    # splitmix64 finalizer; uint64 arithmetic wraps, which is what we want
+    z = hashes + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def minhash_signature(hashes):
+    signature = np.full(MINHASH_SIZE, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), _HASH_BLOCK):
+        block = hashes[start:start + _HASH_BLOCK, None] ^ _MINHASH_SEEDS[None, :]
+        np.minimum(signature, _mix(block).min(axis=0), out=signature)
+    return signature
+
+
+def merge_minhash(a, b):
+    return np.minimum(a, b)
+
+
+def _bit_length(values):
+    length = np.zeros(len(values), dtype=np.uint8)
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = values >= (np.uint64(1) << np.uint64(shift))
+        length[big] += shift
+        values[big] >>= np.uint64(shift)
+    length[values > 0] += 1
+    return length
+
+
+def hll_registers(hashes):
+    registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+    if len(hashes):
+        hashes = _mix(hashes)
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - _bit_length(remainder) + 1
+        np.maximum.at(registers, index, rank.astype(np.uint8))
+    return registers
+
+
+def merge_hll(a, b):
+    return np.maximum(a, b)
+
+
+def hll_estimate(registers):
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        # Linear counting is more accurate while many registers are still empty
+        estimate = m * np.log(m / zeros)
+    return float(estimate)
+
+
+def quantile_sketch(values, weights=None):
+    # Quantiles at fixed points; two sketches give the 1-D Wasserstein distance directly
+    values = np.asarray(values, dtype='float64')
+    if weights is None:
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return None
+        return np.quantile(values, QUANTILE_POINTS)
+
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], np.asarray(weights, dtype='float64')[order]
+    if not len(values):
+        return None
+    cumulative = np.cumsum(weights) - weights / 2
+    return np.interp(QUANTILE_POINTS, cumulative / weights.sum(), values)
+
+
+def wasserstein_from_quantiles(a, b):
+    return float(np.mean(np.abs(a - b)))
+
+
+def value_sample(hashes):
+    # Bottom-k by a second hash: a uniform sample of the distinct values that every column draws alike
+    if len(hashes) <= VALUE_SAMPLE_SIZE:
+        return np.sort(hashes)
+    return np.sort(hashes[np.argpartition(_mix(hashes), VALUE_SAMPLE_SIZE)[:VALUE_SAMPLE_SIZE]])
+
+
+def profile_column(series, keep_hashes=False):
+    # One pass over the column: factorize, then every sketch works on the distinct values.
+    # keep_hashes also stores the full sorted hash set, for the one column others are compared to.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # A categorical is already factorized: count its codes and keep the categories in use
+        codes = series.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+        used = counts > 0
+        uniques, counts = series.cat.categories[used], counts[used]
+        dtype = series.cat.categories.dtype
+    else:
+        codes, uniques = pd.factorize(series)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        dtype = series.dtype
+    numeric = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    return profile_counts(uniques, counts, numeric, keep_hashes)
+
+
+def profile_counts(uniques, counts, numeric=False, keep_hashes=False):
+    # Same profile from distinct values and their counts, e.g. value counts accumulated over chunks
+    counts = np.asarray(counts, dtype='int64')
+    hashes = canonical_hashes(pd.Series(uniques)) if len(uniques) else np.empty(0, dtype=np.uint64)
+    registers = hll_registers(hashes)
+    profile = {
+        'count': int(counts.sum()),
+        'minhash': minhash_signature(hashes),
+        'sample': value_sample(hashes),
+        'hll': registers,
+        'distinct': hll_estimate(registers),
+        'freq_quantiles': quantile_sketch(counts / counts.sum()) if len(counts) else None,
+        'value_quantiles': quantile_sketch(np.asarray(uniques, dtype='float64'), counts) if numeric and len(uniques) else None,
+    }
+    if keep_hashes:
+        profile['hashes'] = np.unique(hashes)
+    return profile
+
+
+def profile_frame(df, columns=None):
+    columns = df.columns if columns is None else columns
+    return {column: profile_column(df[column]) for column in columns}
+
+
+def jaccard_estimate(a, b):
+    return float(np.mean(a['minhash'] == b['minhash'])) if a['count'] and b['count'] else 0.0
+
+
+def _contains(sorted_hashes, hashes):
+    if not len(sorted_hashes):
+        return np.zeros(len(hashes), dtype=bool)
+    found = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+    return sorted_hashes[found] == hashes
+
+
+def sample_cutoff(sample):
+    # Bottom-k samples are coordinated: a value is sampled by every column holding it whenever its
+    # second hash is at or below that column's cutoff (unbounded while the column has < k values)
+    if len(sample) < VALUE_SAMPLE_SIZE:
+        return np.iinfo(np.uint64).max
+    return _mix(sample).max()
+
+
+def containment_estimate(a, b):
+    # Share of b's distinct values that also occur in a; exact membership of b's value
+    # sample when a carries its full hash set, otherwise from the two coordinated samples
+    if not len(b['sample']):
+        return 0.0
+    if a.get('hashes') is not None:
+        return float(np.mean(_contains(a['hashes'], b['sample'])))
+
+    cutoff = min(sample_cutoff(a['sample']), sample_cutoff(b['sample']))
+    comparable = b['sample'][_mix(b['sample']) <= cutoff]
+    if len(comparable):
+        return float(np.mean(_contains(a['sample'], comparable)))
+
+    jaccard = jaccard_estimate(a, b)
+    if not jaccard or not b['distinct']:
+        return 0.0
+    intersection = jaccard * (a['distinct'] + b['distinct']) / (1 + jaccard)
+    return min(1.0, intersection / b['distinct'])
+
+
+def _uniqueness(profile):
+    return min(1.0, profile['distinct'] / profile['count']) if profile['count'] else 0.0
+
+
+def value_overlap(key_profile, profile):
+    # Jaccard, or containment where the candidate is as close to unique per row as the key is.
+    # A column of a few repeated values (a flag, small integers) always falls inside a large
+    # key's domain, so its containment only counts in proportion to its relative uniqueness.
+    key_uniqueness = _uniqueness(key_profile)
+    weight = min(1.0, _uniqueness(profile) / key_uniqueness) if key_uniqueness else 0.0
+    return max(jaccard_estimate(key_profile, profile), containment_estimate(key_profile, profile) * weight)
+
+
+def score_profiles(key_profile, profile):
+    # Combines value overlap with the repo's frequency-distribution Wasserstein test
+    overlap = value_overlap(key_profile, profile)
+    parts = [overlap]
+
+    if key_profile['freq_quantiles'] is not None and profile['freq_quantiles'] is not None:
+        emd = wasserstein_from_quantiles(key_profile['freq_quantiles'], profile['freq_quantiles'])
+        parts.append(1 / (1 + emd))
+    else:
+        parts.append(0.0)
+
+    if key_profile['value_quantiles'] is not None and profile['value_quantiles'] is not None:
+        # Scale by the key's spread so the distance is unit-free
+        scale = key_profile['value_quantiles'][-1] - key_profile['value_quantiles'][0] or 1.0
+        emd = wasserstein_from_quantiles(key_profile['value_quantiles'], profile['value_quantiles'])
+        parts.append(1 / (1 + emd / abs(scale)))
+
+    return sum(parts) / len(parts)
+
+
+def score_interval(key_profile, profile, sampled=False, z=2.0):
+    # (score, lower, upper, standard error). The error covers MinHash estimation and, for a
+    # row sample, sampling of the distinct values; the upper bound is what the column could
+    # still reach on the full data, where the distribution parts may rise as high as 1.
+    score = score_profiles(key_profile, profile)
+    n_parts = 3 if key_profile['value_quantiles'] is not None and profile['value_quantiles'] is not None else 2
+    overlap = value_overlap(key_profile, profile)
+
+    variance = overlap * (1 - overlap) / max(1, min(MINHASH_SIZE, len(profile['sample'])))
+    if sampled:
+        variance += overlap * (1 - overlap) / max(1.0, profile['distinct'])
+    # Keep a floor so a sample that happens to score 0 or 1 is not treated as exact
+    overlap_error = max(np.sqrt(variance), 1 / MINHASH_SIZE)
+    error = overlap_error / n_parts
+
+    lower = max(0.0, score - z * error)
+    if sampled:
+        upper = (min(1.0, overlap + z * overlap_error) + (n_parts - 1)) / n_parts
+    else:
+        upper = min(1.0, score + z * error)
+    return score, lower, upper, error
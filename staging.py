@@ -0,0 +1,239 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tracing import span
+
+MANIFEST_NAME = ".manifest.json"
+STAGING_METHODS = ("reflink", "hardlink", "symlink", "copy")
+COPY_CHUNK_BYTES = 64 * 1024 ** 2
+HASH_SAMPLE_BYTES = 1024 ** 2
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents (btrfs, xfs, ...)
+
+_manifest_lock = threading.Lock()
+
+
+def load_manifest(temp_dir):
+    path = os.path.join(temp_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'source': None, 'files': {}}
+    manifest.setdefault('source', None)
+    manifest.setdefault('files', {})
+    return manifest
+
+
+def save_manifest(temp_dir, manifest):
+    path = os.path.join(temp_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with _manifest_lock:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def quick_hash(file_path):
+    # Hash of the size plus the first and last MiB: cheap, and catches rewrites that keep the mtime
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(HASH_SAMPLE_BYTES))
+        if size > 2 * HASH_SAMPLE_BYTES:
+            f.seek(-HASH_SAMPLE_BYTES, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def _reflink(src_path, dest_path):
+    import fcntl
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dest.close()
+            os.remove(dest_path)
+            raise
+
+
+def _chunked_copy(src_path, dest_path, max_workers=4):
+    # Copy large files as independent byte ranges so several ranges are in flight at once
+    size = os.path.getsize(src_path)
+    if size <= COPY_CHUNK_BYTES or not hasattr(os, 'pread'):
+        shutil.copyfile(src_path, dest_path)
+        return
+
+    src_fd = os.open(src_path, os.O_RDONLY)
+    dest_fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(dest_fd, size)
+
+        def copy_range(offset):
+            end = min(offset + COPY_CHUNK_BYTES, size)
+            while offset < end:
+                data = os.pread(src_fd, min(8 * 1024 ** 2, end - offset), offset)
+                if not data:
+                    raise OSError(f"Unexpected end of file while copying {src_path}")
+                offset += os.pwrite(dest_fd, data, offset)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as range_pool:
+            list(range_pool.map(copy_range, range(0, size, COPY_CHUNK_BYTES)))
+    finally:
+        os.close(src_fd)
+        os.close(dest_fd)
+    shutil.copystat(src_path, dest_path)
+
+
+def _stage_one(src_path, dest_path, methods):
+    # Returns the method that worked and the source's quick hash
+    with span('stage_file', file=os.path.basename(src_path), bytes=os.path.getsize(src_path)) as stage:
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        method = _link_or_copy(src_path, dest_path, methods)
+        stage.set(method=method)
+        return method, quick_hash(src_path)
+
+
+def _link_or_copy(src_path, dest_path, methods):
+    for method in methods:
+        try:
+            if method == 'reflink':
+                _reflink(src_path, dest_path)
+            elif method == 'hardlink':
+                os.link(src_path, dest_path)
+            elif method == 'symlink':
+                os.symlink(os.path.abspath(src_path), dest_path)
+            elif method == 'copy':
+                _chunked_copy(src_path, dest_path)
+            else:
+                raise ValueError(f"Unknown staging method: {method}")
+            return method
+        except (OSError, NotImplementedError, ImportError) as e:
+            if method == 'copy' or (isinstance(e, OSError) and e.errno == errno.ENOENT):
+                raise
+            continue
+    raise OSError(f"No staging method succeeded for {src_path}")
+
+
+def _is_current(entry, stat, dest_path, src_path, verify_hash):
+    if not entry or not os.path.exists(dest_path):
+        return False
+    if entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+        return False
+    if verify_hash and entry.get('hash') != quick_hash(src_path):
+        return False
+    return True
+
+
+def stage_files(folder_path, temp_dir, methods=STAGING_METHODS, max_workers=None, verify_hash=False, progress_callback=None,
+                skip=()):
+    # Mirror the data files of folder_path into temp_dir, restaging only new or changed files.
+    # Returns the staged file names and how many of them had to be (re)staged.
+    # progress_callback(done, total, filename) is called from the calling thread.
+    # Files named in skip (still being written, say) are neither staged nor returned this time;
+    # whatever was staged for them earlier is left in place.
+    with span('stage', folder=os.path.basename(os.path.abspath(folder_path))) as stage:
+        os.makedirs(temp_dir, exist_ok=True)
+        folder_path = os.path.abspath(folder_path)
+        manifest = load_manifest(temp_dir)
+        if manifest['source'] != folder_path:
+            # A different folder: nothing staged so far can be reused
+            manifest = {'source': folder_path, 'files': {}}
+            _remove_unlisted(temp_dir, manifest, keep=(".cache", ".index"))
+
+        filenames = sorted(name for name in os.listdir(folder_path)
+                           if not name.startswith('.') and os.path.isfile(os.path.join(folder_path, name)))
+        present = set(filenames)
+        filenames = [name for name in filenames if name not in skip]
+
+        # Files that disappeared from the source leave the staging area too
+        for filename in list(manifest['files']):
+            if filename not in present:
+                _remove_path(os.path.join(temp_dir, filename))
+                del manifest['files'][filename]
+
+        pending = []
+        for filename in filenames:
+            src_path = os.path.join(folder_path, filename)
+            stat = os.stat(src_path)
+            if not _is_current(manifest['files'].get(filename), stat, os.path.join(temp_dir, filename), src_path, verify_hash):
+                pending.append((filename, stat))
+
+        total = len(filenames)
+        done = total - len(pending)
+        if progress_callback:
+            progress_callback(done, total, None)
+
+        max_workers = max_workers or min(8, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for filename, stat in pending:
+                src_path = os.path.join(folder_path, filename)
+                future = executor.submit(_stage_one, src_path, os.path.join(temp_dir, filename), methods)
+                futures[future] = (filename, stat)
+
+            for future in as_completed(futures):
+                filename, stat = futures[future]
+                method, digest = future.result()
+                manifest['files'][filename] = {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'hash': digest,
+                    'method': method,
+                }
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total, filename)
+
+        save_manifest(temp_dir, manifest)
+        stage.add(bytes=sum(stat.st_size for _, stat in pending))
+        stage.set(files=total, restaged=len(pending))
+    return filenames, len(pending)
+
+
+def detach_staged_file(file_path):
+    # Staged files may share storage with the source; give one a private copy before writing to it
+    if os.path.islink(file_path) or (os.path.exists(file_path) and os.stat(file_path).st_nlink > 1):
+        tmp_path = file_path + ".detach"
+        shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+
+
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _remove_unlisted(temp_dir, manifest, keep=()):
+    for name in os.listdir(temp_dir):
+        if name in manifest['files'] or name == MANIFEST_NAME or name in keep:
+            continue
+        _remove_path(os.path.join(temp_dir, name))
+
+
+def clean_staging_directory(temp_dir, keep=(".cache", ".index", ".keys")):
+    # Drop everything the manifest does not vouch for: stray files, spill directories and
+    # staged files whose source has changed since it was staged
+    os.makedirs(temp_dir, exist_ok=True)
+    manifest = load_manifest(temp_dir)
+    source = manifest['source']
+    for filename, entry in list(manifest['files'].items()):
+        src_path = os.path.join(source, filename) if source else None
+        dest_path = os.path.join(temp_dir, filename)
+        try:
+            current = src_path is not None and _is_current(entry, os.stat(src_path), dest_path, src_path, False)
+        except OSError:
+            current = False
+        if not current:
+            _remove_path(dest_path)
+            del manifest['files'][filename]
+
+    _remove_unlisted(temp_dir, manifest, keep)
+    save_manifest(temp_dir, manifest)
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from excel_reader import iter_excel_chunks
+from sketches import (canonical_hashes, minhash_signature, merge_minhash, hll_registers, merge_hll,
+                      hll_estimate, value_sample, profile_column, profile_counts, _contains)
+from tracing import span
+
+# Chunked scans over data files. Large CSVs are read a chunk at a time with only the columns
+# the scan needs, and every chunk is folded into small aggregators (value counts, sketches,
+# key presence), so memory is one chunk plus the aggregators' state however
+# big the file is. Small files and workbooks are parsed whole through the loader (and its
+# cache) and then fed to the same aggregators in slices.
+
+CHUNK_ROWS = 100_000
+STREAM_MIN_BYTES = 64 * 1024 * 1024  # CSVs below this are cheaper to parse whole and keep cached
+_COUNTS_FLUSH_ROWS = 1_000_000
+
+
+def should_stream(file_path, min_bytes=STREAM_MIN_BYTES):
+    return file_path.lower().endswith('.csv') and os.path.getsize(file_path) >= min_bytes
+
+
+def iter_chunks(file_path, usecols=None, chunksize=CHUNK_ROWS, loader=None, min_bytes=STREAM_MIN_BYTES):
+    # DataFrames of at most chunksize rows holding only usecols (every column when None)
+    usecols = list(dict.fromkeys(usecols)) if usecols is not None else None
+    if loader is None and file_path.lower().endswith('.xlsx'):
+        yield from iter_excel_chunks(file_path, usecols if usecols != [] else [0], chunksize)
+        return
+    if loader is None or should_stream(file_path, min_bytes):
+        if not file_path.lower().endswith('.csv'):
+            raise ValueError(f"Unsupported file format for {os.path.basename(file_path)}")
+        # Row counts alone still need one column to count
+        yield from pd.read_csv(file_path, usecols=usecols if usecols != [] else [0], chunksize=chunksize)
+        return
+
+    df = loader(file_path)
+    if usecols is not None:
+        missing = [column for column in usecols if column not in df.columns]
+        if missing:
+            raise ValueError(f"Columns {missing} not found in {os.path.basename(file_path)}")
+        df = df[usecols] if usecols else df.iloc[:, :1]
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def scan(file_path, aggregators, chunksize=CHUNK_ROWS, loader=None, progress_callback=None, min_bytes=STREAM_MIN_BYTES):
+    # One pass over the file feeding every aggregator; returns their results in order.
+    # progress_callback(rows) runs after each chunk, so a job can report or cancel between chunks.
+    usecols = [column for aggregator in aggregators for column in aggregator.columns]
+    rows = 0
+    with span('scan', file=os.path.basename(file_path), streamed=should_stream(file_path, min_bytes), columns=len(usecols)) as scan_span:
+        for chunk in iter_chunks(file_path, usecols, chunksize, loader, min_bytes):
+            for aggregator in aggregators:
+                aggregator.update(chunk)
+            rows += len(chunk)
+            if progress_callback:
+                progress_callback(rows)
+        scan_span.add(rows=rows)
+        return [aggregator.result() for aggregator in aggregators]
+
+
+class RowCounter:
+    def __init__(self):
+        self.columns = []
+        self.rows = 0
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+
+    def result(self):
+        return self.rows
+
+
+class ValueCounter:
+    # Exact value counts; state is one entry per distinct value
+    def __init__(self, column, dropna=True):
+        self.columns = [column]
+        self.column = column
+        self.dropna = dropna
+        self.numeric = True
+        self._counts = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def update(self, chunk):
+        values = chunk[self.column]
+        dtype = values.cat.categories.dtype if isinstance(values.dtype, pd.CategoricalDtype) else values.dtype
+        self.numeric = self.numeric and pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+        counts = values.value_counts(dropna=self.dropna, sort=False)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Counted on the codes; unused categories are dropped and the values kept as plain values
+            counts = counts[counts > 0]
+            counts.index = pd.Index(counts.index.to_numpy(), name=counts.index.name)
+        self._pending.append(counts)
+        self._pending_rows += len(counts)
+        # Chunks are combined in batches so the running totals are not re-aligned on every chunk
+        if self._pending_rows >= _COUNTS_FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        if self._counts is not None:
+            self._pending.append(self._counts)
+        combined = pd.concat(self._pending)
+        self._counts = combined.groupby(level=0, dropna=self.dropna, sort=False).sum()
+        self._pending = []
+        self._pending_rows = 0
+
+    def result(self):
+        self._flush()
+        if self._counts is None:
+            return pd.Series([], dtype='int64', name='count')
+        return self._counts.astype('int64').sort_values(ascending=False, kind='stable')
+
+
+class ColumnProfile:
+    # The sketches.profile_column profile of a column, built from counts accumulated over chunks
+    def __init__(self, column, keep_hashes=False):
+        self.columns = [column]
+        self.keep_hashes = keep_hashes
+        self._counter = ValueCounter(column)
+
+    def update(self, chunk):
+        self._counter.update(chunk)
+
+    def result(self):
+        counts = self._counter.result()
+        return profile_counts(counts.index, counts.to_numpy(), self._counter.numeric and len(counts) > 0, self.keep_hashes)
+
+
+class DistinctSketch:
+    # Distinct-value sketches only (MinHash, bottom-k sample, HyperLogLog); fixed-size state
+    def __init__(self, column):
+        self.columns = [column]
+        self.column = column
+        self.count = 0
+        self.minhash = minhash_signature(np.empty(0, dtype=np.uint64))
+        self.hll = hll_registers(np.empty(0, dtype=np.uint64))
+        self.sample = np.empty(0, dtype=np.uint64)
+
+    def update(self, chunk):
+        values = chunk[self.column].dropna()
+        self.count += len(values)
+        hashes = np.unique(canonical_hashes(pd.Series(pd.unique(values)))) if len(values) else np.empty(0, dtype=np.uint64)
+        self.minhash = merge_minhash(self.minhash, minhash_signature(hashes))
+        self.hll = merge_hll(self.hll, hll_registers(hashes))
+        self.sample = value_sample(np.union1d(self.sample, hashes))
+
+    def result(self):
+        return {'count': self.count, 'distinct': hll_estimate(self.hll), 'minhash': self.minhash,
+                'sample': self.sample, 'hll': self.hll}
+
+
+class KeyPresence:
+    # How many rows carry a key from a reference set, and how many of those keys were seen
+    def __init__(self, column, keys):
+        self.columns = [column]
+        self.column = column
+        keys = pd.Series(keys).dropna()
+        self.keys = np.unique(canonical_hashes(keys)) if len(keys) else np.empty(0, dtype=np.uint64)
+        self.seen = np.zeros(len(self.keys), dtype=bool)
+        self.rows = 0
+        self.present = 0
+
+    def update(self, chunk):
+        values = chunk[self.column]
+        self.rows += len(values)
+        values = values.dropna()
+        hashes = canonical_hashes(values) if len(values) else np.empty(0, dtype=np.uint64)
+        found = _contains(self.keys, hashes)
+        self.present += int(found.sum())
+        self.seen[np.searchsorted(self.keys, hashes[found])] = True
+
+    def result(self):
+        return {'rows': self.rows, 'present': self.present, 'absent': self.rows - self.present,
+                'keys_seen': int(self.seen.sum()), 'keys_total': len(self.keys)}
+
+
+def profile_file(file_path, columns=None, keep_hashes=False, loader=None, chunksize=CHUNK_ROWS, min_bytes=STREAM_MIN_BYTES):
+    # {column: profile} for a file, streamed when it is large and parsed whole (and cached) otherwise
+    if loader is not None and not should_stream(file_path, min_bytes):
+        df = loader(file_path)
+        columns = df.columns if columns is None else columns
+        return {column: profile_column(df[column], keep_hashes) for column in columns}
+
+    if columns is None:
+        columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+    aggregators = [ColumnProfile(column, keep_hashes) for column in columns]
+    return dict(zip(columns, scan(file_path, aggregators, chunksize, None, None, min_bytes)))
@@ -0,0 +1,283 @@
+import atexit
+import csv
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stage profiler. Operations open spans around their stages (staging, parsing, verification,
+# scoring, preview, merging); each finished span records its duration, the rows and bytes it
+# processed, the file it worked on and the peak memory allocated while it ran. Spans nest per
+# thread, so a stage's per-file spans sit under it in the trace.
+#
+# Tracing is off unless enabled, and then span() hands back one shared do-nothing span, so an
+# instrumented operation costs a function call and a flag check. Set MERGER_TRACE to a path to
+# trace a whole session: the Chrome trace (open it in chrome://tracing or ui.perfetto.dev) is
+# written there on exit and a summary table is printed. MERGER_TRACE_MEMORY=0 skips tracemalloc,
+# which slows allocation-heavy code down, and keeps only the process's peak RSS.
+
+TRACE_ENV = "MERGER_TRACE"
+TRACE_MEMORY_ENV = "MERGER_TRACE_MEMORY"
+MAX_EVENTS = 1_000_000
+
+_enabled = False
+_trace_memory = False
+_started_tracemalloc = False
+_origin = time.perf_counter()
+_events = []
+_dropped = 0
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _NullSpan:
+    # Stands in for a span while tracing is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, rows=0, bytes=0):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, name, file=None, attrs=None):
+        self.name = name
+        self.file = file
+        self.attrs = attrs or {}
+        self.rows = 0
+        self.bytes = 0
+        self._parent = None
+        self._peak = 0
+        self._base_memory = 0
+
+    def add(self, rows=0, bytes=0):
+        # Counted work; may be called many times, e.g. once per chunk
+        self.rows += rows
+        self.bytes += bytes
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self._parent = stack[-1] if stack else None
+        stack.append(self)
+        if _trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._parent is not None:
+                # The parent's peak so far must survive the reset below
+                self._parent._peak = max(self._parent._peak, peak)
+            tracemalloc.reset_peak()
+            self._base_memory = self._peak = current
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        peak_memory = None
+        if _trace_memory and tracemalloc.is_tracing():
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            peak_memory = self._peak - self._base_memory
+            if self._parent is not None:
+                self._parent._peak = max(self._parent._peak, self._peak)
+        stack = _local.stack
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        event = {
+            'name': self.name, 'file': self.file, 'start': self._start - _origin, 'duration': end - self._start,
+            'rows': self.rows, 'bytes': self.bytes, 'peak_memory': peak_memory,
+            'max_rss': _max_rss(), 'thread': threading.get_ident(), 'thread_name': threading.current_thread().name,
+            'parent': self._parent.name if self._parent is not None else None,
+            'error': exc_type.__name__ if exc_type is not None else None, 'attrs': self.attrs,
+        }
+        _record(event)
+        return False
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _record(event):
+    global _dropped
+    with _lock:
+        if len(_events) < MAX_EVENTS:
+            _events.append(event)
+        else:
+            _dropped += 1
+
+
+def span(name, file=None, rows=0, bytes=0, **attrs):
+    # with span('parse', file=filename) as s: ...; s.add(rows=len(df))
+    if not _enabled:
+        return _NULL_SPAN
+    current = Span(name, file, attrs)
+    current.add(rows, bytes)
+    return current
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(memory=True):
+    # Start recording spans; memory=True also traces allocations for per-span peak memory
+    global _enabled, _trace_memory, _started_tracemalloc
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _trace_memory = memory
+    _enabled = True
+
+
+def disable():
+    global _enabled, _trace_memory, _started_tracemalloc
+    _enabled = False
+    _trace_memory = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def clear():
+    global _dropped
+    with _lock:
+        _events.clear()
+        _dropped = 0
+
+
+def events():
+    # Finished spans in the order they ended
+    with _lock:
+        return list(_events)
+
+
+def summary(by='name'):
+    # One row per stage (by='name') or per stage and file (by='file'), slowest first
+    if by not in ('name', 'file'):
+        raise ValueError(f"Unsupported summary grouping: {by}")
+    rows = {}
+    for event in events():
+        group = (event['name'],) if by == 'name' else (event['name'], event['file'])
+        row = rows.get(group)
+        if row is None:
+            row = rows[group] = {'name': event['name'], 'file': event['file'], 'calls': 0, 'total_seconds': 0.0,
+                                 'mean_seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'bytes': 0, 'rows_per_second': None,
+                                 'bytes_per_second': None, 'peak_memory': None, 'errors': 0}
+            if by == 'name':
+                del row['file']
+        row['calls'] += 1
+        row['total_seconds'] += event['duration']
+        row['max_seconds'] = max(row['max_seconds'], event['duration'])
+        row['rows'] += event['rows']
+        row['bytes'] += event['bytes']
+        row['errors'] += event['error'] is not None
+        if event['peak_memory'] is not None:
+            row['peak_memory'] = max(row['peak_memory'] or 0, event['peak_memory'])
+
+    result = sorted(rows.values(), key=lambda row: -row['total_seconds'])
+    for row in result:
+        row['mean_seconds'] = row['total_seconds'] / row['calls']
+        seconds = row['total_seconds']
+        row['rows_per_second'] = row['rows'] / seconds if seconds and row['rows'] else None
+        row['bytes_per_second'] = row['bytes'] / seconds if seconds and row['bytes'] else None
+    return result
+
+
+def summary_table(by='name'):
+    # The summary as fixed-width text for a console or a bug report
+    columns = (['file'] if by == 'file' else []) + ['calls', 'total_seconds', 'mean_seconds', 'max_seconds', 'rows', 'bytes', 'peak_memory']
+    headers = ['stage', *columns]
+    lines = []
+    for row in summary(by):
+        cells = [row['name']]
+        for column in columns:
+            value = row[column]
+            if value is None:
+                cells.append('-')
+            elif column.endswith('seconds'):
+                cells.append(f"{value:.3f}")
+            elif column in ('bytes', 'peak_memory'):
+                cells.append(f"{value / 1024 ** 2:.1f} MiB")
+            elif isinstance(value, int):
+                cells.append(f"{value:,}")
+            else:
+                cells.append(str(value))
+        lines.append(cells)
+    widths = [max(len(cells[i]) for cells in [headers] + lines) for i in range(len(headers))]
+    text = [" ".join(header.ljust(width) for header, width in zip(headers, widths))]
+    text += [" ".join(cell.ljust(width) if i == 0 or (by == 'file' and i == 1) else cell.rjust(width)
+                      for i, (cell, width) in enumerate(zip(cells, widths)))
+             for cells in lines]
+    if _dropped:
+        text.append(f"({_dropped} spans past the first {MAX_EVENTS} were not recorded)")
+    return "\n".join(text)
+
+
+def export_chrome_trace(path):
+    # Trace Event Format: one complete ("X") event per span, plus thread names
+    pid = os.getpid()
+    trace_events = []
+    threads = {}
+    for event in events():
+        threads[event['thread']] = event['thread_name']
+        args = {key: event[key] for key in ('file', 'rows', 'bytes', 'peak_memory', 'max_rss', 'error') if event[key] is not None}
+        args.update(event['attrs'])
+        trace_events.append({'name': event['name'], 'cat': 'merger', 'ph': 'X', 'pid': pid, 'tid': event['thread'],
+                             'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6, 'args': args})
+    for tid, thread_name in threads.items():
+        trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, default=str)
+    return path
+
+
+def export_summary(path, by='name'):
+    # .csv: the summary rows; .json: summary rows and raw spans; anything else: the text table
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        rows = summary(by)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['name'])
+            writer.writeheader()
+            writer.writerows(rows)
+    elif lower.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary(by), 'spans': events()}, f, indent=2, default=str)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(summary_table(by) + "\n")
+    return path
+
+
+def _export_on_exit(path):
+    if not events():
+        return
+    export_chrome_trace(path)
+    print(summary_table())
+    print(f"Trace written to {path}")
+
+
+if os.environ.get(TRACE_ENV):
+    enable(memory=os.environ.get(TRACE_MEMORY_ENV, "1") != "0")
+    atexit.register(_export_on_exit, os.path.abspath(os.environ[TRACE_ENV]))
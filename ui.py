@@ -1,22 +1,33 @@
 import os
 import glob
-import pandas as pd
 import tkinter as tk
-from tkinter import simpledialog
 from tkinter import filedialog, ttk, messagebox
-from operations import copy_files_to_temp, setup_temp_directory, load_file, setup_treeview, select_all_files, verify_key_column, find_similar_columns
+from jobs import JobExecutor
+from staging import stage_files
+from overlap import key_overlap, export_overlap_report
+from tracing import span, is_enabled, export_chrome_trace, export_summary
+from writers import write_frame
+from operations import setup_temp_directory, load_file, setup_treeview, select_all_files, verify_key_column, find_similar_columns_progressive, merge_files, probe_file_schema
 
 class DataMatcherApp:
-    def __init__(self, root):
+    def __init__(self, root, temp_cleanup=None):
         self.root = root
         self.temp_dir = setup_temp_directory()
+        # Startup may still be clearing the temp directory on this thread; staging joins it first
+        self.temp_cleanup = temp_cleanup
         print("Temporary directory path:", self.temp_dir)
         self.df = None
         self.master_key_file = None
         self.key_column = None
         self.notebook = ttk.Notebook(self.root)
         self.add_key_vars = {}
+        self.step5 = None
+        # Long operations run as background jobs; their callbacks come back on the Tk loop
+        self.jobs = JobExecutor()
+        self.jobs.attach(self.root)
         self.setup_ui()
+        # With tracing on (MERGER_TRACE), Ctrl+Shift+T saves the spans recorded so far
+        self.root.bind_all('<Control-T>', lambda e: self.save_trace())
 
     def setup_ui(self):
         self.notebook = ttk.Notebook(self.root)
@@ -48,6 +59,13 @@ class DataMatcherApp:
         ttk.Button(self.step2, text="Confirm File Selection", command=self.on_file_confirm).pack()
 
     def setup_step3(self):
+        filter_frame = ttk.Frame(self.step3)
+        filter_frame.pack(fill='x', pady=(10, 0))
+        ttk.Label(filter_frame, text="Filter rows:").pack(side='left')
+        self.filter_entry = ttk.Entry(filter_frame)
+        self.filter_entry.pack(side='left', fill='x', expand=True, padx=5)
+        self.filter_entry.bind('<Return>', lambda e: self.apply_preview_filter())
+
         self.treeview = ttk.Treeview(self.step3)
         self.treeview.pack(fill='both', expand=True, pady=20)
         ttk.Label(self.step3, text="Select the key column:").pack(pady=10)
@@ -55,6 +73,11 @@ class DataMatcherApp:
         self.column_selector.pack(fill='x', expand=True, pady=20)
         ttk.Button(self.step3, text="Choose Column", command=self.confirm_column_selection).pack()
 
+    def apply_preview_filter(self):
+        preview = getattr(self.treeview, 'virtual_preview', None)
+        if preview is not None and preview.model is not None:
+            preview.set_filter(self.filter_entry.get())
+
     def confirm_column_selection(self):
         selected_column = self.column_selector.get()
         if selected_column and selected_column in self.df.columns:
@@ -66,7 +89,10 @@ class DataMatcherApp:
             messagebox.showerror("Error", "The selected column does not exist in the file.")
 
     def setup_step4(self):
-        print("Setting up step 4...")
+        with span('setup_step4'):
+            self._setup_step4()
+
+    def _setup_step4(self):
         self.file_checkbuttons = {}
         self.file_vars = {}
         label = ttk.Label(self.step4, text="Select files to merge:")
@@ -86,7 +112,6 @@ class DataMatcherApp:
         scroll_canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
         scroll_canvas.configure(yscrollcommand=scrollbar.set)
 
-        print("Populating files...")
         self.populate_files(scrollable_frame)
 
         select_all_button = ttk.Button(self.step4, text="Select All", command=lambda: select_all_files(self.file_vars))
@@ -99,42 +124,65 @@ class DataMatcherApp:
         scroll_frame.pack(fill="both", expand=True)
         scroll_canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
-        print("Step 4 setup complete.")
 
 
     def populate_files(self, parent_widget):
-        print("Populating files in the temporary directory...")
         temp_directory = self.temp_dir
-        print("Temporary directory:", temp_directory)
         file_pattern = os.path.join(temp_directory, "*")
-        files = glob.glob(file_pattern)
-        print("File pattern:", file_pattern)
-        print("Files found:", files)
-
-        if not files:
-            label = ttk.Label(parent_widget, text="No Excel files found in the temporary directory.")
-            label.pack(anchor='w', padx=10, pady=2)
-        else:
-            for file_path in files:
-                filename = os.path.basename(file_path)
-                var = tk.BooleanVar(value=False)  # Initialize BooleanVar with False
-                chk = ttk.Checkbutton(parent_widget, text=filename, variable=var)
-                chk.pack(anchor='w', padx=10, pady=2)
-                self.file_checkbuttons[filename] = chk
-                self.file_vars[filename] = var  # Store the BooleanVar associated with the filename
+        with span('populate_files', pattern=file_pattern) as populate:
+            files = glob.glob(file_pattern)
+            populate.set(files=len(files))
 
-        print("File population complete.")
+            if not files:
+                label = ttk.Label(parent_widget, text="No Excel files found in the temporary directory.")
+                label.pack(anchor='w', padx=10, pady=2)
+            else:
+                for file_path in files:
+                    filename = os.path.basename(file_path)
+                    var = tk.BooleanVar(value=False)  # Initialize BooleanVar with False
+                    chk = ttk.Checkbutton(parent_widget, text=filename, variable=var)
+                    chk.pack(anchor='w', padx=10, pady=2)
+                    self.file_checkbuttons[filename] = chk
+                    self.file_vars[filename] = var  # Store the BooleanVar associated with the filename
 
 
     def setup_step5(self, notebook, selected_files, master_key_file, key_column):
-        # Initialize the frame for step 5 first
+        # Initialize the frame for step 5 first, replacing the one from an earlier run
+        if self.step5 is not None:
+            notebook.forget(self.step5)
+            self.step5.destroy()
         step5 = ttk.Frame(notebook)
+        self.step5 = step5
         notebook.add(step5, text='5. Review and Confirm')
         notebook.select(step5)  # Now, it's correct to select the step5 as it has been defined
 
+        status_label = ttk.Label(step5, text="Scoring files...")
+        status_label.pack(pady=5)
+        score_progress = ttk.Progressbar(step5, orient="horizontal", length=200, mode="determinate", maximum=max(len(selected_files), 1))
+        score_progress.pack(pady=5)
+
+        def on_progress(event):
+            score_progress['value'] = event['done']
+            status_label['text'] = f"Scored {event['message']} ({event['done']}/{event['total']})"
+
+        def on_result(result):
+            suggestions, low_similarity_files, report = result
+            status_label.destroy()
+            score_progress.destroy()
+            self.show_review(step5, suggestions, low_similarity_files, key_column, report)
+
+        def on_error(error):
+            status_label['text'] = "Scoring failed."
+            messagebox.showerror("Error", str(error))
+
         # Use the function to get suggested columns
-        suggestions, low_similarity_files = find_similar_columns(selected_files, master_key_file, key_column, key_column)
+        self.jobs.submit(
+            lambda job: find_similar_columns_progressive(
+                selected_files, self.temp_dir, master_key_file, key_column,
+                progress_callback=lambda done, total, filename, details: job.report(done, total, filename, (filename, details))),
+            name="score", group="score", on_progress=on_progress, on_result=on_result, on_error=on_error)
 
+    def show_review(self, step5, suggestions, low_similarity_files, key_column, report):
         # Setup the UI components
         scroll_frame = ttk.Frame(step5)
         scroll_canvas = tk.Canvas(scroll_frame)
@@ -145,7 +193,7 @@ class DataMatcherApp:
         scroll_canvas.configure(yscrollcommand=scrollbar.set)
 
         # Populate the scrollable area with file selections and suggestions
-        self.populate_review_area(scrollable_frame, suggestions, low_similarity_files, key_column)
+        self.populate_review_area(scrollable_frame, suggestions, low_similarity_files, key_column, report)
 
         scroll_frame.pack(fill="both", expand=True)
         scroll_canvas.pack(side="left", fill="both", expand=True)
@@ -155,10 +203,14 @@ class DataMatcherApp:
         add_key_button = ttk.Button(step5, text="Add New Key Column", command=lambda: messagebox.showinfo("Info", "Feature not implemented yet"))
         add_key_button.pack(side="right", padx=10, pady=5)
 
-        master_key_path = os.path.join(temp_dir, master_key_file)
-        suggestions, low_similarity_files = find_similar_columns(selected_files, temp_dir, master_key_path, key_column)
+        merge_button = ttk.Button(step5, text="Merge Files", command=self.merge_selected_files)
+        merge_button.pack(side="right", padx=10, pady=5)
 
-    def populate_review_area(self, parent_widget, suggestions, low_similarity_files, default_key_column):
+        overlap_button = ttk.Button(step5, text="Key Overlap", command=self.show_key_overlap)
+        overlap_button.pack(side="right", padx=10, pady=5)
+
+    def populate_review_area(self, parent_widget, suggestions, low_similarity_files, default_key_column, report=None):
+        self.review_dropdowns = {}
         for file_path, suggested_column in suggestions:
             frame = ttk.Frame(parent_widget)
             frame.pack(fill="x", padx=10, pady=2)
@@ -169,6 +221,15 @@ class DataMatcherApp:
             dropdown = ttk.Combobox(frame, values=[suggested_column])
             dropdown.set(suggested_column)
             dropdown.pack(side="left")
+            self.review_dropdowns[file_path] = dropdown
+
+            # How sure the detector is, and whether it decided on a sample of the rows
+            if report and file_path in report:
+                details = report[file_path]
+                text = f"{details['confidence']:.0%} confident"
+                if details['sampled']:
+                    text += f" (first {details['rows_scanned']:,} rows)"
+                ttk.Label(frame, text=text).pack(side="left", padx=(5, 0))
 
             # Display warning if the file is in the low similarity list
             if file_path in low_similarity_files:
@@ -181,6 +242,77 @@ class DataMatcherApp:
 
 
 
+    def review_key_columns(self):
+        # The master file always comes first so its key column names the merged key
+        master_file = os.path.basename(self.master_key_file)
+        key_columns = {master_file: self.key_column}
+        for filename, dropdown in self.review_dropdowns.items():
+            if filename != master_file:
+                key_columns[filename] = dropdown.get()
+        return key_columns
+
+    def show_key_overlap(self):
+        key_columns = self.review_key_columns()
+        files = list(key_columns)
+
+        def on_report(report):
+            window = tk.Toplevel(self.root)
+            window.title("Key Overlap")
+            tables = {"Shared keys": 'shared', "Orphan keys (row file only)": 'orphans',
+                      "Rows matched": 'matched_rows', "Inner join rows": 'join_rows', "Per file": 'files'}
+
+            controls = ttk.Frame(window)
+            controls.pack(fill="x", padx=10, pady=5)
+            table_selector = ttk.Combobox(controls, values=list(tables), state="readonly")
+            table_selector.set("Shared keys")
+            table_selector.pack(side="left")
+
+            tree_frame = ttk.Frame(window)
+            tree_frame.pack(fill="both", expand=True, padx=10, pady=5)
+            treeview = ttk.Treeview(tree_frame, height=15)
+            treeview.pack(side="left", fill="both", expand=True)
+
+            def show_table(event=None):
+                setup_treeview(report[tables[table_selector.get()]].reset_index(), treeview)
+
+            def export():
+                output_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("JSON", "*.json")])
+                if output_path:
+                    try:
+                        export_overlap_report(report, output_path)
+                    except Exception as e:
+                        messagebox.showerror("Export Error", str(e))
+
+            table_selector.bind("<<ComboboxSelected>>", show_table)
+            ttk.Button(controls, text="Export...", command=export).pack(side="right")
+            show_table()
+
+        self.jobs.submit(
+            lambda job: key_overlap(files, self.temp_dir, key_columns), name="overlap", group="overlap",
+            on_result=on_report, on_error=lambda error: messagebox.showerror("Key Overlap Error", str(error)))
+
+    def merge_selected_files(self):
+        key_columns = self.review_key_columns()
+        files = list(key_columns)
+
+        output_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx"), ("Parquet", "*.parquet")])
+        if not output_path:
+            return
+        output_format = os.path.splitext(output_path)[1].lstrip('.').lower()
+        if output_format not in ('xlsx', 'parquet'):
+            output_format = 'csv'
+
+        def merge_and_save(job):
+            merged = merge_files(files, self.temp_dir, key_columns)
+            job.check_cancelled()
+            write_frame(merged, output_path, output_format)
+            return len(merged)
+
+        self.jobs.submit(
+            merge_and_save, name="merge", group="merge",
+            on_result=lambda rows: messagebox.showinfo("Merge Complete", f"Merged {len(files)} files into {rows} rows."),
+            on_error=lambda error: messagebox.showerror("Merge Error", str(error)))
+
     # Step utils
     def confirm_multi_file_selection(self):
         # Collect all filenames for which the corresponding variable in file_vars is True (checked)
@@ -190,16 +322,21 @@ class DataMatcherApp:
             messagebox.showerror("Error", "No files selected. Please select at least one file before confirming.")
             return
 
-        # Verify if the key column exists in all selected files
-        missing_key_files, errors = verify_key_column(selected_files, self.temp_dir, self.key_column)
+        def on_verified(result):
+            missing_key_files, errors = result
+            if missing_key_files:
+                messagebox.showinfo("Missing Key Column", "Missing key column in files: " + ', '.join(missing_key_files))
+            if errors:
+                messagebox.showerror("File Load Error", "\n".join(errors))
 
-        if missing_key_files:
-            messagebox.showinfo("Missing Key Column", "Missing key column in files: " + ', '.join(missing_key_files))
-        if errors:
-            messagebox.showerror("File Load Error", "\n".join(errors))
+            # Corrected call to setup_step5
+            self.setup_step5(self.notebook, selected_files, self.master_key_file, self.key_column)
 
-        # Corrected call to setup_step5
-        self.setup_step5(self.notebook, selected_files, self.master_key_file, self.key_column)
+        # Verify if the key column exists in all selected files
+        self.jobs.submit(
+            lambda job: verify_key_column(selected_files, self.temp_dir, self.key_column),
+            name="verify", group="verify", on_result=on_verified,
+            on_error=lambda error: messagebox.showerror("File Load Error", str(error)))
 
 
     def prompt_for_file_selection_for_key_column(self, missing_key_files):
@@ -264,20 +401,21 @@ class DataMatcherApp:
             target_file_listbox.insert(tk.END, file_name)
             source_file_listbox.insert(tk.END, file_name)
 
-        def load_columns_for_file(event, listbox, column_selector):
+        def load_columns_for_file(event, listbox, *column_selectors):
             selected_index = listbox.curselection()
             if selected_index:
                 selected_file = listbox.get(selected_index[0])
                 file_path = os.path.join(self.temp_dir, selected_file)
-                try:
-                    df = pd.read_excel(file_path, nrows=0) if file_path.endswith('.xlsx') else pd.read_csv(file_path, nrows=0)
-                    column_selector['values'] = df.columns.tolist()
-                except Exception as e:
-                    messagebox.showerror("Error", f"Unable to load columns from {selected_file}: {str(e)}")
+                # Only the header row is read to fill the column dropdowns
+                probe = probe_file_schema(file_path)
+                if probe['error']:
+                    messagebox.showerror("Error", f"Unable to load columns from {selected_file}: {probe['error']}")
+                    return
+                for column_selector in column_selectors:
+                    column_selector['values'] = probe['columns']
 
         target_file_listbox.bind('<<ListboxSelect>>', lambda e: load_columns_for_file(e, target_file_listbox, target_id_column_selector))
-        source_file_listbox.bind('<<ListboxSelect>>', lambda e: load_columns_for_file(e, source_file_listbox, source_id_column_selector))
-        source_file_listbox.bind('<<ListboxSelect>>', lambda e: load_columns_for_file(e, source_file_listbox, key_column_selector))
+        source_file_listbox.bind('<<ListboxSelect>>', lambda e: load_columns_for_file(e, source_file_listbox, source_id_column_selector, key_column_selector))
 
         # Confirm button
         def confirm_single_file_selection(self):
@@ -296,8 +434,31 @@ class DataMatcherApp:
     def select_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
-            copy_files_to_temp(folder_path, self.temp_dir, self.progress, self.file_listbox, self.root)
-            self.notebook.select(self.step2)  # Move to next step
+            self.progress['value'] = 0
+
+            def on_progress(event):
+                self.progress['maximum'] = max(event['total'], 1)
+                self.progress['value'] = event['done']
+
+            def on_staged(result):
+                filenames, _ = result
+                self.file_listbox.delete(0, tk.END)
+                for filename in filenames:
+                    self.file_listbox.insert(tk.END, filename)
+                self.progress['value'] = 0
+                self.notebook.select(self.step2)  # Move to next step
+
+            def stage(job):
+                # Staging runs one at a time on the shared temp directory
+                job.wait_superseded()
+                if self.temp_cleanup is not None:
+                    self.temp_cleanup.join()
+                return stage_files(folder_path, self.temp_dir, progress_callback=lambda done, total, filename: job.report(done, total, filename))
+
+            # Choosing another folder supersedes a staging run that is still going
+            self.jobs.submit(
+                stage, name="stage", group="stage", on_progress=on_progress, on_result=on_staged,
+                on_error=lambda error: messagebox.showerror("Error", f"Failed to stage files: {error}"))
 
     def update_file_listbox(self):
         self.file_listbox.delete(0, tk.END)
@@ -312,11 +473,31 @@ class DataMatcherApp:
         if selection:
             file_name = self.file_listbox.get(selection[0])
             file_path = os.path.join(self.temp_dir, file_name)
-            self.master_key_file=file_path
-            self.df, error = load_file(file_path)
-            if self.df is not None:
-                self.column_selector['values'] = self.df.columns.tolist()
-                self.notebook.select(self.step3)  # Move to next step
-                setup_treeview(self.df, self.treeview)  # Setup Treeview with DataFrame
+
+            def on_loaded(result):
+                df, error = result
+                if df is not None:
+                    self.master_key_file = file_path
+                    self.df = df
+                    self.column_selector['values'] = self.df.columns.tolist()
+                    self.notebook.select(self.step3)  # Move to next step
+                    setup_treeview(self.df, self.treeview)  # Setup Treeview with DataFrame
+                else:
+                    messagebox.showerror("Error", error)
+
+            # Picking another file cancels the load that is still in flight
+            self.jobs.submit(lambda job: load_file(file_path), name="load", group="load", on_result=on_loaded)
+
+    def save_trace(self):
+        if not is_enabled():
+            return
+        output_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Chrome trace", "*.json"), ("Summary table", "*.csv"), ("Text", "*.txt")])
+        if not output_path:
+            return
+        try:
+            if output_path.lower().endswith('.json'):
+                export_chrome_trace(output_path)
             else:
-                messagebox.showerror("Error", error)
\ No newline at end of file
+                export_summary(output_path, by='file')
+        except Exception as e:
+            messagebox.showerror("Trace Error", str(e))
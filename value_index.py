@@ -0,0 +1,162 @@
+import os
+import pickle
+from collections import defaultdict
+
+from operations import load_data_file
+from sketches import MINHASH_SIZE, profile_frame, jaccard_estimate, containment_estimate
+
+# Folder-wide index of which (file, column) pairs share values. Each column's MinHash
+# signature is cut into bands; columns that agree on any whole band land in the same bucket,
+# so a lookup only scores the few columns it collides with instead of every column in the folder.
+# Banding finds columns with similar value sets; a small column contained in a much larger
+# one is found through an inverted index over the columns' coordinated value samples.
+
+INDEX_DIR_NAME = ".index"
+INDEX_FILE_NAME = "value_index.pkl"
+DEFAULT_BANDS = 64  # 64 bands of 2 rows: pairs with a Jaccard of ~0.15 or more almost always collide
+STOP_POSTING_SIZE = 1000  # values sampled by this many columns (0, 1, "Y", ...) say nothing about joins
+
+
+class ValueIndex:
+    def __init__(self, index_path=None, bands=DEFAULT_BANDS):
+        if MINHASH_SIZE % bands:
+            raise ValueError(f"bands must divide the signature size {MINHASH_SIZE}")
+        self.index_path = index_path
+        self.bands = bands
+        self.rows = MINHASH_SIZE // bands
+        self.files = {}  # filename -> {'size', 'mtime_ns', 'columns': {column: sketch}}
+        self.buckets = [defaultdict(set) for _ in range(bands)]
+        self.postings = defaultdict(set)  # sampled value hash -> {(file, column)}
+
+    @classmethod
+    def open(cls, temp_dir, bands=DEFAULT_BANDS):
+        # Load the index persisted next to the staged files, or start an empty one
+        index_path = os.path.join(temp_dir, INDEX_DIR_NAME, INDEX_FILE_NAME)
+        try:
+            with open(index_path, 'rb') as f:
+                index = pickle.load(f)
+            if isinstance(index, cls) and index.bands == bands:
+                index.index_path = index_path
+                return index
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+        return cls(index_path, bands)
+
+    def save(self):
+        if self.index_path is None:
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+
+    def _band_keys(self, signature):
+        return [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def add_file(self, filename, df, size=None, mtime_ns=None):
+        self.remove_file(filename)
+        columns = {}
+        for column, profile in profile_frame(df).items():
+            if not profile['count']:
+                continue  # Empty columns share nothing and would all collide
+            sketch = {key: profile[key] for key in ('count', 'distinct', 'minhash', 'sample')}
+            columns[column] = sketch
+            for band, key in enumerate(self._band_keys(sketch['minhash'])):
+                self.buckets[band][key].add((filename, column))
+            for value in sketch['sample'].tolist():
+                self.postings[value].add((filename, column))
+        self.files[filename] = {'size': size, 'mtime_ns': mtime_ns, 'columns': columns}
+
+    def remove_file(self, filename):
+        entry = self.files.pop(filename, None)
+        if entry is None:
+            return
+        for column, sketch in entry['columns'].items():
+            for band, key in enumerate(self._band_keys(sketch['minhash'])):
+                bucket = self.buckets[band].get(key)
+                if bucket is not None:
+                    bucket.discard((filename, column))
+                    if not bucket:
+                        del self.buckets[band][key]
+            for value in sketch['sample'].tolist():
+                posting = self.postings.get(value)
+                if posting is not None:
+                    posting.discard((filename, column))
+                    if not posting:
+                        del self.postings[value]
+
+    def update(self, temp_dir, loader=load_data_file, filenames=None):
+        # Re-profile only files that are new or changed since they were indexed; returns their names
+        if filenames is None:
+            filenames = [name for name in os.listdir(temp_dir)
+                         if not name.startswith('.') and name.lower().endswith(('.csv', '.xlsx'))]
+
+        for filename in list(self.files):
+            if filename not in filenames:
+                self.remove_file(filename)
+
+        changed = []
+        for filename in sorted(filenames):
+            file_path = os.path.join(temp_dir, filename)
+            stat = os.stat(file_path)
+            entry = self.files.get(filename)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                continue
+            self.add_file(filename, loader(file_path), stat.st_size, stat.st_mtime_ns)
+            changed.append(filename)
+
+        if changed or len(self.files) != len(filenames):
+            self.save()
+        return changed
+
+    def candidates(self, sketch):
+        found = set()
+        for band, key in enumerate(self._band_keys(sketch['minhash'])):
+            found.update(self.buckets[band].get(key, ()))
+        for value in sketch['sample'].tolist():
+            posting = self.postings.get(value, ())
+            if len(posting) <= STOP_POSTING_SIZE:
+                found.update(posting)
+        return found
+
+    def query(self, filename, column, min_score=0.1):
+        # (file, column, jaccard, containment) of columns in other files sharing values with this one,
+        # best first; containment is the share of this column's values found in the other column
+        sketch = self.files[filename]['columns'][column]
+        return self.query_sketch(sketch, min_score, exclude_file=filename)
+
+    def query_sketch(self, sketch, min_score=0.1, exclude_file=None):
+        matches = []
+        for other_file, other_column in self.candidates(sketch):
+            if other_file == exclude_file:
+                continue
+            other = self.files[other_file]['columns'][other_column]
+            jaccard = jaccard_estimate(sketch, other)
+            containment = containment_estimate(other, sketch)
+            if max(jaccard, containment) >= min_score:
+                matches.append((other_file, other_column, jaccard, containment))
+        matches.sort(key=lambda match: (-max(match[2], match[3]), match[0], str(match[1])))
+        return matches
+
+    def join_graph(self, min_score=0.5):
+        # Every pair of columns in different files that look joinable, best edges first
+        edges = {}
+        for filename in sorted(self.files):
+            for column in self.files[filename]['columns']:
+                for other_file, other_column, jaccard, containment in self.query(filename, column, min_score):
+                    pair = tuple(sorted([(filename, column), (other_file, other_column)], key=str))
+                    score = max(jaccard, containment)
+                    if pair not in edges or edges[pair][2] < score:
+                        edges[pair] = (jaccard, containment, score)
+
+        graph = [(a[0], a[1], b[0], b[1], score) for (a, b), (_, _, score) in edges.items()]
+        graph.sort(key=lambda edge: (-edge[4], edge[0], str(edge[1]), edge[2], str(edge[3])))
+        return graph
+
+
+def build_value_index(temp_dir, bands=DEFAULT_BANDS):
+    # Open the folder's persisted index and bring it up to date with the staged files
+    index = ValueIndex.open(temp_dir, bands)
+    index.update(temp_dir)
+    return index
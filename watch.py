@@ -0,0 +1,311 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+from operations import (validate_file, load_data_file, load_key_profile, score_file_columns, join_frames,
+                        factorize_keys, _key_parts)
+from staging import stage_files
+from tracing import span
+from writers import write_frame
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # Polling only; inotify_simple is an optional, Linux-only dependency
+    INotify = None
+
+# Watch mode. A source folder that receives fresh exports is re-checked every few seconds (or
+# woken up by inotify), and only the files that were added, changed or removed are restaged,
+# rescored and reparsed. Every file's key choice, parsed frame and key factorization are kept
+# with the stamp (size, mtime) of the file they came from, so a refresh where one file changed
+# parses, scores and hashes that one file; the join is then redone from the cached key codes,
+# which costs a fraction of parsing the folder, and the output is replaced atomically.
+
+DEFAULT_INTERVAL = 5.0
+SETTLE_SECONDS = 1.0  # a file must keep its size and mtime this long before it is picked up
+
+
+def folder_snapshot(folder_path):
+    # {filename: (size, mtime_ns)} of the data files in a folder
+    snapshot = {}
+    for name in os.listdir(folder_path):
+        if name.startswith('.') or not validate_file(name.lower()):
+            continue
+        try:
+            stat = os.stat(os.path.join(folder_path, name))
+        except OSError:
+            continue  # Removed while listing
+        snapshot[name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def diff_snapshots(before, after):
+    added = sorted(set(after) - set(before))
+    removed = sorted(set(before) - set(after))
+    changed = sorted(name for name in after if name in before and after[name] != before[name])
+    return added, changed, removed
+
+
+class FolderWatcher:
+    # Reports what changed in a folder since the last poll. With inotify the wait ends as soon
+    # as something happens in the folder; otherwise it simply lasts the polling interval.
+    def __init__(self, folder_path, interval=DEFAULT_INTERVAL, settle=SETTLE_SECONDS, use_inotify=True):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.settle = settle
+        self.snapshot = {}
+        self.pending = set()  # files held back by the last poll because they were still changing
+        self._inotify = None
+        if use_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+                self._inotify.add_watch(folder_path, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM
+                                        | flags.DELETE | flags.ATTRIB | flags.MODIFY)
+            except OSError:
+                self._inotify = None
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def poll(self):
+        # (added, changed, removed) since the last poll; files still being written are held back
+        current = folder_snapshot(self.folder_path)
+        added, changed, removed = diff_snapshots(self.snapshot, current)
+        self.pending = set()
+        if (added or changed) and self.settle:
+            time.sleep(self.settle)
+            settled = folder_snapshot(self.folder_path)
+            for name in added + changed:
+                if settled.get(name) != current[name]:
+                    # Still growing: report it on a later poll
+                    self.pending.add(name)
+                    if name in self.snapshot:
+                        current[name] = self.snapshot[name]
+                    else:
+                        del current[name]
+            added, changed, removed = diff_snapshots(self.snapshot, current)
+        self.snapshot = current
+        return added, changed, removed
+
+    def wait(self, stop_event=None):
+        # Block until the folder may have changed, the interval passes or stop_event is set
+        if self._inotify is not None:
+            self._inotify.read(timeout=int(self.interval * 1000))
+        elif stop_event is not None:
+            stop_event.wait(self.interval)
+        else:
+            time.sleep(self.interval)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class WatchSession:
+    # Incremental state for one folder: the master key's profile, each file's scored key column
+    # and its parsed frame plus key codes, all keyed on the staged file's stamp.
+    # key_columns pins the key of some files ({filename: column}); the others use the column that
+    # scores best against the master key, as the wizard suggests. files limits the merge to
+    # those names; by default every data file in the folder takes part.
+    def __init__(self, folder_path, temp_dir, master_key_file, key_column, output_path=None, key_columns=None,
+                 how='inner', normalize=None, files=None):
+        self.folder_path = folder_path
+        self.temp_dir = temp_dir
+        self.master_key_file = master_key_file
+        self.key_column = key_column
+        self.output_path = output_path
+        self.key_columns = dict(key_columns or {})
+        self.how = how
+        self.normalize = normalize
+        self.files = list(files) if files is not None else None
+        self.key_profile = None
+        self.merged = None
+        self._key_stamp = None
+        self.scores = {}  # filename -> (stamp, column, score)
+        self._sides = {}  # filename -> (stamp, key column, frame, factorized keys)
+        self._failed = {}  # filename -> (stamp, error) of files that could not be scored or parsed
+        self._merged_files = None
+
+    def _stamp(self, filename):
+        stat = os.stat(os.path.join(self.temp_dir, filename))
+        return stat.st_size, stat.st_mtime_ns
+
+    def _fail(self, name, stamp, error, failed):
+        # A file that cannot be scored or parsed sits out until it changes again
+        self._failed[name] = (stamp, f"{type(error).__name__}: {error}")
+        failed[name] = self._failed[name][1]
+
+    def refresh(self, hold=()):
+        # Bring staging, scores and the merged output up to date; returns what was redone.
+        # Files in hold are still being written: they are not restaged, and keep their last
+        # parsed version in the merge (or stay out of it until they settle).
+        started = time.perf_counter()
+        with span('watch_refresh', folder=os.path.basename(os.path.abspath(self.folder_path))) as refresh_span:
+            held = {name for name in hold if name in self._sides}
+            filenames, restaged = stage_files(self.folder_path, self.temp_dir, skip=set(hold))
+            data_files = sorted(name for name in set(filenames) | held
+                                if validate_file(name.lower()) and (self.files is None or name in self.files))
+            if self.master_key_file not in data_files:
+                raise ValueError(f"Master file {self.master_key_file} not found in {self.folder_path}")
+            others = [name for name in data_files if name != self.master_key_file]
+
+            removed = [name for name in set(self.scores) | set(self._sides) | set(self._failed) if name not in data_files]
+            for name in removed:
+                self.scores.pop(name, None)
+                self._sides.pop(name, None)
+                self._failed.pop(name, None)
+
+            master_stamp = self._key_stamp if self.master_key_file in held else self._stamp(self.master_key_file)
+            if master_stamp != self._key_stamp:
+                # A new master key invalidates every score
+                self.key_profile = load_key_profile(self.temp_dir, self.master_key_file, self.key_column, self.normalize)
+                self._key_stamp = master_stamp
+                self.scores.clear()
+
+            rescored = []
+            failed = {}
+            for name in others:
+                if name in self.key_columns or name in held:
+                    continue
+                stamp = self._stamp(name)
+                if self._failed.get(name, (None,))[0] == stamp:
+                    failed[name] = self._failed[name][1]
+                    continue
+                cached = self.scores.get(name)
+                if cached is None or cached[0] != stamp:
+                    try:
+                        column, score = score_file_columns(os.path.join(self.temp_dir, name), self.key_profile, self.normalize)
+                    except Exception as e:
+                        self._fail(name, stamp, e, failed)
+                        continue
+                    self.scores[name] = (stamp, column, score)
+                    rescored.append(name)
+
+            key_columns = {self.master_key_file: self.key_column}
+            skipped = []
+            for name in others:
+                if name in failed:
+                    continue
+                # A held file keeps the key it was last merged on
+                column = self.key_columns.get(name) or (self._sides[name][1] if name in held else self.scores[name][1])
+                if column is None:
+                    skipped.append(name)  # Nothing in the file resembles the master key
+                else:
+                    key_columns[name] = column
+
+            reparsed = []
+            frames = []
+            factorized = []
+            for name, column in list(key_columns.items()):
+                side = self._sides.get(name)
+                stamp = side[0] if name in held else self._stamp(name)
+                if name != self.master_key_file and self._failed.get(name, (None,))[0] == stamp:
+                    failed[name] = self._failed[name][1]
+                    del key_columns[name]
+                    continue
+                if side is None or side[0] != stamp or side[1] != column:
+                    try:
+                        df = load_data_file(os.path.join(self.temp_dir, name))
+                        if any(part not in df.columns for part in _key_parts(column)):
+                            raise ValueError(f"Key column '{column}' not found in the file {name}")
+                        side = (stamp, column, df, factorize_keys(df, column))
+                    except Exception as e:
+                        if name == self.master_key_file:
+                            raise  # Nothing can be merged without the master
+                        self._fail(name, stamp, e, failed)
+                        del key_columns[name]
+                        continue
+                    self._sides[name] = side
+                    reparsed.append(name)
+                frames.append((name, side[2], column))
+                factorized.append(side[3])
+
+            merged_files = list(key_columns)
+            remerged = bool(reparsed) or merged_files != self._merged_files or self.merged is None
+            if remerged:
+                self.merged = join_frames(frames, how=self.how, output_key=self.key_column, factorized=factorized)
+                self._merged_files = merged_files
+                if self.output_path:
+                    # Written next to the output and swapped in, so readers never see a half-written file
+                    write_frame(self.merged, self.output_path)
+            refresh_span.add(rows=len(self.merged))
+
+        report = {'files': merged_files, 'restaged': restaged, 'removed': sorted(removed), 'rescored': rescored,
+                  'reparsed': reparsed, 'skipped': skipped, 'failed': failed, 'held': sorted(hold), 'remerged': remerged,
+                  'rows': len(self.merged), 'output': self.output_path if remerged else None, 'error': None,
+                  'seconds': time.perf_counter() - started}
+        print(f"Refreshed {self.folder_path}: {restaged} restaged, {len(rescored)} rescored, {len(reparsed)} reparsed, "
+              f"{len(report['removed'])} removed; {report['rows']} merged rows in {report['seconds']:.2f}s.")
+        for name, error in failed.items():
+            print(f"  skipped {name}: {error}", file=sys.stderr)
+        return report
+
+
+def watch_folder(folder_path, temp_dir, master_key_file, key_column, output_path=None, interval=DEFAULT_INTERVAL,
+                 stop_event=None, max_refreshes=None, on_update=None, use_inotify=True, **options):
+    # Merge once, then refresh whenever the folder changes until stop_event is set (or after
+    # max_refreshes refreshes). on_update(report) is called after every refresh. options go to
+    # WatchSession (key_columns, how, normalize, files). Returns the session.
+    # A file that fails to load sits out of the merge, and a refresh that fails outright (no
+    # master file, say) is reported; either way watching goes on until stop_event is set.
+    session = WatchSession(folder_path, temp_dir, master_key_file, key_column, output_path, **options)
+    watcher = FolderWatcher(folder_path, interval, use_inotify=use_inotify)
+    stop_event = stop_event or threading.Event()
+    refreshes = 0
+    try:
+        watcher.poll()
+        while True:
+            try:
+                report = session.refresh(hold=watcher.pending)
+            except Exception as e:
+                report = {'error': f"{type(e).__name__}: {e}", 'output': None}
+                print(f"Refresh of {folder_path} failed: {report['error']}", file=sys.stderr)
+            refreshes += 1
+            if on_update:
+                on_update(report)
+            if max_refreshes is not None and refreshes >= max_refreshes:
+                break
+            while not stop_event.is_set():
+                watcher.wait(stop_event)
+                if any(watcher.poll()):
+                    break
+            if stop_event.is_set():
+                break
+    finally:
+        watcher.close()
+    return session
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a merged output up to date as files in a folder change.")
+    parser.add_argument('folder')
+    parser.add_argument('master_file')
+    parser.add_argument('key_column')
+    parser.add_argument('--output', required=True, help=".csv, .xlsx or .parquet, replaced after every refresh")
+    parser.add_argument('--key', action='append', default=[], metavar='FILE=COLUMN', help="pin a file's key column (repeatable)")
+    parser.add_argument('--how', choices=('inner', 'left', 'outer'), default='inner')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument('--temp-dir', default=os.path.join(os.getcwd(), "temp_files"))
+    parser.add_argument('--no-inotify', action='store_true')
+    args = parser.parse_args(argv)
+
+    key_columns = {}
+    for pin in args.key:
+        filename, _, column = pin.partition('=')
+        if not column:
+            parser.error(f"--key expects FILE=COLUMN, got {pin}")
+        key_columns[filename] = column
+
+    try:
+        watch_folder(args.folder, args.temp_dir, args.master_file, args.key_column, os.path.abspath(args.output),
+                     interval=args.interval, use_inotify=not args.no_inotify, key_columns=key_columns, how=args.how)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+import datetime
+import os
+import re
+import shutil
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from compact import STRING_DTYPE
+from tracing import span
+
+# Streaming output. A writer takes the merged data a batch at a time (the external join's
+# partitions, or slices of a frame) and never holds more than one batch, so memory while writing
+# does not grow with the output:
+#
+#   CsvWriter      appends each batch to one CSV file
+#   ParquetWriter  one file, or a directory of part files of at most rows_per_file rows
+#   ExcelWriter    streams sheet XML into the workbook as batches arrive; sheets past Excel's
+#                  row limit continue on "<sheet>_2", "<sheet>_3", ...
+#
+# Every writer works on a ".partial" path and moves it into place on close(), so a failed or
+# interrupted write never leaves a truncated output behind. close() returns the rows and bytes
+# written and the throughput:
+#
+#   with open_writer("merged.xlsx") as writer:
+#       for batch in iter_external_merge(...):
+#           writer.write(batch)
+#   writer.stats  ->  {'rows': ..., 'bytes': ..., 'seconds': ..., 'rows_per_second': ...}
+
+EXCEL_MAX_ROWS = 1_048_576  # header included
+CHUNK_ROWS = 100_000  # rows handed to the underlying writer at a time
+EXCEL_CHUNK_CELLS = 200_000  # cells turned into sheet XML at a time
+FORMATS = ('csv', 'xlsx', 'parquet')
+_STRING = STRING_DTYPE if STRING_DTYPE is not None else 'string'
+
+
+class OutputWriter:
+    format = None
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.columns = None
+        self.stats = None
+        self._partial = f"{path}.partial"
+        self._seconds = 0.0
+        self._closed = False
+
+    def write(self, df):
+        # Append a batch; later batches are aligned to the first batch's columns
+        if self._closed:
+            raise ValueError(f"Writer for {self.path} is closed")
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            missing = set(self.columns) - set(df.columns)
+            if missing:
+                raise ValueError(f"Batch is missing columns: {', '.join(map(str, sorted(missing, key=str)))}")
+            df = df[self.columns]
+        started = time.perf_counter()
+        with span('write', file=os.path.basename(self.path), rows=len(df), format=self.format):
+            for start in range(0, len(df), CHUNK_ROWS):
+                self._write(df.iloc[start:start + CHUNK_ROWS])
+        self._seconds += time.perf_counter() - started
+        self.rows += len(df)
+
+    def close(self):
+        if self._closed:
+            return self.stats
+        started = time.perf_counter()
+        with span('write_close', file=os.path.basename(self.path), format=self.format):
+            self._finish()
+            _remove_path(self.path)
+            os.replace(self._partial, self.path)
+        self._seconds += time.perf_counter() - started
+        self._closed = True
+        written = _path_size(self.path)
+        self.stats = {'path': self.path, 'format': self.format, 'rows': self.rows, 'bytes': written, 'seconds': self._seconds,
+                      'rows_per_second': self.rows / self._seconds if self._seconds else None,
+                      'bytes_per_second': written / self._seconds if self._seconds else None}
+        return self.stats
+
+    def abort(self):
+        # Drop whatever was written; the previous output, if any, stays
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._finish()
+        except Exception:
+            pass
+        _remove_path(self._partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _write(self, df):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+
+class CsvWriter(OutputWriter):
+    format = 'csv'
+
+    def __init__(self, path, encoding='utf-8'):
+        super().__init__(path)
+        self._file = open(self._partial, 'w', encoding=encoding, newline='')
+
+    def _write(self, df):
+        df.to_csv(self._file, index=False, header=self._file.tell() == 0)
+
+    def _finish(self):
+        if self.columns is None:
+            self.columns = []
+        if not self._file.closed:
+            if self._file.tell() == 0 and self.columns:
+                pd.DataFrame(columns=self.columns).to_csv(self._file, index=False)
+            self._file.close()
+
+
+class ParquetWriter(OutputWriter):
+    # rows_per_file=None writes one file; otherwise path is a directory of part-00000.parquet,
+    # part-00001.parquet, ... which pd.read_parquet(path) reads back as one frame.
+    # The schema is widened when a batch needs it (int64 to double once a batch has gaps, an
+    # all-missing column to the type it later shows); what was written already is rewritten
+    # with the wider schema, one row group at a time.
+    format = 'parquet'
+
+    def __init__(self, path, rows_per_file=None, compression='snappy'):
+        super().__init__(path)
+        import pyarrow  # noqa: F401  (Parquet output needs pyarrow)
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.schema = None
+        self._writer = None
+        self._part = 0
+        self._part_rows = 0
+        self._paths = []  # every file written so far, the open one last
+        if rows_per_file is not None:
+            os.makedirs(self._partial, exist_ok=True)
+
+    def _open_part(self):
+        import pyarrow.parquet as pq
+        if self.rows_per_file is None:
+            part_path = self._partial
+        else:
+            part_path = os.path.join(self._partial, f"part-{self._part:05d}.parquet")
+            self._part += 1
+        self._writer = pq.ParquetWriter(part_path, self.schema, compression=self.compression)
+        self._paths.append(part_path)
+        self._part_rows = 0
+
+    def _widen(self, schema):
+        # Rewrite every file written so far with the wider schema; the open one stays open
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.schema = schema
+        reopen = self._writer is not None
+        if reopen:
+            self._writer.close()
+            self._writer = None
+        for i, path in enumerate(self._paths):
+            old_path = path + ".widen"
+            os.replace(path, old_path)
+            writer = pq.ParquetWriter(path, schema, compression=self.compression)
+            with pq.ParquetFile(old_path) as source:
+                for batch in source.iter_batches():
+                    writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+            os.remove(old_path)
+            if reopen and i == len(self._paths) - 1:
+                self._writer = writer
+            else:
+                writer.close()
+
+    def _write(self, df):
+        import pyarrow as pa
+        batch_schema = pa.Schema.from_pandas(df, preserve_index=False)
+        if self.schema is None:
+            self.schema = batch_schema
+        elif not batch_schema.equals(self.schema):
+            try:
+                schema = pa.unify_schemas([self.schema, batch_schema], promote_options='permissive')
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(f"Batch does not match the schema of the earlier batches: {e}")
+            if not schema.equals(self.schema):
+                self._widen(schema)
+        while len(df):
+            if self._writer is None:
+                self._open_part()
+            room = len(df) if self.rows_per_file is None else self.rows_per_file - self._part_rows
+            piece, df = df.iloc[:room], df.iloc[room:]
+            try:
+                table = pa.Table.from_pandas(piece, schema=self.schema, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(f"Batch does not match the schema of the earlier batches: {e}")
+            self._writer.write_table(table)
+            self._part_rows += len(piece)
+            if self.rows_per_file is not None and self._part_rows >= self.rows_per_file:
+                self._writer.close()
+                self._writer = None
+
+    def _finish(self):
+        if self._writer is None and self.rows == 0 and self.rows_per_file is None:
+            # Nothing was written: an empty file with the columns, as to_parquet would write
+            pd.DataFrame(columns=self.columns or []).to_parquet(self._partial, index=False)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ExcelWriter(OutputWriter):
+    # Writes the workbook's XML directly into a streamed zip entry: every batch is turned into
+    # sheet rows with vectorized string operations and compressed on the way out, so neither
+    # the rows nor per-cell objects pile up (openpyxl's write-only mode still builds a Python
+    # object per cell, which makes it slower than to_excel). Strings are stored inline, dates
+    # as Excel serial numbers with a date format, missing values as absent cells and infinities
+    # as the text "inf" / "-inf", like to_excel's default inf_rep.
+    format = 'xlsx'
+
+    def __init__(self, path, sheet_name='Sheet1', max_rows=EXCEL_MAX_ROWS, compresslevel=1):
+        super().__init__(path)
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self.sheets = []
+        self._zip = zipfile.ZipFile(self._partial, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._sheet = None
+        self._sheet_rows = 0
+
+    def _new_sheet(self):
+        self._end_sheet()
+        name = self.sheet_name if not self.sheets else f"{self.sheet_name}_{len(self.sheets) + 1}"
+        self.sheets.append(name)
+        self._sheet = self._zip.open(f"xl/worksheets/sheet{len(self.sheets)}.xml", 'w', force_zip64=True)
+        self._sheet.write(_SHEET_START.encode())
+        self._letters = [_column_letter(i) for i in range(len(self.columns))]
+        header = "".join(f'<c r="{letter}1" t="inlineStr"><is><t xml:space="preserve">{_escape(str(column))}</t></is></c>'
+                         for letter, column in zip(self._letters, self.columns))
+        self._sheet.write(f'<row r="1">{header}</row>'.encode())
+        self._sheet_rows = 1
+
+    def _end_sheet(self):
+        if self._sheet is not None:
+            self._sheet.write(_SHEET_END.encode())
+            self._sheet.close()
+            self._sheet = None
+
+    def _write(self, df):
+        while len(df):
+            if self._sheet is None or self._sheet_rows >= self.max_rows:
+                self._new_sheet()
+            # A piece's XML is built in memory, so pieces are capped by cells, not rows
+            room = min(self.max_rows - self._sheet_rows, max(1, EXCEL_CHUNK_CELLS // max(1, len(self.columns))))
+            piece, df = df.iloc[:room], df.iloc[room:]
+            self._sheet.write(_rows_xml(piece, self._sheet_rows + 1, self._letters).encode())
+            self._sheet_rows += len(piece)
+
+    def _finish(self):
+        if self._zip.fp is None:
+            return
+        if not self.sheets:
+            if self.columns is None:
+                self.columns = []
+            self._new_sheet()  # An empty result still gets its header row
+        self._end_sheet()
+        sheets = "".join(f'<sheet name="{_escape(name)}" sheetId="{i}" r:id="rId{i}"/>' for i, name in enumerate(self.sheets, 1))
+        relationships = "".join(f'<Relationship Id="rId{i}" Type="{_RELATIONSHIP}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                                for i in range(1, len(self.sheets) + 1))
+        overrides = "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{_CONTENT_TYPE}.worksheet+xml"/>'
+                            for i in range(1, len(self.sheets) + 1))
+        styles_id = len(self.sheets) + 1
+        self._zip.writestr("[Content_Types].xml", _CONTENT_TYPES.format(overrides=overrides))
+        self._zip.writestr("_rels/.rels", _ROOT_RELS)
+        self._zip.writestr("xl/workbook.xml", _WORKBOOK.format(sheets=sheets))
+        self._zip.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS.format(
+            relationships=relationships + f'<Relationship Id="rId{styles_id}" Type="{_RELATIONSHIP}/styles" Target="styles.xml"/>'))
+        self._zip.writestr("xl/styles.xml", _STYLES)
+        self._zip.close()
+
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_RELATIONSHIP = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+_SHEET_START = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{_MAIN_NS}"><sheetData>'
+_SHEET_END = '</sheetData></worksheet>'
+_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                  '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                  '<Default Extension="xml" ContentType="application/xml"/>'
+                  f'<Override PartName="/xl/workbook.xml" ContentType="{_CONTENT_TYPE}.sheet.main+xml"/>'
+                  f'<Override PartName="/xl/styles.xml" ContentType="{_CONTENT_TYPE}.styles+xml"/>'
+                  '{overrides}</Types>')
+_ROOT_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+              f'<Relationship Id="rId1" Type="{_RELATIONSHIP}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+_WORKBOOK = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             f'<workbook xmlns="{_MAIN_NS}" xmlns:r="{_RELATIONSHIP}"><sheets>{{sheets}}</sheets></workbook>')
+_WORKBOOK_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{relationships}</Relationships>')
+# Style 1 is the date format pandas' to_excel uses
+_STYLES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           f'<styleSheet xmlns="{_MAIN_NS}">'
+           '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd\\ hh:mm:ss"/></numFmts>'
+           '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+           '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+           '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+           '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+           '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+           '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+           '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+           '</styleSheet>')
+_EXCEL_EPOCH = np.datetime64('1899-12-30')
+INF_REP = 'inf'  # what to_excel writes for infinities by default
+_ILLEGAL_XML = r'[\x00-\x08\x0b\x0c\x0e-\x1f]'  # control characters XML cannot hold
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _escape(text):
+    return re.sub(_ILLEGAL_XML, '', text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _text(series):
+    return series.astype(_STRING)
+
+
+def _cells_xml(column, refs):
+    # One "<c>" element per row (empty where the value is missing), as a string Series
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        column = pd.Series(column.array.astype(object), index=column.index)
+        column = column.infer_objects()
+        dtype = column.dtype
+    missing = column.isna().to_numpy()
+
+    if pd.api.types.is_bool_dtype(dtype):
+        values = _text(column.fillna(False).astype(int)) if missing.any() else _text(column.astype(int))
+        cells = '<c r="' + refs + '" t="b"><v>' + values + '</v></c>'
+    elif pd.api.types.is_numeric_dtype(dtype):
+        cells = '<c r="' + refs + '"><v>' + _text(column) + '</v></c>'
+        if pd.api.types.is_float_dtype(dtype):
+            numbers = column.to_numpy(dtype=np.float64, na_value=np.nan)
+            missing = np.isnan(numbers)
+            infinite = np.isinf(numbers)
+            if infinite.any():
+                text = pd.Series(np.where(numbers > 0, INF_REP, '-' + INF_REP), index=column.index, dtype=_STRING)
+                cells = cells.where(~infinite, '<c r="' + refs + '" t="inlineStr"><is><t>' + text + '</t></is></c>')
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        if getattr(dtype, 'tz', None) is not None:
+            raise ValueError("Excel does not support datetimes with timezones; convert them to naive datetimes first")
+        serials = (column.to_numpy(dtype='datetime64[ns]') - _EXCEL_EPOCH) / np.timedelta64(1, 'D')
+        cells = '<c r="' + refs + '" s="1"><v>' + _text(pd.Series(serials, index=column.index)) + '</v></c>'
+    elif pd.api.types.is_timedelta64_dtype(dtype):
+        days = column.to_numpy(dtype='timedelta64[ns]') / np.timedelta64(1, 'D')
+        cells = '<c r="' + refs + '"><v>' + _text(pd.Series(days, index=column.index)) + '</v></c>'
+    elif pd.api.types.is_string_dtype(dtype) and (dtype != object or pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty')):
+        text = _text(column).str.replace(_ILLEGAL_XML, '', regex=True)
+        text = text.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False).str.replace('>', '&gt;', regex=False)
+        cells = '<c r="' + refs + '" t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>'
+    else:
+        # Mixed values (numbers next to text, dates as objects): one value at a time
+        cells = pd.Series([_cell_xml(value, ref) for value, ref in zip(column.tolist(), refs.tolist())],
+                          index=column.index, dtype=_STRING)
+        missing = np.zeros(len(column), dtype=bool)
+
+    if missing.any():
+        cells = cells.where(~missing, '')
+    return cells
+
+
+def _cell_xml(value, ref):
+    if value is None or value is pd.NA or value is pd.NaT:
+        return ''
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, np.number)):
+        if np.isnan(value):
+            return ''
+        if np.isinf(value):
+            return f'<c r="{ref}" t="inlineStr"><is><t>{"" if value > 0 else "-"}{INF_REP}</t></is></c>'
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime.date):
+        serial = (pd.Timestamp(value) - pd.Timestamp(_EXCEL_EPOCH)) / pd.Timedelta(days=1)
+        return f'<c r="{ref}" s="1"><v>{serial}</v></c>'
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{_escape(str(value))}</t></is></c>'
+
+
+def _rows_xml(df, first_row, letters):
+    # The "<row>" elements of a batch starting at sheet row first_row (1-based)
+    numbers = pd.Series(np.arange(first_row, first_row + len(df)), index=df.index).astype(_STRING)
+    rows = '<row r="' + numbers + '">'
+    for letter, (_, column) in zip(letters, df.items()):
+        rows = rows + _cells_xml(column, letter + numbers)
+    rows = rows + '</row>'
+    return "".join(rows.tolist())
+
+
+def _path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def output_format(path, format=None):
+    # The format named, or the one the path's extension implies
+    format = (format or os.path.splitext(path)[1].lstrip('.')).lower()
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported output format: {format or os.path.basename(path)}")
+    return format
+
+
+def open_writer(path, format=None, **options):
+    # The writer for path's format; options go to its constructor (e.g. rows_per_file, sheet_name)
+    format = output_format(path, format)
+    if format == 'csv':
+        return CsvWriter(path, **options)
+    if format == 'parquet':
+        return ParquetWriter(path, **options)
+    return ExcelWriter(path, **options)
+
+
+def write_batches(batches, path, format=None, **options):
+    # Write an iterable of frames to one output and return the writer's stats
+    with open_writer(path, format, **options) as writer:
+        for batch in batches:
+            writer.write(batch)
+    return writer.stats
+
+
+def write_frame(df, path, format=None, **options):
+    # A whole frame through the streaming writer, e.g. in place of to_excel/to_csv
+    return write_batches([df], path, format, **options)